@@ -2,6 +2,8 @@
 Конфигурация приложения
 """
 import os
+from typing import Dict, List
+
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -15,21 +17,141 @@ class Settings(BaseSettings):
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
     openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     openai_vision_model: str = os.getenv("OPENAI_VISION_MODEL", "gpt-4o-mini")
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")  # Альтернативный endpoint (шлюз, локальная заглушка)
+    openai_timeout: float = 60.0  # Таймаут одного запроса к OpenAI, секунды
+    # Пул HTTP-соединений к OpenAI (один на процесс, keep-alive)
+    openai_max_connections: int = 100
+    openai_max_keepalive_connections: int = 20
+    openai_keepalive_expiry: float = 30.0
+    # Лимиты аккаунта OpenAI (0 — без ограничения) и повторы после 429 / сбоев сети
+    openai_rpm: int = 500  # Запросов в минуту
+    openai_tpm: int = 200_000  # Токенов в минуту (вход + выход)
+    openai_max_retries: int = 4
+    openai_backoff_base: float = 1.0  # Первая задержка перед повтором, секунды
+    openai_backoff_max: float = 30.0
+    # Маршрутизация: короткие запросы сначала на дешёвую модель, при неудачной проверке — на основную
+    openai_cheap_model: str = ""  # Пусто — маршрутизация текстов выключена
+    openai_cheap_vision_model: str = ""  # Пусто — маршрутизация изображений выключена
+    router_max_text_tokens: int = 1500  # Запрос анализа текста не длиннее (оценка) — дешёвая модель
+    router_max_image_tokens: int = 1000  # То же для изображений; по умолчанию проходит только VISION_DETAIL=low
+    openai_prices: Dict[str, List[float]] = {}  # Цены моделей, USD за 1M токенов: {"модель": [вход, выход]}
+    # Формат ответа модели: "json_schema" (по схемам Pydantic), "json_object" (JSON mode) или "text"
+    openai_response_format: str = "json_schema"
+    openai_parse_retries: int = 1  # Повторов запроса, если ответ не удалось разобрать даже после починки
+    # Провайдер LLM: "openai" или "stub" (локальная заглушка для нагрузочных тестов)
+    llm_provider: str = "openai"
+    stub_latency_ms: float = 800.0  # Медиана задержки ответа заглушки
+    stub_latency_sigma: float = 0.3  # Разброс задержки (логнормальное распределение, 0 — фиксированная)
+    stub_error_rate: float = 0.0  # Доля ответов 500
+    stub_rate_limit_rate: float = 0.0  # Доля ответов 429
+    stub_retry_after: float = 1.0  # Retry-After в ответах 429, секунды
+    stub_stream_chunks: int = 40  # Чанков в потоковом ответе
+    stub_seed: int = 0
+    
+    # Кэш результатов анализа
+    cache_enabled: bool = True
+    cache_dir: str = ".cache/analysis"
+    cache_ttl_seconds: int = 7 * 24 * 3600  # Неделя
+    cache_memory_items: int = 256  # Записей в LRU в памяти
+    cache_disk_max_mb: int = 200  # Предельный размер кэша на диске
+    
+    # Подготовка изображений для vision-модели
+    vision_detail: str = "high"  # "low" (512px, 85 токенов), "high" или "auto"
+    vision_image_format: str = "jpeg"  # "jpeg" или "webp"
+    vision_image_quality: int = 80
+    screenshot_thumbnail_width: int = 480  # Ширина миниатюры скриншота в ответе
+    # Хранилище скриншотов (отдаются по /screenshots/<sha256>.<ext>)
+    screenshot_store_dir: str = ".cache/screenshots"
+    screenshot_store_max_mb: int = 500  # Больше — удаляются давно не запрашивавшиеся
+    # Загрузки: лимит размера и предобработка планировок
+    upload_max_mb: int = 10  # Тело запроса больше — 413, не дочитывая его
+    upload_max_pixels: int = 50_000_000  # Защита от "декомпрессионных бомб"
+    upload_autocrop: bool = True  # Обрезать однотонные поля
+    upload_grayscale: bool = True  # Переводить в оттенки серого, если цвет не несёт информации
+    image_workers: int = 2  # Процессов для обработки загруженных изображений
+    
+    # Фоновые задачи (/jobs)
+    jobs_workers: int = 4  # Одновременно выполняемых задач
+    jobs_max_queued: int = 100  # Больше — отказ с 503
+    jobs_ttl_seconds: int = 3600  # Сколько хранить результат завершённой задачи
+    
+    # Пакетный парсинг (/parse_batch)
+    batch_max_urls: int = 500
+    batch_parse_concurrency: int = 4  # Одновременных загрузок страниц (HTTP и браузер)
+    batch_llm_concurrency: int = 8  # Одновременных запросов к модели
+    batch_per_host_concurrency: int = 2  # Одновременных запросов к одному сайту
+    batch_per_host_interval: float = 1.0  # Минимальный интервал между запросами к одному сайту, секунды
+    
+    # Анализ страницы: скриншот и текст параллельно, у каждой ветки свой таймаут (0 — без него)
+    page_analysis_image_timeout: float = 90.0
+    page_analysis_text_timeout: float = 90.0
+    # Длинные тексты: анализ по частям (map-reduce)
+    text_max_chars: int = 200_000  # Более длинный текст — ошибка 400
+    text_chunk_threshold_tokens: int = 6000  # Запрос длиннее (оценка) анализируется по частям
+    text_chunk_tokens: int = 3000  # Размер части текста
+    text_chunk_concurrency: int = 4  # Одновременных запросов к модели на один текст
+    text_reduce_max_items: int = 5  # Пунктов в каждом списке итогового анализа
+    # Пакетный анализ текстов (/analyze_text_batch)
+    text_batch_max_texts: int = 100
+    text_batch_max_items: int = 10  # Текстов в одном запросе к модели
+    text_batch_max_input_tokens: int = 6000  # Входных токенов в одном запросе (оценка)
+    text_batch_item_max_tokens: int = 1500  # Более длинные тексты анализируются по одному
+    text_batch_output_tokens: int = 900  # Токенов ответа на один текст в общем запросе
+    text_batch_concurrency: int = 4  # Одновременных запросов к модели из одного пакета
+    
+    # Дедлайн запроса: заголовок X-Request-Timeout или ?timeout=, секунды (0 — без дедлайна)
+    request_timeout_default: float = 60.0  # Для /analyze_text, /analyze_image, /parse_demo и т.п.
+    request_timeout_max: float = 600.0
+    deadline_analysis_reserve: float = 10.0  # Сколько оставить на анализ после парсинга страницы
+    deadline_browser_min: float = 5.0  # Меньше — браузер не запускается, берётся HTTP-версия страницы
+    deadline_vision_min: float = 15.0  # Меньше — скриншот не анализируется, только текст
+    deadline_llm_min: float = 5.0  # Меньше — без необязательных запросов (объединение резюме, эскалация)
+    
+    # Отмена обработки при отключении клиента (браузер закрывается, запрос к модели прерывается)
+    cancel_on_disconnect: bool = True
+    
+    # Метрики (/metrics, заголовок Server-Timing)
+    metrics_enabled: bool = True
     
     # API
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     
     # История
-    history_file: str = "history.json"
+    history_backend: str = "sqlite"  # "sqlite" или "json" (устаревший формат, один процесс)
+    history_file: str = "history.json"  # Хранилище для backend=json, источник импорта для sqlite
+    history_db_file: str = "history.db"
+    history_retention_items: int = 1000  # Сколько записей хранить в базе
+    history_batch_size: int = 50  # Максимум записей в одной транзакции
+    history_flush_interval: float = 0.05  # Сколько ждать накопления пачки, секунды
     max_history_items: int = 10
     
     # Парсер
     parser_timeout: int = 30  # Увеличено для Selenium
     parser_user_agent: str = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    parser_max_text_chars: int = 200_000  # Сколько видимого текста собирать со страницы до отбора
+    # Отбор текста для модели: без меню, шапки, подвала и списков ссылок, в пределах бюджета
+    parser_content_token_budget: int = 1500  # 0 — без ограничения
+    parser_strip_boilerplate: bool = True
+    # Ожидание готовности страницы в браузере
+    parser_ready_max_wait: float = 8.0  # Максимум ожидания после DOMContentLoaded, секунды
+    parser_ready_quiet_ms: int = 300  # Сколько DOM и сеть должны быть неизменны
+    parser_ready_poll_interval: float = 0.1
+    # Быстрый путь без браузера: HTTP-запрос + lxml, Selenium только для JS-страниц и скриншотов
+    parser_http_first: bool = True
+    parser_http_timeout: float = 10.0
+    parser_http_max_connections: int = 20
+    parser_http_max_bytes: int = 5 * 1024 * 1024
+    parser_http_min_text: int = 200  # Меньше символов видимого текста — страница рендерится через JS
     # Путь к Яндекс браузеру (опционально, будет определен автоматически)
     yandex_browser_path: str = os.getenv("YANDEX_BROWSER_PATH", "")
     
+    # Пул браузеров для парсера
+    browser_pool_size: int = 2  # Максимум одновременно запущенных браузеров
+    browser_pool_max_pages: int = 50  # Перезапуск браузера после N страниц
+    browser_pool_lease_timeout: float = 60.0  # Сколько ждать свободный браузер, секунды
+    browser_pool_prewarm: bool = True  # Запускать браузеры при старте приложения
+    
     # Прокси для OpenAI (опционально)
     http_proxy: str = os.getenv("HTTP_PROXY", "")
     https_proxy: str = os.getenv("HTTPS_PROXY", "")
@@ -2,28 +2,75 @@
 Главный модуль FastAPI приложения
 BuildIntel - AI ассистент для анализа маркетинга в строительстве
 """
-import base64
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import uvicorn
-from openai import APIError
 
 from backend.config import settings
+from backend.middleware import BodySizeLimitMiddleware, ServerTimingMiddleware
 from backend.models.schemas import (
     TextAnalysisRequest,
     TextAnalysisResponse,
+    TextBatchRequest,
+    TextBatchResponse,
     ImageAnalysisResponse,
     ParseDemoRequest,
     ParseDemoResponse,
-    ParsedContent,
+    ParseBatchRequest,
     HistoryResponse,
-    CompetitorAnalysis
+    JobSubmitResponse,
+    JobStatusResponse
 )
 from backend.services.openai_service import openai_service
 from backend.services.parser_service import parser_service
 from backend.services.history_service import history_service
+from backend.services.cache_service import analysis_cache
+from backend.services.analysis_service import analysis_service
+from backend.services.job_service import Job, JobQueueFull, job_queue
+from backend.services.image_service import image_service
+from backend.services.screenshot_store import screenshot_store
+from backend.services.batch_service import batch_service
+from backend.services.cancellation import CLIENT_CLOSED_REQUEST, ClientDisconnected, cancellation, run_until_disconnected
+from backend.services.deadline import TIMEOUT_HEADER, deadlines, expires_at, request_timeout, run_with_deadline
+from backend.services.text_batch_service import text_batch_service
+from backend.services.rate_limiter import rate_limiter
+from backend.services.metrics import metrics
+from backend.services.tokens import IMAGE_TOKENS
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка общих ресурсов приложения"""
+    if settings.llm_provider == "stub":
+        print("LLM: используется локальная заглушка (LLM_PROVIDER=stub), запросы в OpenAI не отправляются")
+    if settings.openai_cheap_vision_model and settings.vision_detail != "low" \
+            and settings.router_max_image_tokens < IMAGE_TOKENS["high"]:
+        print(
+            f"Маршрутизация изображений не сработает: при VISION_DETAIL={settings.vision_detail} запрос "
+            f"длиннее ROUTER_MAX_IMAGE_TOKENS={settings.router_max_image_tokens} (нужен VISION_DETAIL=low "
+            f"или порог больше {IMAGE_TOKENS['high']})"
+        )
+    # Заранее запускаем браузеры для парсера и процессы обработки изображений
+    await parser_service.start()
+    image_service.start()
+    await job_queue.start()
+    # Фоновая запись истории (после close() в прошлом запуске приложения)
+    history_service.start()
+    yield
+    await job_queue.stop()
+    await parser_service.shutdown()
+    image_service.shutdown()
+    # Дописываем накопленную историю
+    history_service.close()
+    # Закрываем пул соединений к OpenAI
+    await openai_service.aclose()
 
 
 # Инициализация приложения
@@ -32,7 +79,8 @@ app = FastAPI(
     description="AI ассистент для анализа маркетинга в строительстве: анализ продающих текстов и планировок квартир",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS для работы с фронтендом
@@ -44,6 +92,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Лимит размера тела запроса: большие загрузки отклоняются до чтения в память
+app.add_middleware(BodySizeLimitMiddleware, max_body_bytes=settings.upload_max_mb * 1024 * 1024)
+
+# Время этапов в заголовке Server-Timing и гистограмма длительности запросов
+if settings.metrics_enabled:
+    app.add_middleware(ServerTimingMiddleware)
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    """Клиент отключился, обработка отменена: ответ никто не прочитает"""
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+
+# Разрешённые типы изображений
+ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+
+
+def _check_image_type(file: UploadFile):
+    """Проверить тип загруженного файла"""
+    if file.content_type not in ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(ALLOWED_IMAGE_TYPES)}"
+        )
+
+
+def _check_text_length(text: str):
+    """Проверить длину текста (длинный текст анализируется по частям, но не бесконечный)"""
+    if len(text) > settings.text_max_chars:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком длинный текст: {len(text)} символов, максимум {settings.text_max_chars}"
+        )
+
+
+def _deadline(http_request: Request, default: Optional[float]) -> Optional[float]:
+    """Момент истечения бюджета запроса (X-Request-Timeout или ?timeout=, иначе default секунд)"""
+    try:
+        return expires_at(request_timeout(http_request, default))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный {TIMEOUT_HEADER}: {e}")
+
+
+def _sse_response(events: AsyncIterator[dict], route: str) -> StreamingResponse:
+    """Отдать события анализа как Server-Sent Events (тип события — поле type)"""
+    async def body():
+        try:
+            async for event in events:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except asyncio.CancelledError:
+            # Starlette отменяет потоковый ответ, когда клиент отключается
+            cancellation.record_request(route)
+            raise
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        # Отключаем буферизацию в прокси, иначе события придут одной пачкой в конце
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 # === Эндпоинты ===
 
@@ -54,7 +164,7 @@ async def root():
 
 
 @app.post("/analyze_text", response_model=TextAnalysisResponse)
-async def analyze_text(request: TextAnalysisRequest):
+async def analyze_text(request: TextAnalysisRequest, http_request: Request):
     """
     Анализ продающего текста в строительстве
     
@@ -64,227 +174,245 @@ async def analyze_text(request: TextAnalysisRequest):
     - Уникальные предложения и УТП (выделенные преимущества, конкурентные отличия)
     - Рекомендации по улучшению продающего текста (конкретные советы для строительного маркетинга)
     - Резюме маркетинговой эффективности текста
+    
+    Тексты длиннее одного запроса к модели делятся по абзацам, части анализируются
+    параллельно, а результаты объединяются без повторов.
+    
+    Бюджет времени — заголовок X-Request-Timeout или ?timeout= (секунды, по умолчанию
+    REQUEST_TIMEOUT_DEFAULT); не уложившийся в него анализ возвращает ошибку.
     """
-    try:
-        if not request.text or not isinstance(request.text, str) or not request.text.strip():
-            return TextAnalysisResponse(
-                success=False,
-                error="Текст для анализа не может быть пустым"
-            )
-        analysis = await openai_service.analyze_text(request.text)
-        
-        # Сохраняем в историю
-        history_service.add_entry(
-            request_type="text",
-            request_summary=request.text[:100] + "..." if len(request.text) > 100 else request.text,
-            response_summary=analysis.summary
-        )
-        
-        return TextAnalysisResponse(
-            success=True,
-            analysis=analysis
-        )
-    except APIError as e:
-        # Специальная обработка ошибок OpenAI API
-        error_message = str(e)
-        if "unsupported_country_region_territory" in error_message or "403" in str(e.status_code):
-            error_message = "OpenAI API недоступен в вашем регионе. Используйте VPN или прокси для доступа к API."
-        elif "401" in str(e.status_code) or "invalid_api_key" in error_message.lower():
-            error_message = "Неверный API ключ OpenAI. Проверьте файл .env"
-        elif "429" in str(e.status_code) or "rate_limit" in error_message.lower():
-            error_message = "Превышен лимит запросов к OpenAI API. Попробуйте позже."
-        return TextAnalysisResponse(
-            success=False,
-            error=error_message
-        )
-    except Exception as e:
-        return TextAnalysisResponse(
-            success=False,
-            error=f"Ошибка при анализе: {str(e)}"
+    _check_text_length(request.text)
+    deadline = _deadline(http_request, settings.request_timeout_default)
+    return await run_until_disconnected(
+        http_request, run_with_deadline(deadline, analysis_service.analyze_text(request.text))
+    )
+
+
+@app.post("/analyze_text_batch", response_model=TextBatchResponse)
+async def analyze_text_batch(request: TextBatchRequest, http_request: Request):
+    """
+    Анализ нескольких продающих текстов
+    
+    Короткие тексты анализируются по несколько за один запрос к модели; результаты
+    возвращаются в порядке запроса, по элементу на текст. В stats — сколько
+    запросов и входных токенов сэкономлено по сравнению с анализом по одному.
+    """
+    if len(request.texts) > settings.text_batch_max_texts:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много текстов в пакете: {len(request.texts)}, максимум {settings.text_batch_max_texts}"
         )
+    for text in request.texts:
+        _check_text_length(text)
+    # Пакет может быть долгим: дедлайн — только если клиент задал его явно
+    deadline = _deadline(http_request, None)
+    return await run_until_disconnected(
+        http_request, run_with_deadline(deadline, text_batch_service.analyze(request.texts))
+    )
 
 
 @app.post("/analyze_image", response_model=ImageAnalysisResponse)
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(http_request: Request, file: UploadFile = File(...)):
     """
     Анализ планировки квартиры
     
-    Принимает изображение планировки квартиры и возвращает:
+    Принимает изображение планировки квартиры (до UPLOAD_MAX_MB). Перед анализом изображение
+    поворачивается по EXIF, обрезается по полям, при возможности переводится в оттенки
+    серого и уменьшается до размера модели; отчёт — в поле preprocessing.
+    
+    Возвращает:
     - Описание планировки
     - Анализ удобства планировки (комнаты, санузлы, лифты)
     - Общую оценку удобства планировки (0-10)
     - Сильные и слабые стороны
     - Рекомендации по улучшению
     """
-    # Проверяем тип файла
-    allowed_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(allowed_types)}"
-        )
+    _check_image_type(file)
+    deadline = _deadline(http_request, settings.request_timeout_default)
+    content = await file.read()
+    return await run_until_disconnected(
+        http_request,
+        run_with_deadline(deadline, analysis_service.analyze_image(content, file.content_type, file.filename))
+    )
+
+
+@app.post("/analyze_text/stream")
+async def analyze_text_stream(request: TextAnalysisRequest):
+    """
+    Анализ продающего текста с потоковой выдачей (Server-Sent Events)
     
-    try:
-        # Читаем и кодируем изображение
-        content = await file.read()
-        image_base64 = base64.b64encode(content).decode('utf-8')
-        
-        # Анализируем
-        analysis = await openai_service.analyze_image(
-            image_base64=image_base64,
-            mime_type=file.content_type
-        )
-        
-        # Сохраняем в историю
-        history_service.add_entry(
-            request_type="image",
-            request_summary=f"Изображение: {file.filename}",
-            response_summary=analysis.description[:200] if analysis.description else "Анализ изображения"
-        )
-        
-        return ImageAnalysisResponse(
-            success=True,
-            analysis=analysis
-        )
-    except APIError as e:
-        # Специальная обработка ошибок OpenAI API
-        error_message = str(e)
-        if "unsupported_country_region_territory" in error_message or "403" in str(e.status_code):
-            error_message = "OpenAI API недоступен в вашем регионе. Используйте VPN или прокси для доступа к API."
-        elif "401" in str(e.status_code) or "invalid_api_key" in error_message.lower():
-            error_message = "Неверный API ключ OpenAI. Проверьте файл .env"
-        elif "429" in str(e.status_code) or "rate_limit" in error_message.lower():
-            error_message = "Превышен лимит запросов к OpenAI API. Попробуйте позже."
-        return ImageAnalysisResponse(
-            success=False,
-            error=error_message
-        )
-    except Exception as e:
-        return ImageAnalysisResponse(
-            success=False,
-            error=f"Ошибка при анализе изображения: {str(e)}"
-        )
+    События: delta (фрагмент ответа модели), item (готовый пункт списка, например
+    strengths[0]), field (готовое поле), result (итоговый анализ как в /analyze_text), error.
+    Длинный текст анализируется по частям: delta не приходят, остальные события — после объединения.
+    """
+    _check_text_length(request.text)
+    return _sse_response(analysis_service.stream_text(request.text), "/analyze_text/stream")
+
+
+@app.post("/analyze_image/stream")
+async def analyze_image_stream(file: UploadFile = File(...)):
+    """
+    Анализ планировки с потоковой выдачей (Server-Sent Events)
+    
+    События те же, что у /analyze_text/stream; result содержит анализ как в /analyze_image.
+    """
+    _check_image_type(file)
+    content = await file.read()
+    return _sse_response(
+        analysis_service.stream_image(content, file.content_type, file.filename), "/analyze_image/stream"
+    )
 
 
 @app.post("/parse_demo", response_model=ParseDemoResponse)
-async def parse_demo(request: ParseDemoRequest):
+async def parse_demo(request: ParseDemoRequest, http_request: Request):
     """
-    Парсинг и анализ сайта конкурента через Selenium
+    Парсинг и анализ сайта конкурента
     
-    Принимает URL, открывает в Chrome через Selenium:
-    - Делает скриншот страницы
+    Принимает URL и загружает страницу:
+    - Серверные страницы — быстрым HTTP-запросом, без браузера
+    - JS-приложения и запросы со скриншотом (screenshot=true) — в Chrome через Selenium
     - Извлекает title, h1, первый абзац и весь видимый текст
-    - Передаёт скриншот и текст модели для анализа
+    - Передаёт скриншот (если есть) или текст модели для анализа
+    
+    Если клиент отключится раньше, загрузка страницы и запрос к модели отменяются.
+    
+    Бюджет времени — заголовок X-Request-Timeout или ?timeout= (секунды, по умолчанию
+    REQUEST_TIMEOUT_DEFAULT). Каждый этап получает остаток бюджета; если времени мало,
+    браузер, скриншот или анализ скриншота пропускаются, а ответ помечается partial=true.
     """
-    try:
-        # Проверяем URL
-        if not request.url or not isinstance(request.url, str) or not request.url.strip():
-            return ParseDemoResponse(
-                success=False,
-                error="URL не может быть пустым"
-            )
-        
-        # Парсим страницу через Selenium
-        title, h1, first_paragraph, screenshot_base64, full_text, error = await parser_service.parse_url(request.url.strip())
-        
-        if error:
-            return ParseDemoResponse(
-                success=False,
-                error=error
-            )
-        
-        # Анализируем контент
-        analysis = None
-        
-        # Если есть скриншот, анализируем его как изображение
-        if screenshot_base64:
-            try:
-                image_analysis = await openai_service.analyze_image(
-                    image_base64=screenshot_base64,
-                    mime_type="image/png"
-                )
-                # Конвертируем ImageAnalysis в CompetitorAnalysis для единообразия
-                analysis = CompetitorAnalysis(
-                    strengths=image_analysis.marketing_insights,
-                    weaknesses=[],
-                    unique_offers=[],
-                    recommendations=image_analysis.recommendations,
-                    summary=f"Визуальный анализ страницы. Оценка стиля: {image_analysis.visual_style_score}/10. {image_analysis.description}"
-                )
-            except Exception as e:
-                print(f"Ошибка при анализе скриншота: {e}")
-        
-        # Если нет скриншота или анализ изображения не удался, анализируем текст
-        if not analysis:
-            # Используем весь текст или комбинируем с title/h1/paragraph
-            text_to_analyze = None
-            if full_text and full_text.strip():
-                text_to_analyze = full_text
-            elif title or h1 or first_paragraph:
-                text_to_analyze = f"{title or ''}\n{h1 or ''}\n{first_paragraph or ''}".strip()
-            
-            if text_to_analyze:
-                analysis = await openai_service.analyze_parsed_content(
-                    title=title,
-                    h1=h1,
-                    paragraph=text_to_analyze
-                )
-            else:
-                # Если нет контента для анализа
-                analysis = CompetitorAnalysis(
-                    summary="Не удалось извлечь контент для анализа"
-                )
-        
-        parsed_content = ParsedContent(
-            url=request.url,
-            title=title,
-            h1=h1,
-            first_paragraph=first_paragraph,
-            screenshot_base64=screenshot_base64,
-            full_text=full_text[:1000] if (full_text and isinstance(full_text, str)) else None,  # Ограничиваем для JSON
-            analysis=analysis
+    deadline = _deadline(http_request, settings.request_timeout_default)
+    return await run_until_disconnected(
+        http_request, run_with_deadline(deadline, analysis_service.parse_demo(request))
+    )
+
+
+@app.post("/parse_batch")
+async def parse_batch(request: ParseBatchRequest):
+    """
+    Пакетный парсинг и анализ списка URL
+    
+    Отвечает потоком NDJSON: по строке на каждый URL по мере готовности
+    (type=result, index — позиция URL в запросе), последней строкой — сводка (type=summary).
+    Ошибка на отдельном URL приходит как success=false и не прерывает пакет.
+    Загрузка страниц, запросы к модели и запросы к одному сайту ограничены отдельно (BATCH_*).
+    """
+    if len(request.urls) > settings.batch_max_urls:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много URL в пакете: {len(request.urls)}, максимум {settings.batch_max_urls}"
         )
-        
-        # Сохраняем в историю
+
+    async def body():
         try:
-            history_service.add_entry(
-                request_type="parse",
-                request_summary=f"URL: {request.url or 'N/A'}",
-                response_summary=f"Title: {title or 'N/A'}" if title else "N/A"
-            )
-        except Exception as e:
-            print(f"Ошибка при сохранении в историю: {e}")
-        
-        return ParseDemoResponse(
-            success=True,
-            data=parsed_content
-        )
-    except APIError as e:
-        # Специальная обработка ошибок OpenAI API
-        error_message = str(e)
-        if "unsupported_country_region_territory" in error_message or "403" in str(e.status_code):
-            error_message = "OpenAI API недоступен в вашем регионе. Используйте VPN или прокси для доступа к API."
-        elif "401" in str(e.status_code) or "invalid_api_key" in error_message.lower():
-            error_message = "Неверный API ключ OpenAI. Проверьте файл .env"
-        elif "429" in str(e.status_code) or "rate_limit" in error_message.lower():
-            error_message = "Превышен лимит запросов к OpenAI API. Попробуйте позже."
-        return ParseDemoResponse(
-            success=False,
-            error=error_message
-        )
-    except Exception as e:
-        return ParseDemoResponse(
-            success=False,
-            error=f"Ошибка при парсинге: {str(e)}"
+            async for item in batch_service.run(request):
+                yield item.model_dump_json() + "\n"
+        except asyncio.CancelledError:
+            cancellation.record_request("/parse_batch")
+            raise
+
+    return StreamingResponse(
+        body(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/screenshots/{name}")
+async def get_screenshot(name: str, request: Request):
+    """
+    Скриншот из хранилища по имени <sha256>.<ext>
+    
+    Содержимое по адресу никогда не меняется, поэтому ответ кэшируется навсегда (immutable);
+    повторный запрос с If-None-Match получает 304.
+    """
+    path = await screenshot_store.open(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Скриншот не найден или уже удалён")
+
+    etag = screenshot_store.etag(name)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=screenshot_store.mime_type(name), headers=headers)
+
+
+# === Фоновые задачи ===
+
+def _submit_job(kind: str, runner) -> JSONResponse:
+    """Поставить задачу в очередь; при переполнении — 503 с Retry-After"""
+    try:
+        job = job_queue.submit(kind, runner)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    response = JobSubmitResponse(job_id=job.id, status=job.status, status_url=f"/jobs/{job.id}")
+    return JSONResponse(status_code=202, content=response.model_dump())
+
+
+@app.post("/jobs/parse", response_model=JobSubmitResponse, status_code=202)
+async def submit_parse_job(request: ParseDemoRequest, http_request: Request):
+    """
+    Парсинг и анализ сайта в фоне
+    
+    Сразу возвращает id задачи; результат (как у /parse_demo) — через GET /jobs/{job_id}.
+    Если очередь заполнена, возвращает 503. С X-Request-Timeout бюджет отсчитывается
+    от постановки в очередь: клиент получит частичный результат, а не перестанет ждать.
+    """
+    deadline = _deadline(http_request, None)
+    return _submit_job(
+        "parse", lambda on_stage: run_with_deadline(deadline, analysis_service.parse_demo(request, on_stage))
+    )
+
+
+@app.post("/jobs/analyze_image", response_model=JobSubmitResponse, status_code=202)
+async def submit_image_job(http_request: Request, file: UploadFile = File(...)):
+    """
+    Анализ планировки в фоне
+    
+    Сразу возвращает id задачи; результат (как у /analyze_image) — через GET /jobs/{job_id}.
+    Если очередь заполнена, возвращает 503.
+    """
+    _check_image_type(file)
+    deadline = _deadline(http_request, None)
+    content = await file.read()
+    content_type, filename = file.content_type, file.filename
+    return _submit_job(
+        "image",
+        lambda on_stage: run_with_deadline(
+            deadline, analysis_service.analyze_image(content, content_type, filename, on_stage)
         )
+    )
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """
+    Статус фоновой задачи: очередь, этап выполнения, результат или ошибка
+    """
+    job: Optional[Job] = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена или её результат уже удалён")
+    return JobStatusResponse(
+        job_id=job.id,
+        kind=job.kind,
+        status=job.status,
+        stage=job.stage,
+        queue_position=job_queue.queue_position(job),
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        result=job.result,
+        error=job.error
+    )
 
 
 @app.get("/history", response_model=HistoryResponse)
-async def get_history():
+def get_history(request_type: Optional[str] = None):
     """
     Получить историю последних 10 запросов
+    
+    Можно отфильтровать по типу запроса: text, image, parse
     """
-    items = history_service.get_history()
+    items = history_service.get_history(request_type)
     return HistoryResponse(
         items=items,
         total=len(items)
@@ -292,7 +420,7 @@ async def get_history():
 
 
 @app.delete("/history")
-async def clear_history():
+def clear_history():
     """
     Очистить историю запросов
     """
@@ -300,6 +428,58 @@ async def clear_history():
     return {"success": True, "message": "История очищена"}
 
 
+@app.get("/stats")
+async def get_stats():
+    """
+    Статистика работы сервиса (кэш анализов, пул браузеров, очередь задач, подготовка изображений)
+    """
+    return _collect_stats()
+
+
+def _collect_stats() -> dict:
+    return {
+        "cache": analysis_cache.stats(),
+        "browser_pool": parser_service.pool.stats(),
+        "jobs": job_queue.stats(),
+        "images": image_service.stats(),
+        "screenshots": screenshot_store.stats(),
+        "batch": batch_service.stats(),
+        "text_batch": text_batch_service.stats(),
+        "openai_limiter": rate_limiter.stats(),
+        "llm_json": openai_service.json_stats(),
+        "model_router": openai_service.router.stats(),
+        "cancellation": cancellation.stats(),
+        "deadline": deadlines.stats(),
+        "coalescing": {
+            "parse": parser_service.inflight.stats(),
+            "analysis": openai_service.inflight.stats()
+        }
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Метрики в формате Prometheus: гистограммы этапов и запросов, токены OpenAI,
+    а также все числовые значения из /stats
+    """
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Метрики отключены (METRICS_ENABLED=false)")
+    return Response(
+        content=metrics.render(gauges=_collect_stats()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.delete("/cache")
+async def clear_cache():
+    """
+    Очистить кэш результатов анализа
+    """
+    await analysis_cache.clear()
+    return {"success": True, "message": "Кэш очищен"}
+
+
 @app.get("/health")
 async def health_check():
     """Проверка работоспособности сервиса"""
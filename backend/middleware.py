@@ -0,0 +1,142 @@
+"""
+ASGI middleware приложения
+"""
+import json
+import time
+
+from fastapi import HTTPException
+from starlette.routing import Match
+
+from backend.services.metrics import http_request_duration, request_timings
+
+
+class BodySizeLimitMiddleware:
+    """
+    Ограничение размера тела запроса
+
+    Запрос с Content-Length больше лимита отклоняется с 413 сразу, до чтения тела.
+    Без Content-Length (chunked) тело считается по мере чтения и обрывается,
+    как только превысит лимит, — целиком в память оно не попадает.
+    """
+
+    def __init__(self, app, max_body_bytes: int):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_body_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None:
+            try:
+                too_large = int(content_length) > self.max_body_bytes
+            except ValueError:
+                too_large = False
+            if too_large:
+                await self._reject(send)
+                return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # HTTPException проходит через разбор тела FastAPI и превращается в ответ 413
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            if e.status_code != 413 or response_started:
+                raise
+            await self._reject(send)
+
+    def _detail(self) -> str:
+        return f"Слишком большой запрос. Максимальный размер: {self.max_body_bytes // (1024 * 1024)} МБ"
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": self._detail()}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class ServerTimingMiddleware:
+    """
+    Заголовок Server-Timing с этапами запроса и гистограмма длительности запросов
+
+    Этапы собирает metrics.span() через контекст запроса; одноимённые этапы
+    суммируются. В заголовок попадает то, что завершилось до начала ответа
+    (для потоковых ответов — этапы до первого байта).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def timing_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = self._header(timings, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timing_send)
+        finally:
+            request_timings.reset(token)
+            http_request_duration.observe(
+                time.perf_counter() - started, scope["method"], self._route(scope), str(status)
+            )
+
+    @staticmethod
+    def _header(timings, total: float) -> str:
+        durations = {}
+        for stage, elapsed in timings:
+            durations[stage] = durations.get(stage, 0.0) + elapsed
+        parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in durations.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    @staticmethod
+    def _route(scope) -> str:
+        """Шаблон пути (/jobs/{job_id}), чтобы id не раздували число рядов метрики"""
+        app = scope.get("app")
+        for route in getattr(app, "routes", []):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", scope["path"])
+        return "unmatched"
@@ -2,7 +2,7 @@
 Pydantic схемы для API
 """
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Optional, List
 from pydantic import BaseModel, Field
 
 
@@ -13,9 +13,23 @@ class TextAnalysisRequest(BaseModel):
     text: str = Field(..., min_length=10, description="Текст для анализа")
 
 
+class TextBatchRequest(BaseModel):
+    """Запрос на анализ нескольких текстов"""
+    texts: List[str] = Field(..., min_length=1, description="Тексты для анализа")
+
+
 class ParseDemoRequest(BaseModel):
     """Запрос на парсинг URL"""
     url: str = Field(..., description="URL для парсинга")
+    screenshot: bool = Field(False, description="Сделать скриншот страницы (всегда через браузер)")
+    full_screenshot: bool = Field(False, description="Вернуть скриншот в исходном разрешении (PNG), а не только миниатюру")
+
+
+class ParseBatchRequest(BaseModel):
+    """Запрос на пакетный парсинг списка URL"""
+    urls: List[str] = Field(..., min_length=1, description="URL для парсинга")
+    screenshot: bool = Field(False, description="Скриншоты страниц (всегда через браузер)")
+    full_screenshot: bool = Field(False, description="Сохранять скриншоты в исходном разрешении")
 
 
 # === Ответы ===
@@ -38,15 +52,81 @@ class ImageAnalysis(BaseModel):
     recommendations: List[str] = Field(default_factory=list, description="Сильные и слабые стороны, рекомендации по улучшению")
 
 
+class ImagePrepReport(BaseModel):
+    """Отчёт о подготовке изображения для модели"""
+    original_bytes: int
+    original_width: int
+    original_height: int
+    prepared_bytes: int
+    prepared_width: int
+    prepared_height: int
+    format: str  # "jpeg", "webp" или исходный формат, если перекодирование не уменьшило файл
+    detail: str  # "low", "high", "auto"
+    thumbnail_bytes: Optional[int] = None
+    steps: List[str] = Field(default_factory=list)  # orientation, autocrop, grayscale, resize, reencode | original
+    bytes_saved: int
+    original_tokens: int  # Оценка токенов за исходное изображение
+    prepared_tokens: int  # Оценка токенов за подготовленное изображение
+    tokens_saved: int
+    processing_ms: Optional[float] = None  # Время самой обработки (для загрузок — в процессе пула)
+    elapsed_ms: float
+
+
+class ContentReport(BaseModel):
+    """Отбор текста страницы для модели: сколько токенов отправлено из всего видимого текста"""
+    raw_chars: int
+    raw_tokens: int  # Оценка токенов всего видимого текста страницы
+    blocks: int  # Блоков текста на странице
+    blocks_boilerplate: int  # Меню, шапка, подвал, боковые колонки, cookie-баннеры
+    blocks_links: int  # Блоки, состоящие в основном из ссылок
+    blocks_duplicate: int  # Повторы уже встреченных блоков
+    blocks_selected: int
+    sent_chars: int
+    sent_tokens: int  # Оценка токенов текста, передаваемого модели
+    token_budget: int  # 0 — без ограничения
+    tokens_saved: int
+    truncated: bool = False  # Самый ценный блок не поместился в бюджет целиком
+
+
+class ImageRef(BaseModel):
+    """Ссылка на изображение в хранилище (GET по url, кэшируется навсегда)"""
+    url: str
+    width: int
+    height: int
+    bytes: int
+    mime_type: str
+
+
+class AnalysisBranch(BaseModel):
+    """Ветка анализа страницы: скриншот (image) или текст (text)"""
+    branch: str
+    success: bool
+    latency_ms: float
+    error: Optional[str] = None
+
+
 class ParsedContent(BaseModel):
     """Результат парсинга страницы"""
     url: str
     title: Optional[str] = None
     h1: Optional[str] = None
     first_paragraph: Optional[str] = None
-    screenshot_base64: Optional[str] = None  # Base64 скриншота страницы
-    full_text: Optional[str] = None  # Весь видимый текст страницы
+    screenshot_image: Optional[ImageRef] = None  # PNG в исходном разрешении (только при full_screenshot)
+    screenshot_thumbnail: Optional[ImageRef] = None  # JPEG-миниатюра скриншота
+    # Base64 вместо ссылок — только если хранилище скриншотов недоступно
+    screenshot_base64: Optional[str] = None
+    screenshot_thumbnail_base64: Optional[str] = None
+    screenshot_report: Optional[ImagePrepReport] = None  # Подготовка скриншота для модели
+    full_text: Optional[str] = None  # Текст страницы, переданный модели (без меню, подвала и т.п.)
+    content_report: Optional[ContentReport] = None  # Отбор текста для модели
+    meta_description: Optional[str] = None  # <meta name="description">
+    json_ld: List[Any] = Field(default_factory=list)  # Структурированные данные (JSON-LD)
+    fetch_method: Optional[str] = None  # Как получена страница: "http" или "selenium"
     analysis: Optional[CompetitorAnalysis] = None
+    analysis_branches: List[AnalysisBranch] = Field(default_factory=list)  # Ветки анализа и их задержка
+    # Частичный результат: не хватило бюджета времени запроса (X-Request-Timeout)
+    partial: bool = False
+    skipped: List[str] = Field(default_factory=list)  # browser, page_load, screenshot, vision, analysis
     error: Optional[str] = None
 
 
@@ -57,10 +137,42 @@ class TextAnalysisResponse(BaseModel):
     error: Optional[str] = None
 
 
+class TextBatchItem(BaseModel):
+    """Результат анализа одного текста из пакета"""
+    index: int  # Позиция текста в запросе
+    success: bool
+    analysis: Optional[CompetitorAnalysis] = None
+    mode: Optional[str] = None  # "cache", "batched" (в общем запросе) или "single" (отдельным запросом)
+    error: Optional[str] = None
+
+
+class TextBatchStats(BaseModel):
+    """Экономия от упаковки текстов в общие запросы"""
+    texts: int
+    cached: int  # Взято из кэша (в том числе повторы внутри пакета)
+    calls: int  # Сделано запросов к модели
+    calls_single: int  # Понадобилось бы запросов по одному тексту
+    calls_saved: int
+    fallback_items: int  # Тексты, переспрошенные по одному из-за некорректного ответа
+    prompt_tokens: int  # Оценка входных токенов сделанных запросов
+    prompt_tokens_single: int  # Оценка входных токенов при запросах по одному тексту
+    tokens_saved: int
+    elapsed_ms: float
+
+
+class TextBatchResponse(BaseModel):
+    """Ответ на анализ нескольких текстов"""
+    success: bool
+    items: List[TextBatchItem] = Field(default_factory=list)
+    stats: Optional[TextBatchStats] = None
+    error: Optional[str] = None
+
+
 class ImageAnalysisResponse(BaseModel):
     """Ответ на анализ изображения"""
     success: bool
     analysis: Optional[ImageAnalysis] = None
+    preprocessing: Optional[ImagePrepReport] = None  # Что сделано с изображением перед анализом
     error: Optional[str] = None
 
 
@@ -71,6 +183,69 @@ class ParseDemoResponse(BaseModel):
     error: Optional[str] = None
 
 
+# === Пакетный парсинг (строки NDJSON) ===
+
+class ParseBatchResult(BaseModel):
+    """Результат по одному URL из пакета"""
+    type: str = "result"
+    index: int  # Позиция URL в запросе (результаты приходят по мере готовности)
+    url: str
+    success: bool
+    data: Optional[ParsedContent] = None
+    error: Optional[str] = None
+    elapsed_ms: float
+
+
+class ParseBatchSummary(BaseModel):
+    """Итог пакета (последняя строка ответа)"""
+    type: str = "summary"
+    total: int
+    succeeded: int
+    failed: int
+    elapsed_ms: float
+
+
+# === Фоновые задачи ===
+
+class JobSubmitResponse(BaseModel):
+    """Ответ на постановку задачи в очередь"""
+    job_id: str
+    status: str
+    status_url: str
+
+
+class JobStatusResponse(BaseModel):
+    """Состояние фоновой задачи"""
+    job_id: str
+    kind: str  # "parse", "image"
+    status: str  # "queued", "running", "done", "failed"
+    stage: Optional[str] = None  # Текущий этап: "parsing", "preparing_image", "analyzing"
+    queue_position: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[dict] = None  # ParseDemoResponse / ImageAnalysisResponse
+    error: Optional[str] = None
+
+
+# === Внутренние модели ===
+
+class ParsedPage(BaseModel):
+    """Извлечённый контент страницы (результат ParserService.parse_url)"""
+    url: str
+    title: Optional[str] = None
+    h1: Optional[str] = None
+    first_paragraph: Optional[str] = None
+    screenshot_png: Optional[bytes] = None  # Скриншот в исходном разрешении
+    full_text: Optional[str] = None  # Отобранный текст в пределах бюджета токенов
+    content_report: Optional[ContentReport] = None
+    meta_description: Optional[str] = None
+    json_ld: List[Any] = Field(default_factory=list)  # Блоки структурированных данных schema.org
+    fetch_method: str = "selenium"  # "http" — быстрый путь без браузера, "selenium" — через Chrome
+    skipped: List[str] = Field(default_factory=list)  # Шаги, пропущенные из-за дедлайна запроса
+    error: Optional[str] = None
+
+
 # === История ===
 
 class HistoryItem(BaseModel):
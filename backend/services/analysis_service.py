@@ -0,0 +1,430 @@
+"""
+Сценарии анализа: текст, изображение, парсинг сайта
+
+Общие для синхронных эндпоинтов и фоновых задач (/jobs): парсинг, вызовы модели,
+запись в историю и преобразование ошибок в ответ API.
+"""
+import asyncio
+import base64
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from openai import APIError
+
+from backend.config import settings
+from backend.models.schemas import (
+    AnalysisBranch,
+    CompetitorAnalysis,
+    ImageAnalysis,
+    ImageAnalysisResponse,
+    ParseDemoRequest,
+    ParseDemoResponse,
+    ParsedContent,
+    ParsedPage,
+    TextAnalysisResponse
+)
+from backend.services import deadline
+from backend.services.deadline import DeadlineExceeded, deadlines
+from backend.services.history_service import history_service
+from backend.services.image_service import ImageDecodeError, PreparedScreenshot, image_service, image_size
+from backend.services.metrics import span
+from backend.services.openai_service import describe_api_error, openai_service
+from backend.services.parser_service import parser_service
+from backend.services.screenshot_store import screenshot_store
+from backend.services.text_chunking import merge_points
+
+
+# Колбэк смены этапа обработки (для статуса фоновой задачи)
+StageCallback = Optional[Callable[[str], None]]
+
+
+def _set_stage(on_stage: StageCallback, stage: str):
+    if on_stage:
+        on_stage(stage)
+
+
+class AnalysisService:
+    """Сценарии анализа поверх парсера, OpenAI и истории"""
+
+    async def analyze_text(self, text: str, on_stage: StageCallback = None) -> TextAnalysisResponse:
+        """Анализ продающего текста"""
+        try:
+            if not text or not isinstance(text, str) or not text.strip():
+                return TextAnalysisResponse(
+                    success=False,
+                    error="Текст для анализа не может быть пустым"
+                )
+            _set_stage(on_stage, "analyzing")
+            analysis = await openai_service.analyze_text(text)
+
+            # Сохраняем в историю
+            history_service.add_entry(
+                request_type="text",
+                request_summary=text[:100] + "..." if len(text) > 100 else text,
+                response_summary=analysis.summary
+            )
+
+            return TextAnalysisResponse(
+                success=True,
+                analysis=analysis
+            )
+        except APIError as e:
+            return TextAnalysisResponse(
+                success=False,
+                error=describe_api_error(e)
+            )
+        except Exception as e:
+            return TextAnalysisResponse(
+                success=False,
+                error=f"Ошибка при анализе: {str(e)}"
+            )
+
+    async def analyze_image(
+        self,
+        content: bytes,
+        content_type: str,
+        filename: Optional[str],
+        on_stage: StageCallback = None
+    ) -> ImageAnalysisResponse:
+        """Анализ планировки квартиры по содержимому загруженного файла"""
+        try:
+            # Обрезка полей, поворот, уменьшение и перекодирование — в пуле процессов
+            _set_stage(on_stage, "preparing_image")
+            prepared = await image_service.prepare_upload(content)
+
+            _set_stage(on_stage, "analyzing")
+            analysis = await openai_service.analyze_image(
+                image_base64=prepared.base64,
+                mime_type=prepared.mime_type,
+                detail=prepared.detail
+            )
+
+            # Сохраняем в историю
+            history_service.add_entry(
+                request_type="image",
+                request_summary=f"Изображение: {filename}",
+                response_summary=analysis.description[:200] if analysis.description else "Анализ изображения"
+            )
+
+            return ImageAnalysisResponse(
+                success=True,
+                analysis=analysis,
+                preprocessing=prepared.report
+            )
+        except ImageDecodeError as e:
+            return ImageAnalysisResponse(
+                success=False,
+                error=str(e)
+            )
+        except APIError as e:
+            return ImageAnalysisResponse(
+                success=False,
+                error=describe_api_error(e)
+            )
+        except Exception as e:
+            return ImageAnalysisResponse(
+                success=False,
+                error=f"Ошибка при анализе изображения: {str(e)}"
+            )
+
+    async def stream_text(self, text: str) -> AsyncIterator[dict]:
+        """
+        Потоковый анализ продающего текста (события для SSE)
+        
+        Ошибки не прерывают поток исключением, а приходят событием {"type": "error"}.
+        """
+        if not text or not isinstance(text, str) or not text.strip():
+            yield {"type": "error", "error": "Текст для анализа не может быть пустым"}
+            return
+        try:
+            async for event in openai_service.stream_text(text):
+                if event["type"] == "result":
+                    history_service.add_entry(
+                        request_type="text",
+                        request_summary=text[:100] + "..." if len(text) > 100 else text,
+                        response_summary=event["analysis"].get("summary", "")
+                    )
+                    event = {**event, "success": True}
+                yield event
+        except APIError as e:
+            yield {"type": "error", "error": describe_api_error(e)}
+        except Exception as e:
+            yield {"type": "error", "error": f"Ошибка при анализе: {str(e)}"}
+
+    async def stream_image(
+        self,
+        content: bytes,
+        content_type: str,
+        filename: Optional[str]
+    ) -> AsyncIterator[dict]:
+        """Потоковый анализ планировки (события для SSE)"""
+        try:
+            prepared = await image_service.prepare_upload(content)
+            yield {"type": "preprocessing", "report": prepared.report.model_dump()}
+            async for event in openai_service.stream_image(prepared.base64, prepared.mime_type, prepared.detail):
+                if event["type"] == "result":
+                    description = event["analysis"].get("description")
+                    history_service.add_entry(
+                        request_type="image",
+                        request_summary=f"Изображение: {filename}",
+                        response_summary=description[:200] if description else "Анализ изображения"
+                    )
+                    event = {**event, "success": True, "preprocessing": prepared.report.model_dump()}
+                yield event
+        except ImageDecodeError as e:
+            yield {"type": "error", "error": str(e)}
+        except APIError as e:
+            yield {"type": "error", "error": describe_api_error(e)}
+        except Exception as e:
+            yield {"type": "error", "error": f"Ошибка при анализе изображения: {str(e)}"}
+
+    async def analyze_page(
+        self,
+        page: ParsedPage,
+        screenshot: Optional[PreparedScreenshot] = None,
+        skipped: Optional[List[str]] = None
+    ) -> Tuple[Optional[CompetitorAnalysis], List[AnalysisBranch]]:
+        """
+        Анализ распарсенной страницы: скриншот и текст параллельно
+
+        Каждая ветка ограничена своим таймаутом и остатком дедлайна запроса; результаты
+        удавшихся веток объединяются, неудавшаяся ветка только отмечается в списке веток.
+        Ошибка — если не удалась ни одна. Исключение — дедлайн: если ветки не успели
+        (или на анализ не осталось времени), возвращается None, а в skipped
+        добавляются пропущенные шаги (vision, analysis). Время ответа — время самой
+        медленной ветки.
+        """
+        skipped = skipped if skipped is not None else []
+        if not deadline.has_time(settings.deadline_llm_min):
+            deadlines.skip("analysis", "нет времени на запрос к модели")
+            skipped.append("analysis")
+            return None, []
+
+        branches: List[Tuple[str, Awaitable, float]] = []
+        if screenshot and not deadline.has_time(settings.deadline_vision_min):
+            deadlines.skip("vision", "нет времени на анализ скриншота")
+            skipped.append("vision")
+        elif screenshot:
+            branches.append(("image", openai_service.analyze_image(
+                image_base64=screenshot.base64,
+                mime_type=screenshot.mime_type,
+                detail=screenshot.detail
+            ), deadline.budget(settings.page_analysis_image_timeout)))
+
+        # Используем отобранный текст страницы или title/h1/первый абзац
+        text_to_analyze = None
+        if page.full_text and page.full_text.strip():
+            text_to_analyze = page.full_text
+        elif page.title or page.h1 or page.first_paragraph:
+            text_to_analyze = f"{page.title or ''}\n{page.h1 or ''}\n{page.first_paragraph or ''}".strip()
+        if text_to_analyze:
+            branches.append(("text", openai_service.analyze_parsed_content(
+                title=page.title,
+                h1=page.h1,
+                paragraph=text_to_analyze
+            ), deadline.budget(settings.page_analysis_text_timeout)))
+
+        if not branches:
+            return CompetitorAnalysis(summary="Не удалось извлечь контент для анализа"), []
+
+        outcomes = await asyncio.gather(*(
+            self._run_branch(name, coro, timeout) for name, coro, timeout in branches
+        ))
+        results = {report.branch: result for result, report in outcomes if report.success}
+        reports = [report for _, report in outcomes]
+        if not results:
+            errors = {report.branch: result for result, report in outcomes}
+            if deadline.remaining() is not None and all(isinstance(e, TimeoutError) for e in errors.values()):
+                # Не успели до дедлайна: отдаём результат парсинга без анализа
+                deadlines.skip("analysis", "ветки анализа не успели")
+                skipped.append("analysis")
+                return None, reports
+            # Ни одна ветка не удалась: ошибка текста важнее (её раньше и получал клиент)
+            raise errors.get("text", errors.get("image"))
+
+        return self._merge_page_analyses(results.get("image"), results.get("text")), reports
+
+    @staticmethod
+    async def _run_branch(name: str, coro: Awaitable, timeout: float) -> Tuple[object, AnalysisBranch]:
+        """Выполнить ветку анализа: (результат или исключение, отчёт о ветке)"""
+        started = time.perf_counter()
+        try:
+            with span(f"analysis.{name}"):
+                result = await (asyncio.wait_for(coro, timeout) if timeout > 0 else coro)
+            error = None
+        except DeadlineExceeded as e:
+            result, error = e, str(e)
+        except asyncio.TimeoutError:
+            result = TimeoutError(f"Превышено время анализа ({name}, {timeout:.0f} с)")
+            error = str(result)
+        except APIError as e:
+            result, error = e, describe_api_error(e)
+        except Exception as e:
+            result, error = e, str(e)
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        if error:
+            print(f"Ветка анализа страницы {name} не удалась за {latency_ms:.0f} мс: {error}")
+        return result, AnalysisBranch(branch=name, success=error is None, latency_ms=latency_ms, error=error)
+
+    @staticmethod
+    def _merge_page_analyses(
+        image: Optional[ImageAnalysis],
+        text: Optional[CompetitorAnalysis]
+    ) -> CompetitorAnalysis:
+        """Объединить визуальный анализ скриншота и анализ текста в один CompetitorAnalysis"""
+        visual_summary = None
+        if image is not None:
+            visual_summary = f"Визуальный анализ страницы. Оценка стиля: {image.visual_style_score}/10. {image.description}"
+        if text is None:
+            # Конвертируем ImageAnalysis в CompetitorAnalysis для единообразия
+            return CompetitorAnalysis(
+                strengths=image.marketing_insights,
+                weaknesses=[],
+                unique_offers=[],
+                recommendations=image.recommendations,
+                summary=visual_summary
+            )
+        if image is None:
+            return text
+
+        def combined(*lists: List[str]) -> List[str]:
+            return merge_points(lists, sum(len(points) for points in lists))
+
+        return CompetitorAnalysis(
+            strengths=combined(text.strengths, image.marketing_insights),
+            weaknesses=text.weaknesses,
+            unique_offers=text.unique_offers,
+            recommendations=combined(text.recommendations, image.recommendations),
+            summary=f"{text.summary} {visual_summary}".strip()
+        )
+
+    async def _store_screenshots(
+        self,
+        page: ParsedPage,
+        screenshot: Optional[PreparedScreenshot],
+        full_screenshot: bool
+    ) -> dict:
+        """
+        Сохранить скриншот и миниатюру в хранилище и вернуть поля ParsedContent
+
+        Исходный PNG — только по явному запросу, по умолчанию клиенту уходит миниатюра.
+        Если записать на диск не удалось, изображения возвращаются в base64, как раньше.
+        """
+        fields = {}
+        keep_full = page.screenshot_png and (full_screenshot or screenshot is None)
+        try:
+            if screenshot:
+                fields["screenshot_thumbnail"] = await screenshot_store.put(
+                    screenshot.thumbnail, screenshot.thumbnail_mime_type, *screenshot.thumbnail_size
+                )
+            if keep_full:
+                if screenshot:
+                    width, height = screenshot.report.original_width, screenshot.report.original_height
+                else:
+                    width, height = image_size(page.screenshot_png)
+                fields["screenshot_image"] = await screenshot_store.put(page.screenshot_png, "image/png", width, height)
+        except Exception as e:
+            print(f"Ошибка при сохранении скриншота: {e}")
+            fields = {
+                "screenshot_thumbnail_base64": screenshot.thumbnail_base64 if screenshot else None,
+                "screenshot_base64": base64.b64encode(page.screenshot_png).decode('utf-8') if keep_full else None
+            }
+        return fields
+
+    async def build_parse_response(
+        self,
+        request_url: str,
+        page: ParsedPage,
+        analysis: Optional[CompetitorAnalysis],
+        screenshot: Optional[PreparedScreenshot] = None,
+        full_screenshot: bool = False,
+        branches: Optional[List[AnalysisBranch]] = None,
+        skipped: Optional[List[str]] = None
+    ) -> ParseDemoResponse:
+        """Собрать ответ парсинга и записать его в историю (skipped — шаги, пропущенные из-за дедлайна)"""
+        full_text = page.full_text
+        screenshot_fields = await self._store_screenshots(page, screenshot, full_screenshot)
+        parsed_content = ParsedContent(
+            url=request_url,
+            title=page.title,
+            h1=page.h1,
+            first_paragraph=page.first_paragraph,
+            **screenshot_fields,
+            screenshot_report=screenshot.report if screenshot else None,
+            full_text=full_text[:1000] if (full_text and isinstance(full_text, str)) else None,  # Ограничиваем для JSON
+            content_report=page.content_report,
+            meta_description=page.meta_description,
+            json_ld=page.json_ld,
+            fetch_method=page.fetch_method,
+            analysis=analysis,
+            analysis_branches=branches or [],
+            partial=bool(skipped),
+            skipped=skipped or []
+        )
+        if skipped:
+            deadlines.record_partial()
+
+        # Сохраняем в историю
+        try:
+            history_service.add_entry(
+                request_type="parse",
+                request_summary=f"URL: {request_url or 'N/A'}",
+                response_summary=f"Title: {page.title or 'N/A'}" if page.title else "N/A"
+            )
+        except Exception as e:
+            print(f"Ошибка при сохранении в историю: {e}")
+
+        return ParseDemoResponse(
+            success=True,
+            data=parsed_content
+        )
+
+    async def parse_demo(self, request: ParseDemoRequest, on_stage: StageCallback = None) -> ParseDemoResponse:
+        """Парсинг страницы и анализ её контента"""
+        try:
+            # Проверяем URL
+            if not request.url or not isinstance(request.url, str) or not request.url.strip():
+                return ParseDemoResponse(
+                    success=False,
+                    error="URL не может быть пустым"
+                )
+
+            # Парсим страницу (HTTP или Selenium)
+            _set_stage(on_stage, "parsing")
+            page = await parser_service.parse_url(request.url.strip(), screenshot=request.screenshot)
+
+            if page.error:
+                return ParseDemoResponse(
+                    success=False,
+                    error=page.error
+                )
+
+            # Уменьшаем скриншот для модели и делаем миниатюру для ответа
+            screenshot = None
+            if page.screenshot_png:
+                _set_stage(on_stage, "preparing_image")
+                screenshot = await image_service.prepare_screenshot(page.screenshot_png)
+
+            # Анализируем контент
+            _set_stage(on_stage, "analyzing")
+            skipped = list(page.skipped)
+            analysis, branches = await self.analyze_page(page, screenshot, skipped)
+
+            return await self.build_parse_response(
+                request.url, page, analysis, screenshot,
+                full_screenshot=request.full_screenshot, branches=branches, skipped=skipped
+            )
+        except APIError as e:
+            return ParseDemoResponse(
+                success=False,
+                error=describe_api_error(e)
+            )
+        except Exception as e:
+            return ParseDemoResponse(
+                success=False,
+                error=f"Ошибка при парсинге: {str(e)}"
+            )
+
+
+# Глобальный экземпляр
+analysis_service = AnalysisService()
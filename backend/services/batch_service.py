@@ -0,0 +1,238 @@
+"""
+Пакетный парсинг и анализ списка URL (/parse_batch)
+
+Каждый URL проходит те же этапы, что и /parse_demo, но этапы ограничены отдельно:
+загрузка страниц (HTTP/браузер) — своим лимитом, запросы к модели — своим, а к одному
+сайту одновременно идёт не больше N запросов с интервалом между ними. Результаты
+отдаются по мере готовности; ошибка на одном URL не прерывает пакет.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Union
+from urllib.parse import urlparse
+
+from openai import APIError
+
+from backend.config import settings
+from backend.models.schemas import ParseBatchRequest, ParseBatchResult, ParseBatchSummary
+from backend.services.analysis_service import analysis_service
+from backend.services.image_service import image_service
+from backend.services.openai_service import describe_api_error
+from backend.services.parser_service import parser_service
+from backend.services.rate_limiter import PRIORITY_BATCH, llm_priority
+
+
+def host_of(url: str) -> str:
+    """Хост URL (протокол по умолчанию — https, как в парсере)"""
+    url = url.strip()
+    if not url.startswith(("http://", "https://")):
+        url = "https://" + url
+    return (urlparse(url).hostname or url).lower()
+
+
+class _HostState:
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+        self.users = 0
+
+
+class HostLimiter:
+    """Вежливость к сайтам: не больше N одновременных запросов к хосту и интервал между ними"""
+
+    def __init__(self, concurrency: int, interval: float):
+        self.concurrency = max(1, concurrency)
+        self.interval = max(0.0, interval)
+        self._hosts: Dict[str, _HostState] = {}
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        """
+        Место в очереди к хосту; внутри перед самим запросом нужно вызвать wait_turn(host)
+
+        Ожидание интервала отделено от захвата места, чтобы интервал отсчитывался
+        между фактическими началами запросов, а не между входами в очередь.
+        """
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.concurrency)
+        state.users += 1
+        try:
+            async with state.semaphore:
+                yield
+        finally:
+            state.users -= 1
+            if state.users == 0:
+                self._forget_later(host, state)
+
+    def _forget_later(self, host: str, state: _HostState):
+        """
+        Удалить состояние хоста, когда истечёт интервал с последнего запроса
+
+        Иначе следующий URL того же хоста, пришедший сразу после, не выдержал бы интервал.
+        """
+        loop = asyncio.get_running_loop()
+        delay = state.next_start - loop.time()
+        if delay > 0:
+            loop.call_later(delay, self._forget, host, state)
+        else:
+            self._forget(host, state)
+
+    def _forget(self, host: str, state: _HostState):
+        if state.users == 0 and self._hosts.get(host) is state:
+            del self._hosts[host]
+
+    async def wait_turn(self, host: str):
+        """Выдержать интервал с предыдущего запроса к хосту (до захвата общих лимитов)"""
+        state = self._hosts[host]
+        async with state.lock:
+            loop = asyncio.get_running_loop()
+            delay = state.next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            state.next_start = loop.time() + self.interval
+
+    def started(self, host: str):
+        """
+        Запрос к хосту фактически начат
+
+        Между wait_turn и началом запроса может пройти ожидание общего лимита загрузок,
+        поэтому интервал до следующего запроса отсчитывается заново от начала этого.
+        """
+        state = self._hosts[host]
+        state.next_start = max(state.next_start, asyncio.get_running_loop().time() + self.interval)
+
+    def active_hosts(self) -> int:
+        return len(self._hosts)
+
+
+class BatchService:
+    """Пакетная обработка URL с раздельными лимитами на этапы"""
+
+    def __init__(
+        self,
+        parse_concurrency: int,
+        llm_concurrency: int,
+        per_host_concurrency: int,
+        per_host_interval: float
+    ):
+        self.parse_concurrency = max(1, parse_concurrency)
+        self.llm_concurrency = max(1, llm_concurrency)
+        # Лимиты общие для всех пакетов: два параллельных пакета не удваивают нагрузку
+        self._parse_slots = asyncio.Semaphore(self.parse_concurrency)
+        self._llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        self.hosts = HostLimiter(per_host_concurrency, per_host_interval)
+
+        # Статистика
+        self.batches_running = 0
+        self.batches_total = 0
+        self.urls_succeeded = 0
+        self.urls_failed = 0
+
+    async def _process(self, index: int, url: str, request: ParseBatchRequest) -> ParseBatchResult:
+        """Обработать один URL; любые ошибки превращаются в результат с success=False"""
+        started = time.perf_counter()
+
+        def result(**fields) -> ParseBatchResult:
+            return ParseBatchResult(
+                index=index,
+                url=url,
+                elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+                **fields
+            )
+
+        try:
+            if not url or not url.strip():
+                return result(success=False, error="URL не может быть пустым")
+
+            # Загрузка страницы: сначала очередь и интервал к сайту, потом общий лимит
+            # загрузок — чтобы ожидание интервала не занимало места других сайтов
+            host = host_of(url)
+            async with self.hosts.slot(host):
+                await self.hosts.wait_turn(host)
+                async with self._parse_slots:
+                    self.hosts.started(host)
+                    page = await parser_service.parse_url(url.strip(), screenshot=request.screenshot)
+            if page.error:
+                return result(success=False, error=page.error)
+
+            screenshot = None
+            if page.screenshot_png:
+                screenshot = await image_service.prepare_screenshot(page.screenshot_png)
+
+            async with self._llm_slots:
+                analysis, branches = await analysis_service.analyze_page(page, screenshot)
+
+            response = await analysis_service.build_parse_response(
+                url, page, analysis, screenshot, full_screenshot=request.full_screenshot, branches=branches
+            )
+            return result(success=True, data=response.data)
+        except APIError as e:
+            return result(success=False, error=describe_api_error(e))
+        except Exception as e:
+            return result(success=False, error=f"Ошибка при парсинге: {str(e)}")
+
+    async def run(self, request: ParseBatchRequest) -> AsyncIterator[Union[ParseBatchResult, ParseBatchSummary]]:
+        """
+        Обработать пакет и выдавать результаты по мере готовности (не в порядке запроса)
+
+        Последним элементом идёт сводка. Если клиент отключился, оставшиеся URL отменяются.
+        """
+        started = time.perf_counter()
+        results: "asyncio.Queue[ParseBatchResult]" = asyncio.Queue()
+
+        async def worker(index: int, url: str):
+            # Пакеты уступают интерактивным запросам в очереди к модели
+            llm_priority.set(PRIORITY_BATCH)
+            await results.put(await self._process(index, url, request))
+
+        self.batches_running += 1
+        self.batches_total += 1
+        tasks: List[asyncio.Task] = [
+            asyncio.create_task(worker(index, url)) for index, url in enumerate(request.urls)
+        ]
+        succeeded = failed = 0
+        try:
+            for _ in range(len(tasks)):
+                item = await results.get()
+                if item.success:
+                    succeeded += 1
+                    self.urls_succeeded += 1
+                else:
+                    failed += 1
+                    self.urls_failed += 1
+                yield item
+
+            yield ParseBatchSummary(
+                total=len(tasks),
+                succeeded=succeeded,
+                failed=failed,
+                elapsed_ms=round((time.perf_counter() - started) * 1000, 1)
+            )
+        finally:
+            self.batches_running -= 1
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "batches_running": self.batches_running,
+            "batches_total": self.batches_total,
+            "urls_succeeded": self.urls_succeeded,
+            "urls_failed": self.urls_failed,
+            "parse_concurrency": self.parse_concurrency,
+            "llm_concurrency": self.llm_concurrency,
+            "active_hosts": self.hosts.active_hosts()
+        }
+
+
+# Глобальный экземпляр
+batch_service = BatchService(
+    parse_concurrency=settings.batch_parse_concurrency,
+    llm_concurrency=settings.batch_llm_concurrency,
+    per_host_concurrency=settings.batch_per_host_concurrency,
+    per_host_interval=settings.batch_per_host_interval
+)
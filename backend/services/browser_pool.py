@@ -0,0 +1,273 @@
+"""
+Пул заранее запущенных headless-браузеров для парсера
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Set
+
+from selenium import webdriver
+
+
+class BrowserPoolTimeout(Exception):
+    """Не удалось получить браузер из пула за отведённое время"""
+
+
+class PooledDriver:
+    """Драйвер из пула со счётчиком обработанных страниц"""
+
+    def __init__(self, driver: webdriver.Chrome):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.monotonic()
+        self.broken = False
+        self.interrupted = False
+
+    def mark_broken(self):
+        """Пометить драйвер как сломанный — при возврате он будет перезапущен"""
+        self.broken = True
+
+    def mark_interrupted(self):
+        """
+        Обработка отменена, пока команда браузера выполнялась в другом потоке
+
+        Такой драйвер при возврате не очищается, а закрывается без очереди за этой командой.
+        """
+        self.broken = True
+        self.interrupted = True
+
+
+class BrowserPool:
+    """
+    Ограниченный пул браузеров с выдачей в аренду.
+
+    - не больше size драйверов одновременно;
+    - перед выдачей драйвер проверяется (жив ли процесс браузера);
+    - после max_pages страниц или падения драйвер закрывается и в фоне заменяется новым;
+    - отмена ожидающего (клиент отключился) не теряет ни слот, ни запускаемый браузер.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], webdriver.Chrome],
+        size: int,
+        max_pages: int,
+        lease_timeout: float,
+        health_check_timeout: float = 5.0
+    ):
+        self.factory = factory
+        self.size = max(1, size)
+        self.max_pages = max(1, max_pages)
+        self.lease_timeout = lease_timeout
+        self.health_check_timeout = health_check_timeout
+
+        self._slots = asyncio.Semaphore(self.size)
+        self._idle: Deque[PooledDriver] = deque()
+        self._live = 0  # Запущенные драйверы: свободные, выданные и создаваемые
+        self._warmups: Set[asyncio.Task] = set()
+        self._closed = False
+
+        # Статистика
+        self.created = 0
+        self.recycled = 0
+        self.leases = 0
+        self.interrupted = 0
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    async def _run_sync(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def _create(self) -> PooledDriver:
+        """Запустить новый браузер (в отдельном потоке, Selenium не async)"""
+        self._live += 1
+        launch = asyncio.ensure_future(self._run_sync(self.factory))
+        try:
+            driver = await asyncio.shield(launch)
+        except asyncio.CancelledError:
+            # Поток запуска отменой не остановить: запущенный браузер забирает пул
+            self._track(asyncio.get_running_loop().create_task(self._adopt(launch)))
+            raise
+        except BaseException:
+            self._live -= 1
+            raise
+        self.created += 1
+        return PooledDriver(driver)
+
+    async def _adopt(self, launch: asyncio.Future):
+        """Положить в очередь свободных браузер, запуск которого был отменён"""
+        try:
+            driver = await launch
+        except BaseException:
+            self._live -= 1
+            return
+        self.created += 1
+        pooled = PooledDriver(driver)
+        if self._closed or self._live > self.size:
+            await self._discard(pooled)
+        else:
+            self._idle.append(pooled)
+
+    @staticmethod
+    def _quit(pooled: PooledDriver):
+        if pooled.interrupted:
+            # Команда (driver.get) ещё выполняется в другом потоке, и quit встал бы в очередь за ней.
+            # Останавливаем chromedriver: он закрывает браузер, прерванная команда завершится ошибкой
+            service = getattr(pooled.driver, "service", None)
+            if service is not None:
+                service.stop()
+                return
+        pooled.driver.quit()
+
+    async def _discard(self, pooled: PooledDriver):
+        """Закрыть браузер и освободить место в пуле"""
+        self._live -= 1
+        try:
+            await self._run_sync(self._quit, pooled)
+        except Exception:
+            pass
+
+    async def _is_healthy(self, pooled: PooledDriver) -> bool:
+        """Проверить, что браузер отвечает на команды"""
+        try:
+            result = await asyncio.wait_for(
+                self._run_sync(pooled.driver.execute_script, "return 1"),
+                timeout=self.health_check_timeout
+            )
+            return result == 1
+        except Exception:
+            return False
+
+    async def _reset(self, pooled: PooledDriver) -> bool:
+        """Очистить состояние браузера перед следующей арендой"""
+        def reset():
+            pooled.driver.delete_all_cookies()
+            pooled.driver.get("about:blank")
+
+        try:
+            await asyncio.wait_for(self._run_sync(reset), timeout=self.health_check_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def _warm_one(self):
+        """Запустить браузер заранее и положить его в очередь свободных"""
+        if self._closed or self._live >= self.size:
+            return
+        try:
+            pooled = await self._create()
+        except Exception as e:
+            print(f"⚠️ Не удалось запустить браузер для пула: {e}")
+            return
+        if self._closed:
+            await self._discard(pooled)
+        else:
+            self._idle.append(pooled)
+
+    def _track(self, task: asyncio.Task):
+        """Фоновая задача пула (прогрев, подбор отменённого запуска) — drain её дождётся"""
+        self._warmups.add(task)
+        task.add_done_callback(self._warmups.discard)
+
+    def _schedule_warmup(self):
+        self._track(asyncio.get_running_loop().create_task(self._warm_one()))
+
+    async def start(self, prewarm: bool = True):
+        """Запустить пул (при старте приложения)"""
+        self._closed = False
+        if prewarm:
+            await asyncio.gather(*(self._warm_one() for _ in range(self.size - self._live)))
+            print(f"✅ Пул браузеров: запущено {len(self._idle)} из {self.size}")
+
+    async def acquire(self) -> PooledDriver:
+        """Взять браузер из пула (ждёт освобождения не дольше lease_timeout)"""
+        if self._closed:
+            raise RuntimeError("Пул браузеров остановлен")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.lease_timeout)
+        except asyncio.TimeoutError:
+            raise BrowserPoolTimeout("Все браузеры заняты, попробуйте позже")
+
+        pooled = None
+        try:
+            while self._idle:
+                pooled = self._idle.popleft()
+                if await self._is_healthy(pooled):
+                    self.leases += 1
+                    return pooled
+                # Браузер упал, пока лежал в пуле
+                broken, pooled = pooled, None
+                self.recycled += 1
+                await self._discard(broken)
+
+            pooled = await self._create()
+            self.leases += 1
+            return pooled
+        except BaseException:
+            if pooled is not None:
+                # Отменили во время проверки: браузер возвращается в очередь и будет проверен снова
+                self._idle.appendleft(pooled)
+            self._slots.release()
+            raise
+
+    async def release(self, pooled: PooledDriver):
+        """Вернуть браузер в пул"""
+        try:
+            pooled.pages += 1
+            recycle = (
+                self._closed
+                or pooled.broken
+                or pooled.pages >= self.max_pages
+                or self._live > self.size  # Лишний драйвер после фонового прогрева
+            )
+            if not recycle and not await self._reset(pooled):
+                recycle = True
+
+            if recycle:
+                self.recycled += 1
+                if pooled.interrupted:
+                    self.interrupted += 1
+                await self._discard(pooled)
+                if not self._closed:
+                    # Держим пул тёплым: замена запускается в фоне
+                    self._schedule_warmup()
+            else:
+                self._idle.append(pooled)
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def lease(self):
+        """Аренда браузера на время обработки одной страницы"""
+        pooled = await self.acquire()
+        try:
+            yield pooled
+        finally:
+            await self.release(pooled)
+
+    async def drain(self):
+        """Остановить пул и закрыть все свободные браузеры (выданные закроются при возврате)"""
+        self._closed = True
+        # Фоновые запуски не отменяем: поток запуска всё равно доработает, а увидев _closed,
+        # задача сама закроет браузер. Отмена оставила бы его процесс без владельца
+        while self._warmups:
+            await asyncio.gather(*list(self._warmups), return_exceptions=True)
+
+        idle = list(self._idle)
+        self._idle.clear()
+        await asyncio.gather(*(self._discard(pooled) for pooled in idle), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "live": self._live,
+            "idle": len(self._idle),
+            "created": self.created,
+            "recycled": self.recycled,
+            "leases": self.leases,
+            "interrupted": self.interrupted
+        }
@@ -0,0 +1,259 @@
+"""
+Кэш результатов анализа (контентно-адресуемый)
+
+Ключ — SHA-256 от (тип анализа, модель, версия системного промпта, нормализованные входные байты).
+Два уровня: LRU в памяти процесса и JSON-файлы на диске, которые переживают перезапуск.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from backend.config import settings
+
+
+def normalize_text(text: str) -> bytes:
+    """Нормализовать текст для ключа кэша: Unicode NFC, схлопнутые пробелы"""
+    text = unicodedata.normalize("NFC", text or "")
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.encode("utf-8")
+
+
+def normalize_image(image_base64: str, mime_type: str) -> bytes:
+    """Нормализовать изображение для ключа кэша: исходные байты файла + MIME-тип"""
+    try:
+        data = base64.b64decode(image_base64, validate=False)
+    except (ValueError, TypeError):
+        data = (image_base64 or "").encode("ascii", errors="ignore")
+    return mime_type.encode("ascii", errors="ignore") + b"\0" + data
+
+
+class AnalysisCache:
+    """Двухуровневый кэш: LRU в памяти + файлы на диске с TTL и ограничением размера"""
+
+    def __init__(
+        self,
+        directory: str,
+        ttl_seconds: int,
+        max_memory_items: int,
+        max_disk_bytes: int,
+        enabled: bool = True
+    ):
+        self.directory = Path(directory)
+        self.ttl = ttl_seconds
+        self.max_memory_items = max(0, max_memory_items)
+        self.max_disk_bytes = max(0, max_disk_bytes)
+        self.enabled = enabled
+
+        self._memory: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        # Индекс файлов на диске в порядке последнего использования: ключ -> размер
+        self._disk_index: Optional["OrderedDict[str, int]"] = None
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+
+        # Счётчики
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @staticmethod
+    def make_key(kind: str, model: str, prompt_version: str, payload: bytes) -> str:
+        """Ключ кэша по типу анализа, модели, версии промпта и входным данным"""
+        digest = hashlib.sha256()
+        digest.update(f"{kind}\0{model}\0{prompt_version}\0".encode("utf-8"))
+        digest.update(payload)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    async def _run_disk(self, func, *args):
+        """Выполнить операцию с диском в отдельном потоке под блокировкой индекса"""
+        def locked():
+            with self._disk_lock:
+                return func(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, locked)
+
+    # === Память ===
+
+    def _memory_get(self, key: str) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            self.expired += 1
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: dict, expires_at: float):
+        if self.max_memory_items == 0:
+            return
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    # === Диск (выполняется в отдельном потоке) ===
+
+    def _load_disk_index(self):
+        """Просканировать каталог кэша один раз, упорядочив файлы по времени использования"""
+        entries = []
+        if self.directory.exists():
+            for path in self.directory.glob("*/*.json"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+        entries.sort()
+        self._disk_index = OrderedDict((key, size) for _, key, size in entries)
+        self._disk_bytes = sum(size for _, _, size in entries)
+
+    def _disk_remove(self, key: str):
+        size = self._disk_index.pop(key, 0)
+        self._disk_bytes -= size
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, dict]]:
+        if self._disk_index is None:
+            self._load_disk_index()
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            if key in self._disk_index:
+                self._disk_remove(key)
+            return None
+
+        expires_at = entry.get("expires_at", 0)
+        if expires_at < time.time():
+            self._disk_remove(key)
+            self.expired += 1
+            return None
+
+        # Обновляем время использования для LRU-очистки
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        if key in self._disk_index:
+            self._disk_index.move_to_end(key)
+        return expires_at, entry.get("value")
+
+    def _disk_set(self, key: str, value: dict, expires_at: float):
+        if self._disk_index is None:
+            self._load_disk_index()
+        path = self._path(key)
+        data = json.dumps({"expires_at": expires_at, "value": value}, ensure_ascii=False).encode("utf-8")
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Атомарная запись: другой воркер не прочитает полузаписанный файл
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        self._disk_bytes += len(data) - self._disk_index.pop(key, 0)
+        self._disk_index[key] = len(data)
+
+        while self._disk_bytes > self.max_disk_bytes and self._disk_index:
+            oldest = next(iter(self._disk_index))
+            self._disk_remove(oldest)
+            self.evictions += 1
+
+    def _disk_clear(self):
+        if self._disk_index is None:
+            self._load_disk_index()
+        for key in list(self._disk_index):
+            self._disk_remove(key)
+
+    # === Публичный интерфейс ===
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Получить сохранённый результат или None"""
+        if not self.enabled:
+            return None
+
+        value = self._memory_get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        try:
+            entry = await self._run_disk(self._disk_get, key)
+        except Exception as e:
+            print(f"Ошибка чтения кэша: {e}")
+            entry = None
+
+        if entry is not None and entry[1] is not None:
+            expires_at, value = entry
+            self._memory_set(key, value, expires_at)
+            self.disk_hits += 1
+            return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        """Сохранить результат в оба уровня кэша"""
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        try:
+            await self._run_disk(self._disk_set, key, value, expires_at)
+            self.writes += 1
+        except Exception as e:
+            print(f"Ошибка записи кэша: {e}")
+
+    async def clear(self):
+        """Очистить кэш полностью"""
+        self._memory.clear()
+        await self._run_disk(self._disk_clear)
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "memory_items": len(self._memory),
+            "disk_items": len(self._disk_index) if self._disk_index is not None else None,
+            "disk_bytes": self._disk_bytes if self._disk_index is not None else None
+        }
+
+
+# Глобальный экземпляр
+analysis_cache = AnalysisCache(
+    directory=settings.cache_dir,
+    ttl_seconds=settings.cache_ttl_seconds,
+    max_memory_items=settings.cache_memory_items,
+    max_disk_bytes=settings.cache_disk_max_mb * 1024 * 1024,
+    enabled=settings.cache_enabled
+)
@@ -0,0 +1,111 @@
+"""
+Отмена обработки запроса, если клиент отключился
+
+Обычный (не потоковый) эндпоинт FastAPI дорабатывает до конца, даже если клиент
+закрыл вкладку или отвалился по таймауту: браузер из пула занят, запрос к модели
+оплачен, а ответ никто не прочитает. run_until_disconnected выполняет обработку в
+отдельной задаче и отменяет её, как только сервер получает http.disconnect.
+Ресурсы освобождаются там, где их держат: парсер закрывает браузер с
+незавершённой командой, OpenAIService прерывает запрос к модели и возвращает
+резерв токенов ограничителю. Потоковые ответы Starlette отменяет сама.
+"""
+import asyncio
+from typing import Awaitable, Dict, TypeVar
+
+from starlette.requests import Request
+
+from backend.config import settings
+from backend.services.metrics import cancelled_requests, cancelled_resources
+
+T = TypeVar("T")
+
+# Код ответа для отключившегося клиента (как у nginx): ответ всё равно никто не получит
+CLIENT_CLOSED_REQUEST = 499
+
+# Освобождённые ресурсы
+RESOURCE_BROWSER = "browser"  # Браузер закрыт посреди загрузки или извлечения
+RESOURCE_LLM_CALL = "llm_call"  # Прерванный запрос к модели
+RESOURCE_LLM_TOKENS = "llm_tokens"  # Возвращённый ограничителю резерв токенов (оценка)
+
+
+class ClientDisconnected(Exception):
+    """Клиент отключился, обработка запроса отменена"""
+
+
+class CancellationTracker:
+    """Счётчики отменённых запросов и освобождённых ресурсов"""
+
+    def __init__(self):
+        self.requests: Dict[str, int] = {}
+        self.resources: Dict[str, int] = {
+            RESOURCE_BROWSER: 0,
+            RESOURCE_LLM_CALL: 0,
+            RESOURCE_LLM_TOKENS: 0
+        }
+
+    def record_request(self, route: str):
+        """Учесть запрос, отменённый из-за отключения клиента"""
+        self.requests[route] = self.requests.get(route, 0) + 1
+        cancelled_requests.inc(1, route)
+
+    def record_resource(self, resource: str, amount: int = 1):
+        """Учесть ресурс, освобождённый отменой (по любой причине: отключение, таймаут этапа)"""
+        self.resources[resource] = self.resources.get(resource, 0) + amount
+        cancelled_resources.inc(amount, resource)
+
+    def stats(self) -> dict:
+        # По эндпоинтам — в метрике cancelled_requests_total{route}
+        return {
+            "requests": sum(self.requests.values()),
+            "reclaimed": dict(self.resources)
+        }
+
+
+async def _wait_for_disconnect(request: Request):
+    """
+    Дождаться http.disconnect
+
+    Тело запроса к этому моменту уже прочитано FastAPI, поэтому receive() ждёт,
+    пока клиент не закроет соединение (или сервер не завершит ответ).
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnected(request: Request, work: Awaitable[T]) -> T:
+    """
+    Выполнить обработку запроса, отменив её при отключении клиента
+
+    Отменённая обработка дожидается своих finally (возврат браузера в пул), затем
+    поднимается ClientDisconnected — main.py отвечает на него кодом 499.
+    """
+    if not settings.cancel_on_disconnect:
+        return await work
+
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    disconnected = False
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+        disconnected = watcher.done() and not task.done()
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+
+    if not disconnected:
+        return task.result()
+    route = request.scope.get("route")
+    cancellation.record_request(getattr(route, "path", request.url.path))
+    print(f"Клиент отключился, обработка {request.url.path} отменена")
+    raise ClientDisconnected()
+
+
+# Глобальный экземпляр
+cancellation = CancellationTracker()
@@ -0,0 +1,266 @@
+"""
+Отбор текста страницы для модели
+
+Видимый текст страницы делится на блоки (абзацы, заголовки, пункты списков).
+Служебные блоки — меню, шапка и подвал сайта, боковые колонки, cookie-баннеры,
+списки ссылок и повторы — отбрасываются, остальные ранжируются по плотности текста
+и укладываются в бюджет токенов (PARSER_CONTENT_TOKEN_BUDGET). В промпт блоки
+попадают в исходном порядке.
+"""
+import re
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from lxml import etree
+
+from backend.models.schemas import ContentReport
+from backend.services.tokens import estimate_tokens
+
+# Блочные теги: между ними проходит граница блоков текста (как переносы строк в body.innerText)
+BLOCK_TAGS = frozenset((
+    'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'nav', 'aside',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'ul', 'ol', 'dl', 'dt', 'dd',
+    'table', 'tr', 'td', 'th', 'blockquote', 'pre', 'form', 'figure', 'figcaption', 'br'
+))
+
+HEADING_TAGS = frozenset(('h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+
+# Служебные элементы по тегу; header и footer — только вне main/article
+BOILERPLATE_TAGS = frozenset(('nav', 'aside', 'menu', 'dialog'))
+PAGE_CHROME_TAGS = frozenset(('header', 'footer'))
+CONTENT_ROOT_TAGS = frozenset(('main', 'article'))
+BOILERPLATE_ROLES = frozenset((
+    'navigation', 'banner', 'contentinfo', 'complementary', 'search', 'menu', 'menubar', 'dialog', 'alertdialog'
+))
+# Служебные элементы по class/id (не применяется к элементам с h1)
+BOILERPLATE_MARKER = re.compile(
+    r'(?:^|[\s_-])(?:cookies?|consent|gdpr|breadcrumbs?|navbar|nav|menu|sidebar|footer|social|share|subscribe|popup|modal)(?:$|[\s_-])',
+    re.IGNORECASE
+)
+
+# Блок, больше половины текста которого — ссылки, считается меню или списком ссылок
+MAX_LINK_DENSITY = 0.5
+# Заголовки короткие, но задают контекст соседним абзацам
+HEADING_WEIGHT = 3.0
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _clean(text: str) -> str:
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class TextBlock:
+    """Блок видимого текста и доля его символов в ссылках, служебных элементах и заголовках"""
+
+    def __init__(
+        self,
+        text: str,
+        total_chars: int = 0,
+        link_chars: int = 0,
+        boilerplate_chars: int = 0,
+        heading_chars: int = 0
+    ):
+        self.text = text
+        self.total_chars = total_chars or len(text)
+        self.link_chars = link_chars
+        self.boilerplate_chars = boilerplate_chars
+        self.heading_chars = heading_chars
+
+    @property
+    def link_density(self) -> float:
+        return self.link_chars / self.total_chars if self.total_chars else 0.0
+
+    @property
+    def is_boilerplate(self) -> bool:
+        return self.boilerplate_chars * 2 > self.total_chars
+
+    @property
+    def is_heading(self) -> bool:
+        return self.heading_chars * 2 > self.total_chars
+
+    def score(self) -> float:
+        """Плотность текста: длина без ссылок с поправкой на долю ссылок"""
+        density = 1.0 - self.link_density
+        score = self.total_chars * density * density
+        return score * HEADING_WEIGHT if self.is_heading else score
+
+
+class _BlockCollector:
+    """Накопление текста текущего блока при обходе DOM"""
+
+    def __init__(self):
+        self.blocks: List[TextBlock] = []
+        self._parts: List[str] = []
+        self._total = self._link = self._boilerplate = self._heading = 0
+
+    def add(self, text: Optional[str], link: bool, boilerplate: bool, heading: bool):
+        if not text:
+            return
+        self._parts.append(text)
+        size = len(_clean(text))
+        self._total += size
+        if link:
+            self._link += size
+        if boilerplate:
+            self._boilerplate += size
+        if heading:
+            self._heading += size
+
+    def flush(self):
+        text = _clean("".join(self._parts))
+        if text:
+            self.blocks.append(TextBlock(text, self._total, self._link, self._boilerplate, self._heading))
+        self._parts = []
+        self._total = self._link = self._boilerplate = self._heading = 0
+
+
+def _is_boilerplate(element, tag: str, in_content: bool) -> bool:
+    if tag in PAGE_CHROME_TAGS:
+        return not in_content
+    if tag in BOILERPLATE_TAGS:
+        return True
+    if (element.get('role') or '').lower() in BOILERPLATE_ROLES:
+        return True
+    if tag in ('html', 'body') or tag in CONTENT_ROOT_TAGS:
+        return False
+    marker = f"{element.get('class') or ''} {element.get('id') or ''}"
+    return bool(BOILERPLATE_MARKER.search(marker)) and element.find('.//h1') is None
+
+
+def collect_blocks(root) -> List[TextBlock]:
+    """
+    Блоки видимого текста элемента lxml (невидимые элементы должны быть уже удалены)
+
+    Обход без рекурсии: глубина DOM реальных страниц бывает больше лимита рекурсии.
+    """
+    collector = _BlockCollector()
+    # (внутри ссылки, внутри служебного элемента, внутри заголовка, внутри main/article)
+    state = [(False, False, False, False)]
+    for event, element in etree.iterwalk(root, events=("start", "end")):
+        if not isinstance(element.tag, str):
+            # Комментарии и инструкции обработки: текст после них принадлежит родителю
+            if event == "end" and element is not root:
+                collector.add(element.tail, *state[-1][:3])
+            continue
+        tag = element.tag.lower()
+        if event == "start":
+            if tag in BLOCK_TAGS:
+                collector.flush()
+            link, boilerplate, heading, in_content = state[-1]
+            boilerplate = boilerplate or _is_boilerplate(element, tag, in_content)
+            state.append((
+                link or tag == 'a',
+                boilerplate,
+                heading or tag in HEADING_TAGS,
+                in_content or tag in CONTENT_ROOT_TAGS
+            ))
+            collector.add(element.text, *state[-1][:3])
+        else:
+            state.pop()
+            if tag in BLOCK_TAGS:
+                collector.flush()
+            if element is not root:
+                collector.add(element.tail, *state[-1][:3])
+    collector.flush()
+    return collector.blocks
+
+
+def blocks_from_counts(items: Iterable[Sequence]) -> List[TextBlock]:
+    """Блоки из результата EXTRACT_CONTENT_JS: [текст, всего, в ссылках, в служебных, в заголовках]"""
+    blocks = []
+    for item in items or []:
+        if not item or not isinstance(item[0], str):
+            continue
+        text = _clean(item[0])
+        if text:
+            counts = [int(value or 0) for value in list(item[1:5]) + [0] * (5 - len(item))]
+            blocks.append(TextBlock(text, *counts))
+    return blocks
+
+
+def blocks_from_text(text: str) -> List[TextBlock]:
+    """Блоки из готового видимого текста (строка — блок), без сведений о ссылках и разметке"""
+    return [TextBlock(line) for line in (_clean(line) for line in (text or "").split("\n")) if line]
+
+
+def _cut_to_tokens(text: str, tokens: int) -> str:
+    """Начало текста не длиннее tokens по оценке, по границе слова"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    if low < len(text) and " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip()
+
+
+def select_content(
+    blocks: List[TextBlock],
+    token_budget: int,
+    strip_boilerplate: bool = True
+) -> Tuple[str, ContentReport]:
+    """
+    Текст для модели из блоков страницы и отчёт об отборе
+
+    token_budget <= 0 — без ограничения (отбрасываются только служебные блоки).
+    Если после фильтрации ничего не осталось, ранжируются все блоки.
+    """
+    raw_text = "\n".join(block.text for block in blocks)
+    boilerplate = links = duplicates = 0
+    candidates: List[Tuple[int, TextBlock]] = []
+    seen = set()
+    for position, block in enumerate(blocks):
+        key = block.text.lower()
+        if strip_boilerplate and block.is_boilerplate:
+            boilerplate += 1
+        elif strip_boilerplate and block.link_density > MAX_LINK_DENSITY:
+            links += 1
+        elif key in seen:
+            duplicates += 1
+        else:
+            candidates.append((position, block))
+        seen.add(key)
+    if not candidates:
+        candidates = list(enumerate(blocks))
+
+    selected: List[Tuple[int, str]] = []
+    truncated = False
+    if token_budget > 0:
+        remaining = token_budget
+        for position, block in sorted(candidates, key=lambda item: item[1].score(), reverse=True):
+            # +1 — перенос строки между блоками
+            cost = estimate_tokens(block.text) + 1
+            if cost <= remaining:
+                selected.append((position, block.text))
+                remaining -= cost
+            elif not selected:
+                # Самый ценный блок сам больше бюджета — берём его начало
+                selected.append((position, _cut_to_tokens(block.text, remaining - 1)))
+                truncated = True
+                remaining = 0
+            if remaining <= 1:
+                break
+    else:
+        selected = [(position, block.text) for position, block in candidates]
+
+    text = "\n".join(part for _, part in sorted(selected) if part)
+    raw_tokens = estimate_tokens(raw_text)
+    sent_tokens = estimate_tokens(text)
+    return text, ContentReport(
+        raw_chars=len(raw_text),
+        raw_tokens=raw_tokens,
+        blocks=len(blocks),
+        blocks_boilerplate=boilerplate,
+        blocks_links=links,
+        blocks_duplicate=duplicates,
+        blocks_selected=len(selected),
+        sent_chars=len(text),
+        sent_tokens=sent_tokens,
+        token_budget=token_budget,
+        tokens_saved=max(0, raw_tokens - sent_tokens),
+        truncated=truncated
+    )
@@ -0,0 +1,137 @@
+"""
+Дедлайн запроса: общий бюджет времени на парсинг и анализ
+
+Клиент сообщает, сколько готов ждать (заголовок X-Request-Timeout или параметр
+?timeout=, секунды; без них — REQUEST_TIMEOUT_DEFAULT). Момент истечения хранится
+в контексте задачи asyncio и наследуется дочерними задачами, поэтому каждый этап
+берёт остаток бюджета сам: загрузка страницы, ожидание готовности, запросы к
+модели и очередь к ней. Необязательные шаги (браузер, скриншот, анализ скриншота,
+объединение резюме, эскалация на основную модель) пропускаются, если на них не
+хватает времени, а /parse_demo отдаёт то, что успел, с пометкой partial.
+"""
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Optional, TypeVar
+
+from starlette.requests import Request
+
+from backend.config import settings
+from backend.services.metrics import deadline_skipped
+
+T = TypeVar("T")
+
+# Заголовок и параметр запроса с бюджетом времени, секунды
+TIMEOUT_HEADER = "X-Request-Timeout"
+TIMEOUT_QUERY = "timeout"
+
+# Момент истечения дедлайна текущего запроса (time.monotonic()), None — без дедлайна
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Бюджет времени запроса исчерпан до завершения этапа"""
+
+
+def request_timeout(request: Request, default: Optional[float]) -> Optional[float]:
+    """
+    Бюджет запроса из заголовка или параметра, секунды (не больше REQUEST_TIMEOUT_MAX)
+
+    None или 0 — без дедлайна. ValueError — если значение не число.
+    """
+    value = request.headers.get(TIMEOUT_HEADER) or request.query_params.get(TIMEOUT_QUERY)
+    if value is None or not value.strip():
+        seconds = default
+    else:
+        seconds = float(value)
+        if seconds != seconds or seconds < 0:
+            raise ValueError(f"некорректный бюджет времени: {value}")
+    if not seconds:
+        return None
+    if settings.request_timeout_max > 0:
+        seconds = min(seconds, settings.request_timeout_max)
+    return seconds
+
+
+def expires_at(seconds: Optional[float]) -> Optional[float]:
+    """Момент истечения бюджета, отсчитанного от текущего момента"""
+    return time.monotonic() + seconds if seconds else None
+
+
+async def run_with_deadline(deadline: Optional[float], work: Awaitable[T]) -> T:
+    """Выполнить обработку с дедлайном (момент time.monotonic(), None — без дедлайна)"""
+    if deadline is not None:
+        deadlines.record_request()
+    token = request_deadline.set(deadline)
+    try:
+        return await work
+    finally:
+        request_deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Остаток бюджета текущего запроса, секунды (None — дедлайна нет)"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def budget(limit: float, reserve: float = 0.0) -> float:
+    """
+    Время на этап: собственный лимит этапа, но не больше остатка бюджета за вычетом
+    reserve (времени, нужного следующим этапам). Без дедлайна — limit.
+
+    Следующим этапам оставляется не больше половины остатка: при коротком бюджете
+    текущий этап всё равно получает время, а не завершается сразу.
+    """
+    left = remaining()
+    if left is None:
+        return limit
+    return max(0.0, min(limit, left - min(reserve, left / 2)))
+
+
+def has_time(seconds: float) -> bool:
+    """Хватает ли остатка бюджета на шаг длительностью seconds (без дедлайна — всегда)"""
+    left = remaining()
+    return left is None or left >= seconds
+
+
+def check(stage: str):
+    """DeadlineExceeded, если бюджет запроса уже исчерпан"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Бюджет времени запроса исчерпан ({stage})")
+
+
+class DeadlineTracker:
+    """Счётчики запросов с дедлайном, частичных ответов и пропущенных шагов"""
+
+    def __init__(self):
+        self.requests = 0
+        self.partial = 0
+        self.skipped: Dict[str, int] = {}
+
+    def record_request(self):
+        self.requests += 1
+
+    def record_partial(self):
+        self.partial += 1
+
+    def skip(self, stage: str, reason: str = ""):
+        """Учесть шаг, пропущенный или прерванный из-за дедлайна"""
+        self.skipped[stage] = self.skipped.get(stage, 0) + 1
+        deadline_skipped.inc(1, stage)
+        left = remaining()
+        print(f"Дедлайн: пропущен шаг {stage}" + (f" ({reason})" if reason else "")
+              + (f", осталось {left:.1f} с" if left is not None else ""))
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "partial": self.partial,
+            "skipped": dict(sorted(self.skipped.items()))
+        }
+
+
+# Глобальный экземпляр
+deadlines = DeadlineTracker()
@@ -2,28 +2,53 @@
 Сервис для работы с историей запросов
 """
 import json
+import queue
+import sqlite3
+import threading
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 from backend.config import settings
 from backend.models.schemas import HistoryItem
+from backend.services.metrics import span
 
 
-class HistoryService:
-    """Управление историей запросов"""
-    
-    def __init__(self):
-        self.history_file = Path(settings.history_file)
-        self.max_items = settings.max_history_items
+class HistoryBackend:
+    """Интерфейс хранилища истории"""
+
+    def add(self, items: List[dict]):
+        """Сохранить пачку записей"""
+        raise NotImplementedError
+
+    def list(self, limit: int, request_type: Optional[str] = None) -> List[dict]:
+        """Последние записи, новые первыми"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Удалить все записи"""
+        raise NotImplementedError
+
+    def close(self):
+        """Освободить ресурсы"""
+
+
+class JsonHistoryBackend(HistoryBackend):
+    """Устаревшее хранилище: весь список в одном JSON-файле (только для одного процесса)"""
+
+    def __init__(self, history_file: Path, max_items: int):
+        self.history_file = history_file
+        self.max_items = max_items
+        self._lock = threading.Lock()
         self._ensure_file_exists()
-    
+
     def _ensure_file_exists(self):
         """Создать файл истории если его нет"""
         if not self.history_file.exists():
             self.history_file.write_text("[]", encoding="utf-8")
-    
+
     def _load_history(self) -> List[dict]:
         """Загрузить историю из файла"""
         try:
@@ -31,23 +56,266 @@ class HistoryService:
             return json.loads(content)
         except (json.JSONDecodeError, FileNotFoundError):
             return []
-    
+
     def _save_history(self, history: List[dict]):
         """Сохранить историю в файл"""
         self.history_file.write_text(
             json.dumps(history, ensure_ascii=False, indent=2, default=str),
             encoding="utf-8"
         )
-    
+
+    def add(self, items: List[dict]):
+        with self._lock:
+            history = self._load_history()
+            # Добавляем в начало, новые первыми
+            history = list(reversed(items)) + history
+            # Оставляем только последние N записей
+            self._save_history(history[:self.max_items])
+
+    def list(self, limit: int, request_type: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            history = self._load_history()
+        if request_type:
+            history = [item for item in history if item.get("request_type") == request_type]
+        return history[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._save_history([])
+
+
+class SqliteHistoryBackend(HistoryBackend):
+    """
+    Хранилище истории в SQLite (WAL).
+
+    WAL позволяет нескольким воркерам uvicorn писать и читать одну базу
+    без потери записей; каждая пачка записей — одна транзакция.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            id TEXT PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            request_type TEXT NOT NULL,
+            request_summary TEXT NOT NULL,
+            response_summary TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp);
+        CREATE INDEX IF NOT EXISTS idx_history_type_timestamp ON history (request_type, timestamp);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_file: Path, retention_items: int, legacy_file: Optional[Path] = None):
+        self.db_file = db_file
+        self.retention_items = retention_items
+        self._local = threading.local()
+        # Соединения всех потоков (обработчики /history выполняются в пуле потоков)
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # Увеличивается при close(): соединения прошлых поколений закрыты
+        self._generation = 0
+
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        if legacy_file is not None:
+            self._import_legacy(conn, legacy_file)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение для текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "generation", None) != self._generation:
+            # check_same_thread=False — только чтобы close() мог закрыть соединения
+            # других потоков; каждое соединение используется одним потоком
+            conn = sqlite3.connect(
+                str(self.db_file), timeout=10.0, isolation_level=None, check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            with self._connections_lock:
+                self._connections.append(conn)
+                self._local.generation = self._generation
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self, conn: sqlite3.Connection, legacy_file: Path):
+        """Однократно перенести записи из старого history.json"""
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            return
+
+        items = []
+        if legacy_file.exists():
+            try:
+                items = json.loads(legacy_file.read_text(encoding="utf-8"))
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"Не удалось прочитать {legacy_file}: {e}")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Другой воркер мог успеть импортировать раньше
+            if not conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                self._insert(conn, [item for item in items if isinstance(item, dict) and item.get("id")])
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)",
+                    (datetime.now().isoformat(),)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if items:
+            print(f"✅ История: импортировано {len(items)} записей из {legacy_file}")
+
+    def _insert(self, conn: sqlite3.Connection, items: List[dict]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO history (id, timestamp, request_type, request_summary, response_summary) "
+            "VALUES (:id, :timestamp, :request_type, :request_summary, :response_summary)",
+            [
+                {
+                    "id": item["id"],
+                    "timestamp": str(item.get("timestamp", "")),
+                    "request_type": item.get("request_type", ""),
+                    "request_summary": item.get("request_summary", ""),
+                    "response_summary": item.get("response_summary", "")
+                }
+                for item in items
+            ]
+        )
+
+    def add(self, items: List[dict]):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert(conn, items)
+            # Ограничиваем размер таблицы
+            conn.execute(
+                "DELETE FROM history WHERE id IN ("
+                "SELECT id FROM history ORDER BY timestamp DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.retention_items,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def list(self, limit: int, request_type: Optional[str] = None) -> List[dict]:
+        conn = self._connect()
+        if request_type:
+            rows = conn.execute(
+                "SELECT * FROM history WHERE request_type = ? ORDER BY timestamp DESC, rowid DESC LIMIT ?",
+                (request_type, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM history ORDER BY timestamp DESC, rowid DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def clear(self):
+        self._connect().execute("DELETE FROM history")
+
+    def close(self):
+        """Закрыть соединения всех потоков (при следующем обращении откроются заново)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Ошибка при закрытии соединения с историей: {e}")
+
+
+class HistoryService:
+    """
+    Управление историей запросов
+
+    Запись идёт в фоновом потоке пачками, поэтому add_entry не блокирует event loop.
+    Чтение сначала дожидается записи накопленных элементов. Поток запускается в
+    start() (lifespan приложения) или при первой записи и останавливается в close(),
+    так что сервис переживает несколько запусков приложения в одном процессе.
+    """
+
+    def __init__(self):
+        self.max_items = settings.max_history_items
+        self.batch_size = max(1, settings.history_batch_size)
+        self.flush_interval = settings.history_flush_interval
+        self.backend = self._create_backend()
+
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self.start()
+
+    def _create_backend(self) -> HistoryBackend:
+        """Выбрать хранилище по настройкам"""
+        history_file = Path(settings.history_file)
+        if settings.history_backend == "json":
+            return JsonHistoryBackend(history_file, self.max_items)
+        return SqliteHistoryBackend(
+            Path(settings.history_db_file),
+            retention_items=max(settings.history_retention_items, self.max_items),
+            legacy_file=history_file
+        )
+
+    def start(self):
+        """Запустить фоновую запись, если она не запущена"""
+        with self._writer_lock:
+            if self._writer is not None and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(target=self._writer_loop, name="history-writer", daemon=True)
+            self._writer.start()
+
+    def _writer_alive(self) -> bool:
+        return self._writer is not None and self._writer.is_alive()
+
+    def _writer_loop(self):
+        """Фоновая запись: собираем пачку за flush_interval и пишем одной транзакцией"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    next_item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if next_item is None:
+                    stop = True
+                    break
+                batch.append(next_item)
+
+            try:
+                with span("history.write"):
+                    self.backend.add(batch)
+            except Exception as e:
+                print(f"Ошибка при сохранении истории: {e}")
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            if stop:
+                return
+
     def add_entry(
         self,
         request_type: str,
         request_summary: str,
         response_summary: str
     ) -> HistoryItem:
-        """Добавить запись в историю"""
-        history = self._load_history()
-        
+        """Добавить запись в историю (запись на диск — в фоне)"""
         item = {
             "id": str(uuid.uuid4()),
             "timestamp": datetime.now().isoformat(),
@@ -55,25 +323,47 @@ class HistoryService:
             "request_summary": request_summary[:200],  # Ограничиваем длину
             "response_summary": response_summary[:500]
         }
-        
-        # Добавляем в начало
-        history.insert(0, item)
-        
-        # Оставляем только последние N записей
-        history = history[:self.max_items]
-        
-        self._save_history(history)
-        
+
+        if not self._writer_alive():
+            self.start()
+        self._queue.put(item)
+
         return HistoryItem(**item)
-    
-    def get_history(self) -> List[HistoryItem]:
-        """Получить всю историю"""
-        history = self._load_history()
+
+    def flush(self):
+        """
+        Дождаться записи всех добавленных элементов
+
+        RuntimeError — если в очереди есть записи, а фоновая запись остановлена
+        (join() ждал бы вечно).
+        """
+        if not self._writer_alive():
+            if self._queue.unfinished_tasks:
+                raise RuntimeError("Фоновая запись истории остановлена, записи не сохранены")
+            return
+        self._queue.join()
+
+    def get_history(self, request_type: Optional[str] = None) -> List[HistoryItem]:
+        """Получить последние записи истории (блокирующий вызов)"""
+        with span("history.read"):
+            self.flush()
+            history = self.backend.list(self.max_items, request_type)
         return [HistoryItem(**item) for item in history]
-    
+
     def clear_history(self):
-        """Очистить историю"""
-        self._save_history([])
+        """Очистить историю (блокирующий вызов)"""
+        with span("history.clear"):
+            self.flush()
+            self.backend.clear()
+
+    def close(self):
+        """Записать оставшееся и остановить фоновый поток"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None and writer.is_alive():
+            self._queue.put(None)
+            writer.join(timeout=10)
+        self.backend.close()
 
 
 # Глобальный экземпляр
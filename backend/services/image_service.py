@@ -0,0 +1,461 @@
+"""
+Подготовка изображений для vision-модели
+
+Модель сама уменьшает картинку под выбранный уровень детализации (detail), поэтому
+отправлять скриншот 1920x1080 в PNG бессмысленно: те же токены, но в разы больше байт.
+Здесь изображение заранее приводится к размеру, который увидит модель, и
+перекодируется в JPEG/WebP; для ответа клиенту делается отдельная миниатюра.
+
+Загруженные планировки (сканы до 10+ МБ) дополнительно обрезаются по полям,
+поворачиваются по EXIF и при возможности переводятся в оттенки серого. Это
+делается в отдельных процессах, чтобы декодирование не занимало GIL воркера API.
+"""
+import asyncio
+import base64
+import math
+import multiprocessing
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageOps, features
+
+from backend.config import settings
+from backend.models.schemas import ImagePrepReport
+from backend.services.metrics import span
+
+# Как модель масштабирует изображение (документация OpenAI по vision)
+VISION_LOW_SIDE = 512  # detail=low: вписывается в 512x512, фиксированная стоимость
+VISION_LOW_TOKENS = 85
+VISION_HIGH_MAX_SIDE = 2048  # detail=high: сначала вписывается в 2048x2048,
+VISION_HIGH_SHORT_SIDE = 768  # затем короткая сторона уменьшается до 768
+VISION_TILE_SIDE = 512  # и изображение режется на плитки 512x512
+VISION_TILE_TOKENS = 170
+VISION_BASE_TOKENS = 85
+
+IMAGE_MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+# Автообрезка: насколько пиксель должен отличаться от цвета фона и какой отступ оставить
+AUTOCROP_TOLERANCE = 24
+AUTOCROP_PADDING = 0.01  # Доля большей стороны
+AUTOCROP_MIN_GAIN = 0.03  # Обрезать, только если площадь уменьшится хотя бы на 3%
+# Перевод в оттенки серого: доля заметно цветных пикселей, при которой цвет считается значимым
+GRAYSCALE_CHROMA = 24
+GRAYSCALE_MAX_COLORED = 0.01
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageDecodeError(ValueError):
+    """Загруженный файл не удалось прочитать как изображение"""
+
+
+def vision_target_size(width: int, height: int, detail: str) -> Tuple[int, int]:
+    """Размер, до которого модель уменьшит изображение при данном detail"""
+    if detail == "low":
+        scale = min(1.0, VISION_LOW_SIDE / max(width, height))
+    else:
+        # "high" и "auto" (для больших картинок auto означает high)
+        scale = min(1.0, VISION_HIGH_MAX_SIDE / max(width, height))
+        scale *= min(1.0, VISION_HIGH_SHORT_SIDE / (min(width, height) * scale))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_vision_tokens(width: int, height: int, detail: str) -> int:
+    """Оценка числа токенов, которые модель потратит на изображение"""
+    if detail == "low":
+        return VISION_LOW_TOKENS
+    target_width, target_height = vision_target_size(width, height, detail)
+    tiles = math.ceil(target_width / VISION_TILE_SIDE) * math.ceil(target_height / VISION_TILE_SIDE)
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * tiles
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """RGB без прозрачности (прозрачные области — белые, как фон страницы)"""
+    if image.mode == "RGB":
+        return image
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    if image_format == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _autocrop(image: Image.Image) -> Tuple[Image.Image, bool]:
+    """Обрезать однотонные поля (цвет фона — по углам изображения)"""
+    gray = image.convert("L")
+    width, height = gray.size
+    corners = sorted(gray.getpixel(point) for point in ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)))
+    background = (corners[1] + corners[2]) // 2
+
+    difference = ImageChops.difference(gray, Image.new("L", gray.size, background))
+    bbox = difference.point(lambda value: 255 if value > AUTOCROP_TOLERANCE else 0).getbbox()
+    if not bbox:
+        return image, False
+
+    padding = round(max(width, height) * AUTOCROP_PADDING)
+    left, top, right, bottom = bbox
+    bbox = (max(0, left - padding), max(0, top - padding), min(width, right + padding), min(height, bottom + padding))
+    cropped_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+    if cropped_area > (1 - AUTOCROP_MIN_GAIN) * width * height:
+        return image, False
+    return image.crop(bbox), True
+
+
+def _is_grayscale_safe(image: Image.Image) -> bool:
+    """Цвет не несёт информации: почти все пиксели ахроматические"""
+    sample = image.convert("RGB")
+    sample.thumbnail((128, 128))
+    red, green, blue = sample.split()
+    chroma = ImageChops.subtract(
+        ImageChops.lighter(ImageChops.lighter(red, green), blue),
+        ImageChops.darker(ImageChops.darker(red, green), blue)
+    )
+    histogram = chroma.histogram()
+    colored = sum(histogram[GRAYSCALE_CHROMA:])
+    return colored <= GRAYSCALE_MAX_COLORED * sample.width * sample.height
+
+
+def preprocess_upload(
+    data: bytes,
+    detail: str,
+    image_format: str,
+    quality: int,
+    autocrop: bool,
+    grayscale: bool,
+    max_pixels: int
+) -> Tuple[bytes, str, dict]:
+    """
+    Предобработка загруженного изображения (выполняется в пуле процессов)
+
+    Возвращает (байты, формат, отчёт). Шаги: поворот по EXIF, обрезка полей,
+    оттенки серого, уменьшение до размера модели, перекодирование.
+    """
+    started = time.perf_counter()
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    steps = []
+    try:
+        with warnings.catch_warnings():
+            # Слишком большое разрешение ("декомпрессионная бомба") — ошибка, а не предупреждение
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            source = Image.open(BytesIO(data))
+            source.load()
+    except (Image.DecompressionBombWarning, Image.DecompressionBombError):
+        raise ImageDecodeError("Слишком большое разрешение изображения")
+    except Exception:
+        raise ImageDecodeError("Не удалось прочитать изображение: файл повреждён или формат не поддерживается")
+
+    with source:
+        original_format = (source.format or "").lower()
+        original_size = source.size
+
+        # Фото со смартфона хранятся "боком" с тегом EXIF Orientation
+        image = source
+        if source.getexif().get(EXIF_ORIENTATION, 1) != 1:
+            image = ImageOps.exif_transpose(source)
+            steps.append("orientation")
+        image = _to_rgb(image)
+
+        if autocrop:
+            image, cropped = _autocrop(image)
+            if cropped:
+                steps.append("autocrop")
+
+        if grayscale and _is_grayscale_safe(image):
+            image = image.convert("L")
+            steps.append("grayscale")
+
+        target = vision_target_size(image.width, image.height, detail)
+        if target != image.size:
+            image = image.resize(target, Image.LANCZOS)
+            steps.append("resize")
+
+        output_format = image_format
+        output = _encode(image, image_format, quality)
+        # Чертежи в оттенках серого (тонкие линии, подписи) без потерь часто компактнее
+        if image.mode == "L":
+            lossless = _encode(image, "png", quality)
+            if len(lossless) < len(output):
+                output_format, output = "png", lossless
+        steps.append("reencode")
+
+        # Изображение только перекодировано (без поворота, обрезки, серого и уменьшения),
+        # а исходный файл меньше — отправляем его как есть. Иначе исходник обошёл бы
+        # ограничение разрешения и стоил бы больше токенов
+        if steps == ["reencode"] and len(data) <= len(output) and original_format in IMAGE_MIME_TYPES:
+            output_format, output = original_format, data
+            steps = ["original"]
+            prepared_size = original_size
+        else:
+            prepared_size = image.size
+
+    report = {
+        "original_bytes": len(data),
+        "original_width": original_size[0],
+        "original_height": original_size[1],
+        "prepared_bytes": len(output),
+        "prepared_width": prepared_size[0],
+        "prepared_height": prepared_size[1],
+        "format": output_format,
+        "detail": detail,
+        "steps": steps,
+        "bytes_saved": len(data) - len(output),
+        # Исходное изображение уходило без detail, то есть с detail=auto
+        "original_tokens": estimate_vision_tokens(original_size[0], original_size[1], "auto"),
+        "prepared_tokens": estimate_vision_tokens(prepared_size[0], prepared_size[1], detail),
+        "processing_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+    report["tokens_saved"] = report["original_tokens"] - report["prepared_tokens"]
+    return output, output_format, report
+
+
+def _warmup() -> bool:
+    """Пустая задача, чтобы процессы пула запустились заранее"""
+    return True
+
+
+def image_size(data: bytes) -> Tuple[int, int]:
+    """Размеры изображения по заголовку файла, без декодирования; (0, 0), если не читается"""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return 0, 0
+
+
+class PreparedImage:
+    """Изображение, подготовленное для отправки модели"""
+
+    def __init__(self, data: bytes, mime_type: str, detail: str, report: ImagePrepReport):
+        self.data = data
+        self.mime_type = mime_type
+        self.detail = detail
+        self.report = report
+
+    @property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+
+class PreparedScreenshot(PreparedImage):
+    """Скриншот для модели + миниатюра для ответа клиенту"""
+
+    def __init__(
+        self,
+        data: bytes,
+        mime_type: str,
+        detail: str,
+        report: ImagePrepReport,
+        thumbnail: bytes,
+        thumbnail_size: Tuple[int, int]
+    ):
+        super().__init__(data, mime_type, detail, report)
+        self.thumbnail = thumbnail
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_mime_type = IMAGE_MIME_TYPES["jpeg"]
+
+    @property
+    def thumbnail_base64(self) -> str:
+        return base64.b64encode(self.thumbnail).decode("utf-8")
+
+
+class ImageService:
+    """Уменьшение и перекодирование изображений перед vision-анализом"""
+
+    def __init__(
+        self,
+        detail: str,
+        image_format: str,
+        quality: int,
+        thumbnail_width: int,
+        thumbnail_quality: int = 70,
+        workers: int = 2,
+        upload_autocrop: bool = True,
+        upload_grayscale: bool = True,
+        max_pixels: int = 50_000_000
+    ):
+        self.detail = detail if detail in ("low", "high", "auto") else "auto"
+        if image_format == "webp" and not features.check("webp"):
+            print("⚠️ Pillow собран без WebP, изображения для модели будут в JPEG")
+            image_format = "jpeg"
+        self.image_format = image_format if image_format in ("jpeg", "webp") else "jpeg"
+        self.quality = quality
+        self.thumbnail_width = thumbnail_width
+        self.thumbnail_quality = thumbnail_quality
+        self.workers = max(1, workers)
+        self.upload_autocrop = upload_autocrop
+        self.upload_grayscale = upload_grayscale
+        self.max_pixels = max_pixels
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+        # Статистика
+        self.prepared = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.tokens_saved = 0
+
+    def _prepare_for_model(
+        self,
+        image: Image.Image,
+        original: bytes,
+        started: float
+    ) -> Tuple[bytes, str, ImagePrepReport]:
+        """Уменьшить до размера, который увидит модель, и перекодировать"""
+        width, height = image.size
+        target = vision_target_size(width, height, self.detail)
+        steps = []
+        prepared = _to_rgb(image)
+        if target != prepared.size:
+            prepared = prepared.resize(target, Image.LANCZOS)
+            steps.append("resize")
+        image_format = self.image_format
+        data = _encode(prepared, image_format, self.quality)
+        steps.append("reencode")
+        prepared_size = prepared.size
+
+        # Плоская графика и текст в PNG бывают меньше, чем в JPEG: если размер не
+        # менялся, в таком случае отправляем исходник. Уменьшенное изображение не
+        # заменяется исходником — тот обошёл бы ограничение разрешения
+        original_format = (image.format or "").lower()
+        if "resize" not in steps and len(original) <= len(data) and original_format in IMAGE_MIME_TYPES:
+            image_format, data, prepared_size = original_format, original, (width, height)
+            steps = ["original"]
+        original_bytes = len(original)
+
+        # Исходное изображение уходило без detail, то есть с detail=auto
+        original_tokens = estimate_vision_tokens(width, height, "auto")
+        prepared_tokens = estimate_vision_tokens(prepared_size[0], prepared_size[1], self.detail)
+        report = ImagePrepReport(
+            original_bytes=original_bytes,
+            original_width=width,
+            original_height=height,
+            prepared_bytes=len(data),
+            prepared_width=prepared_size[0],
+            prepared_height=prepared_size[1],
+            format=image_format,
+            detail=self.detail,
+            steps=steps,
+            bytes_saved=original_bytes - len(data),
+            original_tokens=original_tokens,
+            prepared_tokens=prepared_tokens,
+            tokens_saved=original_tokens - prepared_tokens,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1)
+        )
+        return data, image_format, report
+
+    def _make_thumbnail(self, image: Image.Image) -> Tuple[bytes, Tuple[int, int]]:
+        thumbnail = _to_rgb(image)
+        if thumbnail.width > self.thumbnail_width:
+            height = max(1, round(thumbnail.height * self.thumbnail_width / thumbnail.width))
+            thumbnail = thumbnail.resize((self.thumbnail_width, height), Image.LANCZOS)
+        return _encode(thumbnail, "jpeg", self.thumbnail_quality), thumbnail.size
+
+    def prepare_screenshot_sync(self, png: bytes) -> PreparedScreenshot:
+        """Подготовить скриншот (блокирующий вызов, CPU)"""
+        started = time.perf_counter()
+        with Image.open(BytesIO(png)) as image:
+            image.load()
+            thumbnail, thumbnail_size = self._make_thumbnail(image)
+            data, image_format, report = self._prepare_for_model(image, png, started)
+        report.thumbnail_bytes = len(thumbnail)
+        report.elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        self._account(report)
+        return PreparedScreenshot(
+            data, IMAGE_MIME_TYPES[image_format], self.detail, report, thumbnail, thumbnail_size
+        )
+
+    async def prepare_screenshot(self, png: bytes) -> Optional[PreparedScreenshot]:
+        """Подготовить скриншот вне event loop; None, если изображение не читается"""
+        loop = asyncio.get_running_loop()
+        try:
+            with span("image.screenshot"):
+                return await loop.run_in_executor(None, self.prepare_screenshot_sync, png)
+        except Exception as e:
+            print(f"Ошибка при подготовке скриншота: {e}")
+            return None
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            # spawn, а не fork: в процессе API уже работают потоки (история, пул браузеров)
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._process_pool
+
+    def start(self):
+        """Запустить процессы обработки заранее, чтобы первая загрузка не ждала их старта"""
+        pool = self._get_process_pool()
+        for _ in range(self.workers):
+            pool.submit(_warmup)
+
+    def shutdown(self):
+        """Остановить пул процессов"""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True, cancel_futures=True)
+            self._process_pool = None
+
+    async def prepare_upload(self, data: bytes) -> PreparedImage:
+        """
+        Предобработать загруженное изображение в пуле процессов
+
+        ImageDecodeError — если файл не является читаемым изображением.
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with span("image.upload"):
+            output, image_format, report_data = await loop.run_in_executor(
+                self._get_process_pool(),
+                preprocess_upload,
+                data,
+                self.detail,
+                self.image_format,
+                self.quality,
+                self.upload_autocrop,
+                self.upload_grayscale,
+                self.max_pixels
+            )
+        # Общее время, включая передачу данных между процессами
+        report = ImagePrepReport(**report_data, elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+        self._account(report)
+        return PreparedImage(output, IMAGE_MIME_TYPES[image_format], self.detail, report)
+
+    def _account(self, report: ImagePrepReport):
+        self.prepared += 1
+        self.bytes_in += report.original_bytes
+        self.bytes_out += report.prepared_bytes
+        self.tokens_saved += report.tokens_saved
+
+    def stats(self) -> dict:
+        return {
+            "detail": self.detail,
+            "format": self.image_format,
+            "prepared": self.prepared,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "tokens_saved": self.tokens_saved
+        }
+
+
+# Глобальный экземпляр
+image_service = ImageService(
+    detail=settings.vision_detail,
+    image_format=settings.vision_image_format,
+    quality=settings.vision_image_quality,
+    thumbnail_width=settings.screenshot_thumbnail_width,
+    workers=settings.image_workers,
+    upload_autocrop=settings.upload_autocrop,
+    upload_grayscale=settings.upload_grayscale,
+    max_pixels=settings.upload_max_pixels
+)
@@ -0,0 +1,162 @@
+"""
+Очередь фоновых задач для долгих операций (парсинг, анализ изображений)
+
+Клиент получает id задачи сразу, а результат забирает опросом GET /jobs/{id},
+поэтому HTTP-соединение не держится открытым всё время работы браузера и модели.
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from backend.config import settings
+from backend.services.rate_limiter import PRIORITY_JOB, llm_priority
+
+
+class JobQueueFull(Exception):
+    """Очередь задач заполнена — запрос нужно повторить позже"""
+
+
+# Функция, выполняющая задачу: получает колбэк смены этапа и возвращает ответ API
+JobRunner = Callable[[Callable[[str], None]], Awaitable[BaseModel]]
+
+
+class Job:
+    """Фоновая задача"""
+
+    def __init__(self, kind: str, runner: JobRunner):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.runner = runner
+        self.status = "queued"  # queued -> running -> done | failed
+        self.stage: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self._finished_monotonic: Optional[float] = None
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+
+
+class JobQueue:
+    """Ограниченная очередь задач с фиксированным числом исполнителей в процессе"""
+
+    def __init__(self, workers: int, max_queued: int, ttl_seconds: int):
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.ttl = ttl_seconds
+
+        self._queue: "asyncio.Queue[Job]" = asyncio.Queue(maxsize=self.max_queued)
+        self._jobs: Dict[str, Job] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+
+        # Статистика
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self):
+        """Запустить исполнителей (при старте приложения)"""
+        for i in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(), name=f"job-worker-{i}"))
+
+    async def stop(self):
+        """Остановить исполнителей (при остановке приложения)"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks.clear()
+
+    async def _worker(self):
+        # Запросы к модели из фоновых задач уступают синхронным эндпоинтам
+        llm_priority.set(PRIORITY_JOB)
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        job.status = "running"
+        job.started_at = datetime.now()
+        try:
+            response = await job.runner(job.set_stage)
+            job.result = response.model_dump(mode="json")
+            job.status = "done"
+            self.completed += 1
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "Задача отменена"
+            self.failed += 1
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"Ошибка выполнения задачи: {str(e)}"
+            self.failed += 1
+        finally:
+            job.stage = None
+            job.finished_at = datetime.now()
+            job._finished_monotonic = time.monotonic()
+
+    def _cleanup(self):
+        """Удалить завершённые задачи старше ttl"""
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job._finished_monotonic is not None and now - job._finished_monotonic > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, kind: str, runner: JobRunner) -> Job:
+        """Поставить задачу в очередь (JobQueueFull, если мест нет)"""
+        self._cleanup()
+        job = Job(kind, runner)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFull("Сервер перегружен, повторите запрос позже")
+        self._jobs[job.id] = job
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        """Позиция задачи в очереди (1 — следующая), None если задача уже не в очереди"""
+        if job.status != "queued":
+            return None
+        for position, queued in enumerate(self._queue._queue, start=1):
+            if queued is job:
+                return position
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "max_queued": self.max_queued,
+            "running": sum(1 for job in self._jobs.values() if job.status == "running"),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+# Глобальный экземпляр
+job_queue = JobQueue(
+    workers=settings.jobs_workers,
+    max_queued=settings.jobs_max_queued,
+    ttl_seconds=settings.jobs_ttl_seconds
+)
@@ -0,0 +1,279 @@
+"""
+Разбор JSON-ответа модели
+
+Модель отвечает одним JSON-объектом вида {"strengths": [...], "summary": "..."}.
+- parse_json_object — итоговый разбор за один проход, с починкой ответа,
+  оборванного по лимиту токенов;
+- IncrementalJsonParser — разбор по мере поступления токенов: сообщает о каждом
+  завершённом элементе массива и поле верхнего уровня, не дожидаясь конца ответа.
+"""
+import json
+from typing import Any, List, Optional, Tuple
+
+# Результат parse_json_object
+PARSE_OK = "ok"
+PARSE_REPAIRED = "repaired"
+PARSE_FAILED = "failed"
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def repair_truncated_json(text: str) -> Optional[str]:
+    """
+    Достроить оборванный JSON-объект до корректного
+
+    Незакрытая строка-значение закрывается; если так не получается, ответ обрезается
+    до последнего завершённого значения. Затем закрываются все открытые скобки.
+    Возвращает None, если в тексте нет ни одного завершённого значения.
+    """
+    stack: List[str] = []
+    expect_key: List[bool] = []  # Для каждого открытого объекта: следующая строка — ключ
+    in_string = escape = string_is_key = False
+    string_start = 0
+    last_safe: Optional[Tuple[int, str]] = None  # (позиция конца значения, закрывающие скобки)
+
+    def closers() -> str:
+        return "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+    def value_done(end: int):
+        nonlocal last_safe
+        if stack:
+            last_safe = (end, closers())
+
+    start = text.find("{")
+    if start < 0:
+        return None
+    i = start
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                if not string_is_key:
+                    value_done(i + 1)
+            i += 1
+            continue
+
+        if char == '"':
+            in_string = True
+            string_start = i
+            string_is_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+        elif char in "{[":
+            stack.append(char)
+            expect_key.append(char == "{")
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            expect_key.pop()
+            if not stack:
+                # Объект верхнего уровня завершён — дальше мусор
+                return text[start:i + 1]
+            value_done(i + 1)
+        elif char == ":":
+            if stack and stack[-1] == "{":
+                expect_key[-1] = False
+        elif char == ",":
+            if stack and stack[-1] == "{":
+                expect_key[-1] = True
+            # Число или литерал перед запятой завершён
+            prev = text[start:i].rstrip()
+            if prev and prev[-1] not in '"}],':
+                value_done(start + len(prev))
+        i += 1
+
+    candidates = []
+    if in_string and not string_is_key and len(text) - string_start > 1 + escape:
+        # Оборвалась непустая строка-значение: закрываем её, отбросив незавершённую escape-последовательность
+        body = text[start:len(text) - escape]
+        candidates.append(body + '"' + closers())
+    if last_safe is not None:
+        end, tail = last_safe
+        candidates.append(text[start:end] + tail)
+    for candidate in candidates:
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            continue
+    return None
+
+
+def parse_json_object(content: Optional[str]) -> Tuple[Optional[dict], str]:
+    """
+    Разобрать JSON-объект из ответа модели за один проход
+
+    Ответ в режиме JSON разбирается сразу; иначе объект ищется с первой "{"
+    (текст до неё, например ```json, пропускается) и читается raw_decode, без
+    жадных регулярных выражений. Оборванный ответ чинится repair_truncated_json.
+    Возвращает (объект или None, PARSE_OK | PARSE_REPAIRED | PARSE_FAILED).
+    """
+    if not content or not isinstance(content, str):
+        return None, PARSE_FAILED
+
+    start = content.find("{")
+    if start < 0:
+        return None, PARSE_FAILED
+    try:
+        data, _ = json.JSONDecoder().raw_decode(content, start)
+        if isinstance(data, dict):
+            return data, PARSE_OK
+    except ValueError:
+        pass
+
+    repaired = repair_truncated_json(content[start:])
+    if repaired is not None:
+        try:
+            data = json.loads(repaired)
+            if isinstance(data, dict):
+                return data, PARSE_REPAIRED
+        except ValueError:
+            pass
+    return None, PARSE_FAILED
+
+
+class IncrementalJsonParser:
+    """
+    Потоковый разбор JSON-объекта верхнего уровня
+
+    feed() возвращает список событий, ставших известными после очередного куска:
+    - {"type": "item", "field": "strengths", "index": 0, "value": "..."} — элемент массива;
+    - {"type": "field", "field": "summary", "value": "..."} — поле целиком (в том числе массив).
+
+    Текст до первой "{" (например, ```json) пропускается. Некорректный фрагмент
+    не прерывает разбор: такие элементы просто не попадают в события.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self.done = False
+
+        # Состояние сканера
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+        # Уровень 1: ключ и начало значения текущего поля
+        self._expect = "key"  # key -> colon -> value -> comma
+        self._key_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+
+        # Уровень 2: начало текущего элемента массива
+        self._in_array = False
+        self._item_start: Optional[int] = None
+        self._item_index = 0
+
+    def feed(self, chunk: str) -> List[dict]:
+        """Добавить кусок ответа и вернуть новые события"""
+        if self.done or not chunk:
+            return []
+        self._buffer += chunk
+        events: List[dict] = []
+
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer) and not self.done:
+            self._scan(buffer, i, events)
+            i += 1
+
+        self._pos = i
+        return events
+
+    def _scan(self, buffer: str, i: int, events: List[dict]):
+        """Обработать один символ"""
+        char = buffer[i]
+
+        if not self._started:
+            if char == "{":
+                self._started = True
+                self._depth = 1
+            return
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._key_start is not None:
+                    self._key = self._loads(buffer[self._key_start:i + 1])
+                    self._key_start = None
+                    self._expect = "colon"
+            return
+
+        if char in " \t\r\n":
+            return
+
+        if char == '"':
+            self._in_string = True
+
+        if self._depth == 1:
+            if self._expect == "key":
+                if char == '"':
+                    self._key_start = i
+                elif char == "}":
+                    self.done = True
+            elif self._expect == "colon":
+                if char == ":":
+                    self._expect = "value"
+            elif self._expect == "value":
+                self._value_start = i
+                self._expect = "comma"
+                if char in "{[":
+                    self._depth = 2
+                    self._in_array = char == "["
+                    self._item_start = None
+                    self._item_index = 0
+            elif char in ",}":
+                self._finish_field(buffer[self._value_start:i], events)
+                self._expect = "key"
+                if char == "}":
+                    self.done = True
+            return
+
+        if self._depth == 2 and self._in_array:
+            if char in ",]":
+                self._finish_item(buffer[self._item_start:i] if self._item_start is not None else "", events)
+                if char == "]":
+                    self._in_array = False
+                    self._depth = 1
+                return
+            if self._item_start is None:
+                self._item_start = i
+
+        # Вложенные объекты и массивы
+        if char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+
+    def _finish_item(self, raw: str, events: List[dict]):
+        raw = raw.strip()
+        if not raw:
+            return
+        value = self._loads(raw)
+        if value is not None:
+            events.append({"type": "item", "field": self._key, "index": self._item_index, "value": value})
+        self._item_index += 1
+        self._item_start = None
+
+    def _finish_field(self, raw: str, events: List[dict]):
+        value = self._loads(raw.strip())
+        if value is not None:
+            events.append({"type": "field", "field": self._key, "value": value})
+        self._value_start = None
+
+    @staticmethod
+    def _loads(raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except (json.JSONDecodeError, ValueError):
+            return None
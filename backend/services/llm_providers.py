@@ -0,0 +1,245 @@
+"""
+Провайдеры LLM за OpenAIService
+
+Провайдер выполняет один запрос chat.completions и возвращает объекты SDK openai:
+ChatCompletion, а при stream=True — асинхронный поток ChatCompletionChunk с close().
+Лимиты, повторы, кэш и разбор ответа остаются в OpenAIService.
+
+- "openai" — настоящий API (или совместимый шлюз через OPENAI_BASE_URL);
+- "stub" — локальная детерминированная заглушка для нагрузочных тестов без затрат:
+  задержка с логнормальным распределением, потоковая выдача, готовые JSON-ответы,
+  внедрение ошибок 500 и 429 с Retry-After (через те же исключения SDK).
+"""
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from typing import AsyncIterator, Optional
+
+import httpx
+from openai import AsyncOpenAI, InternalServerError, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from backend.config import settings
+from backend.services.tokens import estimate_messages_tokens, estimate_tokens
+
+# Готовые ответы заглушки
+STUB_TEXT_ANALYSIS = {
+    "strengths": ["Конкретные сроки сдачи", "Гарантия 5 лет", "Развитая инфраструктура"],
+    "weaknesses": ["Нет цен", "Мало социального доказательства", "Слабый CTA"],
+    "unique_offers": ["Рассрочка 0%", "Отделка премиум-класса", "Рядом метро"],
+    "recommendations": ["Добавить цены", "Добавить отзывы", "Усилить призыв к действию"],
+    "summary": "Текст убедительный, но не хватает конкретики по цене"
+}
+
+STUB_IMAGE_ANALYSIS = {
+    "description": "Двухкомнатная квартира около 54 м²: кухня-гостиная, спальня, санузел, лоджия",
+    "marketing_insights": [
+        "Удобство планировки: комнаты изолированы, проходных зон нет",
+        "Лифты: два лифта рядом с входом в квартиру",
+        "Санузлы: совмещённый санузел доступен из прихожей",
+        "Комнаты: спальня прямоугольная, окна на одну сторону",
+        "Дополнительные помещения: лоджия и встроенная кладовая"
+    ],
+    "visual_style_score": 7,
+    "visual_style_analysis": "Функциональная планировка с рациональным использованием площади",
+    "recommendations": [
+        "Сильные стороны планировки: изолированные комнаты",
+        "Слабые стороны планировки: один санузел",
+        "Рекомендации по улучшению: гардеробная в прихожей"
+    ]
+}
+
+# Тексты в пакетном запросе (см. TEXT_BATCH_INSTRUCTIONS)
+BATCH_TEXT_ID = re.compile(r'<text id="(\d+)">')
+
+
+class LLMProvider:
+    """Интерфейс провайдера: один вызов chat.completions без повторов"""
+
+    name = "base"
+
+    async def create(self, **kwargs):
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI API через AsyncOpenAI на общем пуле соединений"""
+
+    name = "openai"
+
+    def __init__(self, http_client: httpx.AsyncClient):
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None,
+            http_client=http_client,
+            # Повторы делает OpenAIService через общий ограничитель, а не клиент сам по себе
+            max_retries=0
+        )
+
+    async def create(self, **kwargs):
+        return await self.client.chat.completions.create(**kwargs)
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class _StubStream:
+    """Поток чанков заглушки: тот же интерфейс, что у AsyncStream SDK"""
+
+    def __init__(self, chunks: list, delay: float):
+        self._chunks = chunks
+        self._delay = delay
+        self._closed = False
+
+    def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            if self._closed:
+                return
+            await asyncio.sleep(self._delay)
+            yield chunk
+
+    async def close(self):
+        self._closed = True
+
+
+class StubProvider(LLMProvider):
+    """Детерминированная заглушка OpenAI для нагрузочных тестов"""
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency_ms: float,
+        latency_sigma: float,
+        error_rate: float,
+        rate_limit_rate: float,
+        retry_after: float,
+        stream_chunks: int,
+        seed: int
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stream_chunks = max(1, stream_chunks)
+        self._random = random.Random(seed)
+        self._counter = 0
+
+    def _latency(self) -> float:
+        """Задержка ответа, секунды: логнормальное распределение с медианой latency_ms"""
+        if self.latency_ms <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency_ms / 1000
+        return self._random.lognormvariate(math.log(self.latency_ms), self.latency_sigma) / 1000
+
+    @staticmethod
+    def _error_response(status_code: int, headers: Optional[dict] = None) -> httpx.Response:
+        request = httpx.Request("POST", "http://stub.local/v1/chat/completions")
+        return httpx.Response(status_code, headers=headers or {}, request=request)
+
+    def _maybe_fail(self):
+        """Внедрённые ошибки: 429 с Retry-After и 500"""
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            raise RateLimitError(
+                "Rate limit reached (stub)",
+                response=self._error_response(429, {"retry-after": str(self.retry_after)}),
+                body={"code": "rate_limit_exceeded", "message": "Rate limit reached (stub)"}
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise InternalServerError(
+                "Internal server error (stub)",
+                response=self._error_response(500),
+                body={"code": "server_error", "message": "Internal server error (stub)"}
+            )
+
+    @staticmethod
+    def _content(messages: list) -> str:
+        """Готовый ответ по виду запроса: пакет текстов, изображение или текст"""
+        user = messages[-1].get("content") if messages else ""
+        if isinstance(user, list):
+            return json.dumps(STUB_IMAGE_ANALYSIS, ensure_ascii=False)
+        ids = BATCH_TEXT_ID.findall(user or "")
+        if ids:
+            items = [{"id": int(item_id), **STUB_TEXT_ANALYSIS} for item_id in ids]
+            return json.dumps({"items": items}, ensure_ascii=False)
+        return json.dumps(STUB_TEXT_ANALYSIS, ensure_ascii=False)
+
+    async def create(self, **kwargs):
+        self._counter += 1
+        completion_id = f"chatcmpl-stub-{self._counter}"
+        model = kwargs.get("model", "stub")
+        messages = kwargs.get("messages", [])
+        latency = self._latency()
+        content = self._content(messages)
+
+        if not kwargs.get("stream"):
+            await asyncio.sleep(latency)
+            self._maybe_fail()
+            prompt_tokens = estimate_messages_tokens(messages)
+            completion_tokens = estimate_tokens(content)
+            return ChatCompletion.model_validate({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                    "message": {"role": "assistant", "content": content}
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+
+        # Ошибка потокового запроса приходит до первого чанка, как у настоящего API
+        self._maybe_fail()
+        step = max(1, math.ceil(len(content) / self.stream_chunks))
+        chunks = [
+            ChatCompletionChunk.model_validate({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": None,
+                    "logprobs": None,
+                    "delta": {"content": content[i:i + step]}
+                }]
+            })
+            for i in range(0, len(content), step)
+        ]
+        return _StubStream(chunks, latency / len(chunks))
+
+
+def create_provider(name: str, http_client: httpx.AsyncClient) -> LLMProvider:
+    """Провайдер по имени из настроек (LLM_PROVIDER)"""
+    if name == "stub":
+        return StubProvider(
+            latency_ms=settings.stub_latency_ms,
+            latency_sigma=settings.stub_latency_sigma,
+            error_rate=settings.stub_error_rate,
+            rate_limit_rate=settings.stub_rate_limit_rate,
+            retry_after=settings.stub_retry_after,
+            stream_chunks=settings.stub_stream_chunks,
+            seed=settings.stub_seed
+        )
+    if name != "openai":
+        raise ValueError(f"Неизвестный LLM_PROVIDER: {name} (допустимо: openai, stub)")
+    return OpenAIProvider(http_client)
@@ -0,0 +1,217 @@
+"""
+Метрики времени выполнения в формате Prometheus (без внешних зависимостей)
+
+span("parse.page_load") замеряет этап и записывает его в гистограмму
+buildintel_stage_duration_seconds{stage="..."}, а если этап выполняется внутри
+HTTP-запроса — ещё и в заголовок Server-Timing ответа (см. ServerTimingMiddleware).
+При METRICS_ENABLED=false замеры не выполняются вовсе.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from backend.config import settings
+
+# Границы корзин гистограмм, секунды: от быстрых обращений к диску до минутных вызовов модели
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Этапы текущего HTTP-запроса: список (этап, секунды), его создаёт middleware
+request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с метками: счётчики по корзинам, сумма и количество"""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (последняя — +Inf)..., сумма]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self, enabled: bool, prefix: str = "buildintel"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._metrics: list = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(f"{self.prefix}_{name}", help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, gauges: Optional[dict] = None) -> str:
+        """
+        Текст для /metrics
+
+        gauges — вложенный словарь статистики (как в /stats): каждое числовое значение
+        выводится отдельной метрикой с именем по пути ключей.
+        """
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        if gauges:
+            for name, value in self._flatten(gauges, self.prefix):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def _flatten(cls, data: dict, prefix: str) -> Iterable[Tuple[str, float]]:
+        for key, value in data.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                yield from cls._flatten(value, name)
+            elif isinstance(value, bool):
+                yield name, int(value)
+            elif isinstance(value, (int, float)):
+                yield name, value
+
+
+# Глобальный экземпляр
+metrics = MetricsRegistry(enabled=settings.metrics_enabled)
+
+stage_duration = metrics.histogram(
+    "stage_duration_seconds", "Длительность этапов обработки запроса", ["stage"]
+)
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds", "Длительность HTTP-запросов к API", ["method", "route", "status"]
+)
+openai_requests = metrics.counter(
+    "openai_requests_total", "Запросы к OpenAI по исходу", ["model", "outcome"]
+)
+openai_tokens = metrics.counter(
+    "openai_tokens_total", "Токены OpenAI (по usage; для потоковых ответов — оценка)", ["model", "type"]
+)
+openai_cost = metrics.counter(
+    "openai_cost_usd_total", "Оценка стоимости запросов к OpenAI по usage и таблице цен, USD", ["model"]
+)
+llm_route_requests = metrics.counter(
+    "llm_route_requests_total", "Запросы, начатые на дешёвой модели: accepted или escalated", ["kind", "outcome"]
+)
+llm_route_duration = metrics.histogram(
+    "llm_route_duration_seconds", "Длительность вызова модели по маршруту (cheap, strong, escalated)", ["kind", "route"]
+)
+page_text_tokens = metrics.counter(
+    "page_text_tokens_total", "Токены текста страниц (оценка): raw — весь видимый текст, sent — отобранный для модели", ["type"]
+)
+llm_json_parse = metrics.counter(
+    "llm_json_parse_total", "Разбор JSON-ответов модели: ok, repaired (оборванный ответ починен), failed", ["kind", "outcome"]
+)
+llm_json_retries = metrics.counter(
+    "llm_json_retries_total", "Повторные запросы к модели из-за неразобранного ответа", ["kind"]
+)
+cancelled_requests = metrics.counter(
+    "cancelled_requests_total", "Запросы, обработка которых отменена из-за отключения клиента", ["route"]
+)
+cancelled_resources = metrics.counter(
+    "cancelled_resources_total", "Ресурсы, освобождённые отменой: browser, llm_call, llm_tokens (оценка)", ["resource"]
+)
+deadline_skipped = metrics.counter(
+    "deadline_skipped_total", "Шаги обработки, пропущенные или прерванные из-за дедлайна запроса", ["stage"]
+)
+
+
+@contextmanager
+def span(stage: str):
+    """Замерить этап: гистограмма stage_duration и Server-Timing текущего запроса"""
+    if not metrics.enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_duration.observe(elapsed, stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
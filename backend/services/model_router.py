@@ -0,0 +1,203 @@
+"""
+Маршрутизация запросов между дешёвой и основной моделью
+
+Короткие тексты и изображения с detail=low сначала отправляются дешёвой модели
+(OPENAI_CHEAP_MODEL / OPENAI_CHEAP_VISION_MODEL). Её ответ проверяется: списки из
+ожидаемого числа пунктов, непустое резюме, оценка планировки в допустимых пределах.
+Если проверка не пройдена, запрос повторяется на основной модели (эскалация).
+Для каждого маршрута считаются задержка, стоимость и доля эскалаций — по ним
+подбираются пороги ROUTER_MAX_TEXT_TOKENS и ROUTER_MAX_IMAGE_TOKENS.
+
+Изображение с detail=high оценивается в 1445 токенов, поэтому при пороге по умолчанию
+дешёвая модель получает изображения только при VISION_DETAIL=low.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from backend.config import settings
+from backend.services.json_parsing import PARSE_OK
+from backend.services.metrics import llm_route_duration, llm_route_requests
+
+ROUTE_CHEAP = "cheap"  # Дешёвая модель, ответ принят
+ROUTE_STRONG = "strong"  # Сразу основная модель
+ROUTE_ESCALATED = "escalated"  # Основная модель после отклонённого ответа дешёвой
+
+# Ожидаемое число пунктов в списках (как в системных промптах)
+TEXT_LIST_LIMITS = {
+    "strengths": (3, 5),
+    "weaknesses": (3, 5),
+    "unique_offers": (3, 5),
+    "recommendations": (3, 5)
+}
+IMAGE_LIST_LIMITS = {
+    "marketing_insights": (4, 6),
+    "recommendations": (3, 5)
+}
+
+# Цены по умолчанию, USD за 1M токенов (вход, выход); переопределяются OPENAI_PRICES
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00)
+}
+
+
+def model_price(model: str) -> Optional[Tuple[float, float]]:
+    """Цена модели; для версий с датой (gpt-4o-mini-2024-07-18) — по самому длинному префиксу"""
+    prices = {**DEFAULT_PRICES, **{name: tuple(value) for name, value in settings.openai_prices.items()}}
+    if model in prices:
+        return prices[model]
+    matches = [name for name in prices if model.startswith(name + "-")]
+    return prices[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Стоимость запроса, USD (0 — цена модели неизвестна)"""
+    price = model_price(model)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+def _check_list(data: dict, field: str, limits: Tuple[int, int], problems: List[str]):
+    value = data.get(field)
+    if not isinstance(value, list) or not all(isinstance(item, str) and item.strip() for item in value):
+        problems.append(f"{field}: не список строк")
+        return
+    low, high = limits
+    if not low <= len(value) <= high:
+        problems.append(f"{field}: {len(value)} пунктов вместо {low}-{high}")
+
+
+def _check_text(data: dict, field: str, problems: List[str]):
+    value = data.get(field)
+    if not isinstance(value, str) or not value.strip():
+        problems.append(f"{field}: пусто")
+
+
+def validate_text_analysis(data: dict) -> List[str]:
+    problems: List[str] = []
+    for field, limits in TEXT_LIST_LIMITS.items():
+        _check_list(data, field, limits, problems)
+    _check_text(data, "summary", problems)
+    return problems
+
+
+def validate_image_analysis(data: dict) -> List[str]:
+    problems: List[str] = []
+    for field, limits in IMAGE_LIST_LIMITS.items():
+        _check_list(data, field, limits, problems)
+    _check_text(data, "description", problems)
+    _check_text(data, "visual_style_analysis", problems)
+    score = data.get("visual_style_score")
+    # 0 допускается промптом и схемой ImageAnalysis
+    if isinstance(score, bool) or not isinstance(score, int) or not 0 <= score <= 10:
+        problems.append(f"visual_style_score: {score!r} вне 0-10")
+    return problems
+
+
+def validate_summary(data: dict) -> List[str]:
+    problems: List[str] = []
+    _check_text(data, "summary", problems)
+    return problems
+
+
+VALIDATORS = {
+    "text": validate_text_analysis,
+    "image": validate_image_analysis,
+    "text_reduce": validate_summary
+}
+
+
+class _RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.cost = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+
+class ModelRouter:
+    """Выбор модели для запроса и учёт маршрутов"""
+
+    def __init__(self, cheap_model: str, cheap_vision_model: str, max_text_tokens: int, max_image_tokens: int):
+        self.cheap_model = cheap_model
+        self.cheap_vision_model = cheap_vision_model
+        self.max_text_tokens = max_text_tokens
+        self.max_image_tokens = max_image_tokens
+        self._routes: Dict[Tuple[str, str], _RouteStats] = {}
+        # Запросов, начатых на дешёвой модели, и из них эскалированных
+        self.cheap_attempts = 0
+        self.escalations = 0
+
+    def cheap_model_for(self, kind: str, strong_model: str, prompt_tokens: int) -> Optional[str]:
+        """Дешёвая модель для запроса или None — сразу основная"""
+        if kind == "image":
+            model, limit = self.cheap_vision_model, self.max_image_tokens
+        else:
+            model, limit = self.cheap_model, self.max_text_tokens
+        if not model or model == strong_model or prompt_tokens > limit:
+            return None
+        return model
+
+    @staticmethod
+    def validate(kind: str, data: dict, outcome: str) -> List[str]:
+        """Проблемы ответа дешёвой модели (пустой список — ответ принят)"""
+        problems = [] if outcome == PARSE_OK else [f"ответ разобран с исходом {outcome}"]
+        validator = VALIDATORS.get(kind)
+        if validator:
+            problems.extend(validator(data))
+        return problems
+
+    def record(
+        self,
+        route: str,
+        kind: str,
+        model: str,
+        seconds: float,
+        prompt_tokens: int,
+        completion_tokens: int
+    ):
+        """Учесть вызов модели на маршруте (у эскалации — только вызов основной модели)"""
+        stats = self._routes.setdefault((kind, route), _RouteStats())
+        stats.calls += 1
+        stats.total_seconds += seconds
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+        stats.cost += estimate_cost(model, prompt_tokens, completion_tokens)
+        llm_route_duration.observe(seconds, kind, route)
+
+    def record_cheap_attempt(self, kind: str, accepted: bool):
+        self.cheap_attempts += 1
+        if not accepted:
+            self.escalations += 1
+        llm_route_requests.inc(1, kind, "accepted" if accepted else "escalated")
+
+    def stats(self) -> dict:
+        routes: Dict[str, dict] = {}
+        for (kind, route), stats in sorted(self._routes.items()):
+            routes.setdefault(kind, {})[route] = {
+                "calls": stats.calls,
+                "avg_ms": round(stats.total_seconds / stats.calls * 1000, 1) if stats.calls else None,
+                "prompt_tokens": stats.prompt_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "cost_usd": round(stats.cost, 6)
+            }
+        return {
+            "enabled": bool(self.cheap_model or self.cheap_vision_model),
+            "cheap_attempts": self.cheap_attempts,
+            "escalations": self.escalations,
+            "escalation_rate": round(self.escalations / self.cheap_attempts, 4) if self.cheap_attempts else 0.0,
+            "routes": routes
+        }
+
+
+# Глобальный экземпляр
+model_router = ModelRouter(
+    cheap_model=settings.openai_cheap_model,
+    cheap_vision_model=settings.openai_cheap_vision_model,
+    max_text_tokens=settings.router_max_text_tokens,
+    max_image_tokens=settings.router_max_image_tokens
+)
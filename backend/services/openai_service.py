@@ -1,64 +1,36 @@
 """
 Сервис для работы с OpenAI API
 """
+import asyncio
 import base64
-import json
-import re
-from typing import Optional
+import time
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple, Type
 
-from openai import OpenAI
+import httpx
+from openai import APIConnectionError, APIError, APIStatusError, InternalServerError, RateLimitError
+from pydantic import BaseModel
 
 from backend.config import settings
 from backend.models.schemas import CompetitorAnalysis, ImageAnalysis
+from backend.services.cache_service import analysis_cache, normalize_image, normalize_text
+from backend.services import deadline
+from backend.services.cancellation import RESOURCE_LLM_CALL, RESOURCE_LLM_TOKENS, cancellation
+from backend.services.deadline import DeadlineExceeded, deadlines
+from backend.services.json_parsing import PARSE_FAILED, PARSE_OK, PARSE_REPAIRED, IncrementalJsonParser, parse_json_object
+from backend.services.llm_providers import create_provider
+from backend.services.metrics import llm_json_parse, llm_json_retries, openai_cost, openai_requests, openai_tokens, span
+from backend.services.model_router import ROUTE_CHEAP, ROUTE_ESCALATED, ROUTE_STRONG, estimate_cost, model_router
+from backend.services.rate_limiter import Reservation, parse_retry_after, rate_limiter
+from backend.services.singleflight import SingleFlight
+from backend.services.text_chunking import merge_analyses, split_text
+from backend.services.tokens import estimate_messages_tokens, estimate_tokens
 
+# Версии системных промптов: при изменении промпта версию нужно поднять,
+# чтобы не отдавать из кэша результаты, полученные со старым промптом
+TEXT_PROMPT_VERSION = "text-v1"
+IMAGE_PROMPT_VERSION = "image-v1"
 
-class OpenAIService:
-    """Сервис для анализа через OpenAI"""
-    
-    def __init__(self):
-        # Настройка прокси, если указан
-        client_kwargs = {"api_key": settings.openai_api_key}
-        
-        # Добавляем прокси, если указан
-        if settings.https_proxy or settings.http_proxy:
-            proxy = settings.https_proxy or settings.http_proxy
-            try:
-                import httpx
-                client_kwargs["http_client"] = httpx.Client(
-                    proxies=proxy,
-                    timeout=30.0
-                )
-            except ImportError:
-                # httpx уже должен быть установлен через requirements.txt
-                pass
-        
-        self.client = OpenAI(**client_kwargs)
-        self.model = settings.openai_model
-        self.vision_model = settings.openai_vision_model
-    
-    def _parse_json_response(self, content: str) -> dict:
-        """Извлечь JSON из ответа модели"""
-        if not content or not isinstance(content, str):
-            return {}
-        
-        # Пробуем найти JSON в markdown блоке
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', content)
-        if json_match:
-            content = json_match.group(1)
-        
-        # Пробуем найти JSON объект
-        json_match = re.search(r'\{[\s\S]*\}', content)
-        if json_match:
-            content = json_match.group(0)
-        
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            return {}
-    
-    async def analyze_text(self, text: str) -> CompetitorAnalysis:
-        """Анализ продающего текста в строительстве"""
-        system_prompt = """Ты — эксперт по маркетингу в строительстве и недвижимости. Проанализируй предоставленный продающий текст конкурента в строительной сфере и верни структурированный JSON-ответ.
+TEXT_SYSTEM_PROMPT = """Ты — эксперт по маркетингу в строительстве и недвижимости. Проанализируй предоставленный продающий текст конкурента в строительной сфере и верни структурированный JSON-ответ.
 
 Формат ответа (строго JSON):
 {
@@ -86,22 +58,347 @@ class OpenAIService:
   * Использования строительной терминологии и профессиональных терминов
 - Фокусируйся на специфике строительного маркетинга: доверие, надежность, качество материалов, сроки сдачи, гарантии, технологии строительства, локация, инфраструктура, экологичность"""
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Проанализируй этот продающий текст конкурента в строительстве с точки зрения маркетинга:\n\n{text}"}
-            ],
-            temperature=0.7,
-            max_tokens=2500
+# Дополнение к TEXT_SYSTEM_PROMPT для нескольких текстов в одном запросе
+TEXT_BATCH_INSTRUCTIONS = """
+
+Тебе передано несколько независимых текстов, каждый в блоке <text id="N">...</text>.
+Проанализируй каждый текст отдельно, не смешивая их между собой, и верни один JSON-объект:
+{
+    "items": [
+        {"id": N, "strengths": [...], "weaknesses": [...], "unique_offers": [...], "recommendations": [...], "summary": "..."},
+        ...
+    ]
+}
+В "items" должен быть ровно один элемент на каждый текст, с тем же id, в том же порядке."""
+
+TEXT_REDUCE_PROMPT = """Ты — эксперт по маркетингу в строительстве и недвижимости. Длинный продающий текст конкурента был проанализирован по частям. Тебе переданы резюме анализа каждой части по порядку.
+
+Объедини их в одно краткое резюме всего текста с точки зрения маркетинга в строительстве: 2-4 предложения, без повторов, на русском языке.
+
+Формат ответа (строго JSON):
+{"summary": "Резюме анализа всего текста"}"""
+
+# Ключевые слова JSON Schema, которые не принимает строгий режим structured outputs
+_UNSUPPORTED_SCHEMA_KEYS = {"title", "default", "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum"}
+
+
+def strict_json_schema(model: Type[BaseModel]) -> dict:
+    """
+    JSON Schema модели Pydantic для строгого режима structured outputs
+
+    Все поля обязательны, лишние запрещены, неподдерживаемые ключевые слова
+    (значения по умолчанию, границы чисел) убираются — границы остаются в промпте
+    и проверяются при валидации ответа.
+    """
+    def convert(node):
+        if isinstance(node, list):
+            return [convert(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        result = {key: convert(value) for key, value in node.items() if key not in _UNSUPPORTED_SCHEMA_KEYS}
+        if result.get("type") == "object" and "properties" in result:
+            result["required"] = list(result["properties"])
+            result["additionalProperties"] = False
+        return result
+
+    return convert(model.model_json_schema())
+
+
+TEXT_SCHEMA = strict_json_schema(CompetitorAnalysis)
+IMAGE_SCHEMA = strict_json_schema(ImageAnalysis)
+TEXT_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                **TEXT_SCHEMA,
+                "properties": {"id": {"type": "integer"}, **TEXT_SCHEMA["properties"]},
+                "required": ["id", *TEXT_SCHEMA["required"]]
+            }
+        }
+    },
+    "required": ["items"],
+    "additionalProperties": False
+}
+RESPONSE_SCHEMAS = {
+    "text": ("competitor_analysis", TEXT_SCHEMA),
+    "image": ("image_analysis", IMAGE_SCHEMA),
+    "text_batch": ("competitor_analysis_batch", TEXT_BATCH_SCHEMA),
+    "text_reduce": ("analysis_summary", {
+        "type": "object",
+        "properties": {"summary": {"type": "string"}},
+        "required": ["summary"],
+        "additionalProperties": False
+    })
+}
+
+
+def describe_api_error(e: APIError) -> str:
+    """Понятное пользователю сообщение об ошибке OpenAI API"""
+    error_message = str(e)
+    status_code = str(getattr(e, "status_code", ""))
+    if "unsupported_country_region_territory" in error_message or "403" in status_code:
+        error_message = "OpenAI API недоступен в вашем регионе. Используйте VPN или прокси для доступа к API."
+    elif "401" in status_code or "invalid_api_key" in error_message.lower():
+        error_message = "Неверный API ключ OpenAI. Проверьте файл .env"
+    elif "429" in status_code or "rate_limit" in error_message.lower():
+        error_message = "Превышен лимит запросов к OpenAI API. Попробуйте позже."
+    return error_message
+
+
+class OpenAIService:
+    """Сервис для анализа через OpenAI"""
+    
+    def __init__(self):
+        self.http_client = self._create_http_client()
+        # OpenAI API или локальная заглушка (LLM_PROVIDER)
+        self.provider = create_provider(settings.llm_provider, self.http_client)
+        self.model = settings.openai_model
+        self.vision_model = settings.openai_vision_model
+        self.cache = analysis_cache
+        self.limiter = rate_limiter
+        self.router = model_router
+        # Одновременные анализы одинакового содержимого разделяют один вызов модели
+        self.inflight = SingleFlight()
+        
+        # Счётчики разбора JSON-ответов
+        self.json_outcomes = {PARSE_OK: 0, PARSE_REPAIRED: 0, PARSE_FAILED: 0}
+        self.json_retries = 0
+    
+    def _create_http_client(self) -> httpx.AsyncClient:
+        """
+        Общий асинхронный HTTP-клиент с пулом соединений.
+        
+        Один клиент живёт всё время работы процесса: TCP/TLS соединения к OpenAI
+        переиспользуются между запросами, а сами запросы не блокируют event loop.
+        """
+        # Прокси, если указан
+        proxy = settings.https_proxy or settings.http_proxy or None
+        
+        return httpx.AsyncClient(
+            proxies=proxy,
+            timeout=httpx.Timeout(settings.openai_timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections,
+                keepalive_expiry=settings.openai_keepalive_expiry
+            )
         )
+    
+    async def aclose(self):
+        """Закрыть пул соединений (при остановке приложения)"""
+        await self.provider.aclose()
+        await self.http_client.aclose()
+    
+    async def _send(self, **kwargs) -> Tuple[object, Reservation]:
+        """
+        Запрос к chat.completions через ограничитель RPM/TPM
         
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("Пустой ответ от OpenAI API")
+        Перед запросом резервируется оценка токенов (вход + max_tokens). На 429
+        очередь приостанавливается по Retry-After, запрос повторяется с
+        экспоненциальной задержкой; так же повторяются таймауты, обрывы и 5xx.
+        
+        С дедлайном запроса ожидание в очереди и сам вызов ограничены остатком бюджета,
+        а повтор не выполняется, если до дедлайна его не дождаться (DeadlineExceeded).
+        """
+        estimate = estimate_messages_tokens(kwargs["messages"]) + kwargs.get("max_tokens", 0)
+        attempt = 0
+        model = kwargs["model"]
+        while True:
+            deadline.check("очередь к модели")
+            try:
+                with span("llm.queue"):
+                    reservation = await self._within_deadline(self.limiter.acquire(estimate))
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Бюджет времени запроса исчерпан в очереди к модели")
+            try:
+                with span("llm.call"):
+                    response = await self._within_deadline(self.provider.create(**kwargs))
+                openai_requests.inc(1, model, "ok")
+                return response, reservation
+            except asyncio.TimeoutError:
+                # Ответ уже не нужен клиенту: соединение закрыто, токены не израсходованы
+                openai_requests.inc(1, model, "deadline")
+                self.limiter.release(reservation)
+                deadlines.skip("llm_call", model)
+                raise DeadlineExceeded("Бюджет времени запроса исчерпан во время вызова модели")
+            except RateLimitError as e:
+                openai_requests.inc(1, model, "rate_limited")
+                self.limiter.release(reservation)
+                # Исчерпанная квота не восстановится от ожидания
+                if attempt >= self.limiter.max_retries or e.code == "insufficient_quota":
+                    raise
+                delay = self.limiter.on_rate_limited(parse_retry_after(e.response.headers), attempt)
+                print(f"OpenAI 429, повтор через {delay:.1f} с (попытка {attempt + 1})")
+            except (APIConnectionError, InternalServerError) as e:
+                openai_requests.inc(1, model, "error")
+                self.limiter.release(reservation)
+                if attempt >= self.limiter.max_retries:
+                    raise
+                delay = self.limiter.backoff_delay(attempt)
+                print(f"Ошибка OpenAI API ({type(e).__name__}), повтор через {delay:.1f} с (попытка {attempt + 1})")
+            except asyncio.CancelledError:
+                # Клиент отключился или истёк таймаут этапа: httpx закрывает соединение,
+                # ответ не будет сгенерирован до конца, резерв токенов возвращается
+                openai_requests.inc(1, model, "cancelled")
+                self.limiter.release(reservation)
+                cancellation.record_resource(RESOURCE_LLM_CALL)
+                cancellation.record_resource(RESOURCE_LLM_TOKENS, reservation.tokens)
+                raise
+            except BaseException:
+                self.limiter.release(reservation)
+                raise
+            if not deadline.has_time(delay):
+                raise DeadlineExceeded(f"Повтор запроса к модели не успеть до дедлайна (задержка {delay:.1f} с)")
+            self.limiter.retries += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    @staticmethod
+    async def _within_deadline(awaitable):
+        """Ожидание, ограниченное остатком бюджета запроса (без дедлайна — без ограничения)"""
+        left = deadline.remaining()
+        if left is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, left)
+    
+    async def _complete(self, **kwargs):
+        """Запрос без потоковой выдачи; резерв токенов исправляется по usage ответа"""
+        response, reservation = await self._send(**kwargs)
+        usage = getattr(response, "usage", None)
+        self.limiter.settle(reservation, usage.total_tokens if usage else None)
+        if usage:
+            openai_tokens.inc(usage.prompt_tokens, kwargs["model"], "prompt")
+            openai_tokens.inc(usage.completion_tokens, kwargs["model"], "completion")
+            openai_cost.inc(estimate_cost(kwargs["model"], usage.prompt_tokens, usage.completion_tokens), kwargs["model"])
+        return response
+    
+    @staticmethod
+    def _response_format(kind: str) -> Optional[dict]:
+        """response_format запроса: схема ответа (по моделям Pydantic), JSON mode или ничего"""
+        mode = settings.openai_response_format
+        if mode == "json_schema":
+            name, schema = RESPONSE_SCHEMAS[kind]
+            return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+        if mode == "json_object":
+            return {"type": "json_object"}
+        return None
+    
+    def _json_request(self, kind: str, **kwargs) -> dict:
+        """Параметры запроса с ответом в JSON"""
+        response_format = self._response_format(kind)
+        if response_format is not None:
+            kwargs["response_format"] = response_format
+        return kwargs
+    
+    def _parse_json(self, kind: str, content: Optional[str]) -> Tuple[Optional[dict], str]:
+        """Разобрать ответ модели (с починкой оборванного JSON) и учесть исход в метриках"""
+        data, outcome = parse_json_object(content)
+        self.json_outcomes[outcome] += 1
+        llm_json_parse.inc(1, kind, outcome)
+        if outcome == PARSE_REPAIRED:
+            print(f"Оборванный JSON-ответ модели починен ({kind})")
+        return data, outcome
+    
+    async def _complete_json(self, kind: str, retries: int, **kwargs) -> Tuple[dict, str, Tuple[int, int]]:
+        """
+        Запрос с ответом в JSON: (объект, исход разбора, (токены запроса, токены ответа))
+        
+        Оборванный ответ сначала чинится локально; запрос повторяется, только если
+        починить не удалось (не более retries раз), затем — ValueError.
+        Токены — по usage всех попыток.
+        """
+        kwargs = self._json_request(kind, **kwargs)
+        attempt = 0
+        prompt_tokens = completion_tokens = 0
+        while True:
+            response = await self._complete(**kwargs)
+            usage = getattr(response, "usage", None)
+            if usage:
+                prompt_tokens += usage.prompt_tokens
+                completion_tokens += usage.completion_tokens
+            content = response.choices[0].message.content
+            if not content:
+                raise ValueError("Пустой ответ от OpenAI API")
+            data, outcome = self._parse_json(kind, content)
+            if data is not None:
+                return data, outcome, (prompt_tokens, completion_tokens)
+            if attempt >= retries:
+                raise ValueError("Не удалось разобрать JSON-ответ модели")
+            attempt += 1
+            self.json_retries += 1
+            llm_json_retries.inc(1, kind)
+            print(f"Не удалось разобрать JSON-ответ модели ({kind}), повтор запроса (попытка {attempt})")
+    
+    async def _routed_json(
+        self,
+        kind: str,
+        strong_model: str,
+        messages: list,
+        **kwargs
+    ) -> Tuple[dict, str]:
+        """
+        Запрос с ответом в JSON через маршрутизатор моделей: (объект, исход разбора)
         
-        data = self._parse_json_response(content)
+        Короткий запрос сначала идёт к дешёвой модели (без повторов при неразобранном
+        ответе); ответ, не прошедший проверку, отбрасывается, и запрос повторяется на
+        основной модели. Так же эскалируется ошибка API дешёвой модели (неизвестная
+        модель, не поддерживается формат ответа), кроме 429: исчерпанный лимит аккаунта
+        основная модель не обойдёт.
+        """
+        cheap_model = self.router.cheap_model_for(kind, strong_model, estimate_messages_tokens(messages))
+        route = ROUTE_STRONG
+        if cheap_model:
+            started = time.perf_counter()
+            try:
+                data, outcome, usage = await self._complete_json(
+                    kind, 0, model=cheap_model, messages=messages, **kwargs
+                )
+                problems = self.router.validate(kind, data, outcome)
+            except ValueError as e:
+                data, usage, problems = None, (0, 0), [str(e)]
+            except APIStatusError as e:
+                if isinstance(e, RateLimitError):
+                    raise
+                data, usage, problems = None, (0, 0), [f"ошибка API {e.status_code}: {e.message}"]
+            self.router.record(ROUTE_CHEAP, kind, cheap_model, time.perf_counter() - started, *usage)
+            self.router.record_cheap_attempt(kind, accepted=not problems)
+            if not problems:
+                return data, outcome
+            if data is not None and not deadline.has_time(settings.deadline_llm_min):
+                # До дедлайна основную модель не дождаться: лучше слабый ответ, чем никакого
+                deadlines.skip("escalation", "; ".join(problems))
+                return data, outcome
+            print(f"Ответ {cheap_model} ({kind}) отклонён: {'; '.join(problems)}; повтор на {strong_model}")
+            route = ROUTE_ESCALATED
         
+        started = time.perf_counter()
+        data, outcome, usage = await self._complete_json(
+            kind, settings.openai_parse_retries, model=strong_model, messages=messages, **kwargs
+        )
+        self.router.record(route, kind, strong_model, time.perf_counter() - started, *usage)
+        return data, outcome
+    
+    def json_stats(self) -> dict:
+        """Исходы разбора JSON-ответов модели"""
+        total = sum(self.json_outcomes.values())
+        return {
+            **self.json_outcomes,
+            "retries": self.json_retries,
+            "failure_rate": round(self.json_outcomes[PARSE_FAILED] / total, 4) if total else 0.0,
+            "repair_rate": round(self.json_outcomes[PARSE_REPAIRED] / total, 4) if total else 0.0
+        }
+    
+    def _text_messages(self, text: str) -> list:
+        """Сообщения для анализа продающего текста"""
+        return [
+            {"role": "system", "content": TEXT_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Проанализируй этот продающий текст конкурента в строительстве с точки зрения маркетинга:\n\n{text}"}
+        ]
+    
+    @staticmethod
+    def _build_text_analysis(data: dict) -> CompetitorAnalysis:
         return CompetitorAnalysis(
             strengths=data.get("strengths", []),
             weaknesses=data.get("weaknesses", []),
@@ -110,8 +407,215 @@ class OpenAIService:
             summary=data.get("summary", "")
         )
     
-    async def analyze_image(self, image_base64: str, mime_type: str = "image/jpeg") -> ImageAnalysis:
-        """Анализ планировки квартиры"""
+    def _text_cache_key(self, text: str) -> str:
+        return self.cache.make_key("text", self.model, TEXT_PROMPT_VERSION, normalize_text(text))
+    
+    def is_long_text(self, text: str) -> bool:
+        """Текст не помещается в один запрос и анализируется по частям"""
+        return self.text_prompt_tokens(text) > settings.text_chunk_threshold_tokens
+    
+    async def analyze_text(self, text: str) -> CompetitorAnalysis:
+        """Анализ продающего текста в строительстве (длинного — по частям)"""
+        cache_key = self._text_cache_key(text)
+        if self.is_long_text(text):
+            return await self.inflight.do(cache_key, lambda: self._analyze_long_text(cache_key, text))
+        return await self.inflight.do(cache_key, lambda: self._analyze_text(cache_key, text))
+    
+    async def _analyze_text(self, cache_key: str, text: str) -> CompetitorAnalysis:
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return CompetitorAnalysis.model_validate(cached)
+        
+        data, outcome = await self._routed_json(
+            "text",
+            self.model,
+            self._text_messages(text),
+            temperature=0.7,
+            max_tokens=2500
+        )
+        
+        analysis = self._build_text_analysis(data)
+        # Починенный (оборванный) ответ неполон — отдаём, но не кэшируем
+        if outcome == PARSE_OK:
+            await self.cache.set(cache_key, analysis.model_dump())
+        return analysis
+    
+    async def _analyze_long_text(self, cache_key: str, text: str) -> CompetitorAnalysis:
+        """
+        Map-reduce: части текста анализируются параллельно, результаты объединяются
+        
+        Части кэшируются как обычные тексты, поэтому после сбоя одной из них повтор
+        запроса платит только за неудавшиеся. Время ответа определяется самой
+        медленной частью, а не суммой.
+        """
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return CompetitorAnalysis.model_validate(cached)
+        
+        # Часть вместе с промптом должна быть короче порога, иначе её снова начнут делить
+        overhead = self.text_prompt_tokens("")
+        chunk_tokens = max(1, min(settings.text_chunk_tokens, settings.text_chunk_threshold_tokens - overhead))
+        chunks = split_text(text, chunk_tokens)
+        print(f"Длинный текст (~{estimate_tokens(text)} токенов) анализируется по частям: {len(chunks)}")
+        
+        semaphore = asyncio.Semaphore(max(1, settings.text_chunk_concurrency))
+        
+        async def analyze_chunk(chunk: str) -> CompetitorAnalysis:
+            async with semaphore:
+                return await self.analyze_text(chunk)
+        
+        results = await asyncio.gather(*(analyze_chunk(chunk) for chunk in chunks), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        
+        analysis = merge_analyses(results, settings.text_reduce_max_items)
+        summaries = [result.summary.strip() for result in results if result.summary.strip()]
+        if len(summaries) > 1 and not deadline.has_time(settings.deadline_llm_min):
+            # Резюме частей подряд вместо общего: объединять некогда
+            deadlines.skip("reduce")
+        elif len(summaries) > 1:
+            analysis.summary = await self._reduce_summaries(summaries) or analysis.summary
+        await self.cache.set(cache_key, analysis.model_dump())
+        return analysis
+    
+    async def _reduce_summaries(self, summaries: List[str]) -> Optional[str]:
+        """Одно резюме из резюме частей (короткий запрос); None — если не удалось"""
+        numbered = "\n".join(f"{number}. {summary}" for number, summary in enumerate(summaries, start=1))
+        try:
+            with span("llm.reduce"):
+                data, _ = await self._routed_json(
+                    "text_reduce",
+                    self.model,
+                    [
+                        {"role": "system", "content": TEXT_REDUCE_PROMPT},
+                        {"role": "user", "content": f"Резюме частей текста:\n\n{numbered}"}
+                    ],
+                    temperature=0.7,
+                    max_tokens=400
+                )
+        except (APIError, ValueError, DeadlineExceeded) as e:
+            print(f"Не удалось объединить резюме частей, используем их подряд: {e}")
+            return None
+        summary = data.get("summary")
+        return summary.strip() if isinstance(summary, str) and summary.strip() else None
+    
+    async def get_cached_text(self, text: str) -> Optional[CompetitorAnalysis]:
+        """Результат анализа текста из кэша, без обращения к модели"""
+        cached = await self.cache.get(self._text_cache_key(text))
+        if cached is None:
+            return None
+        return CompetitorAnalysis.model_validate(cached)
+    
+    def text_prompt_tokens(self, text: str) -> int:
+        """Оценка токенов запроса анализа одного текста"""
+        return estimate_messages_tokens(self._text_messages(text))
+    
+    def _text_batch_messages(self, texts: List[str]) -> list:
+        """Сообщения для анализа нескольких текстов одним запросом"""
+        blocks = "\n\n".join(
+            f'<text id="{number}">\n{text}\n</text>' for number, text in enumerate(texts, start=1)
+        )
+        return [
+            {"role": "system", "content": TEXT_SYSTEM_PROMPT + TEXT_BATCH_INSTRUCTIONS},
+            {"role": "user", "content": f"Проанализируй эти продающие тексты конкурентов в строительстве с точки зрения маркетинга:\n\n{blocks}"}
+        ]
+    
+    def text_batch_prompt_tokens(self, texts: List[str]) -> int:
+        """Оценка токенов запроса анализа нескольких текстов"""
+        return estimate_messages_tokens(self._text_batch_messages(texts))
+    
+    @staticmethod
+    def _is_complete_text_analysis(analysis: CompetitorAnalysis) -> bool:
+        """Разобранный элемент пакета похож на полноценный анализ (а не обрывок)"""
+        return bool(analysis.summary.strip()) and any(
+            [analysis.strengths, analysis.weaknesses, analysis.unique_offers, analysis.recommendations]
+        )
+    
+    async def analyze_text_batch(
+        self,
+        texts: List[str],
+        max_tokens_per_text: int
+    ) -> List[Optional[CompetitorAnalysis]]:
+        """
+        Анализ нескольких текстов одним запросом
+        
+        Возвращает список той же длины: анализ или None, если элемент ответа
+        отсутствует или не прошёл проверку (такие тексты анализируются по одному).
+        Удачные результаты кэшируются под тем же ключом, что и при одиночном анализе.
+        """
+        # Без повтора: неразобранные тексты и так анализируются по одному
+        try:
+            data, outcome, _ = await self._complete_json(
+                "text_batch",
+                0,
+                model=self.model,
+                messages=self._text_batch_messages(texts),
+                temperature=0.7,
+                max_tokens=max_tokens_per_text * len(texts)
+            )
+        except ValueError:
+            return [None] * len(texts)
+        items = data.get("items")
+        if not isinstance(items, list):
+            return [None] * len(texts)
+        if outcome == PARSE_REPAIRED and items:
+            # Последний элемент починенного ответа оборван
+            items = items[:-1]
+        
+        # Сопоставляем по id; без id — по позиции
+        by_id = {}
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            item_id = item.get("id", position + 1)
+            if isinstance(item_id, str) and item_id.strip().isdigit():
+                item_id = int(item_id)
+            if isinstance(item_id, int) and item_id not in by_id:
+                by_id[item_id] = item
+        
+        results: List[Optional[CompetitorAnalysis]] = []
+        for number, text in enumerate(texts, start=1):
+            item = by_id.get(number)
+            analysis = None
+            if item is not None:
+                try:
+                    analysis = CompetitorAnalysis.model_validate(
+                        {key: value for key, value in item.items() if key != "id"}
+                    )
+                except ValueError:
+                    analysis = None
+            if analysis is not None and not self._is_complete_text_analysis(analysis):
+                analysis = None
+            if analysis is not None:
+                await self.cache.set(self._text_cache_key(text), analysis.model_dump())
+            results.append(analysis)
+        return results
+    
+    def stream_text(self, text: str) -> AsyncIterator[dict]:
+        """
+        Анализ продающего текста с выдачей событий по мере генерации (см. _stream_analysis)
+        
+        Длинный текст анализируется по частям; события item/field/result приходят
+        после объединения.
+        """
+        if self.is_long_text(text):
+            return self._stream_long_text(text)
+        return self._stream_analysis(
+            kind="text",
+            cache_key=self._text_cache_key(text),
+            model=self.model,
+            messages=self._text_messages(text),
+            build=self._build_text_analysis
+        )
+    
+    async def _stream_long_text(self, text: str) -> AsyncIterator[dict]:
+        analysis = await self.analyze_text(text)
+        for event in self._result_events(analysis, cached=False):
+            yield event
+    
+    def _image_messages(self, image_base64: str, mime_type: str, detail: str) -> list:
+        """Сообщения для анализа планировки"""
         system_prompt = """Ты — эксперт по анализу планировок квартир и недвижимости. Проанализируй планировку квартиры на изображении и верни структурированный JSON-ответ.
 
 Формат ответа (строго JSON):
@@ -141,36 +645,28 @@ class OpenAIService:
 - Будь конкретен в анализе: указывай размеры, расположение, функциональность
 - Оценивай: удобство использования пространства, логику расположения помещений, изолированность комнат, доступность санузлов, удобство лифтов"""
 
-        response = self.client.chat.completions.create(
-            model=self.vision_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Проанализируй эту планировку квартиры. Оцени удобство планировки, расположение комнат, санузлов, лифтов. Опиши сильные и слабые стороны планировки."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{image_base64}"
-                            }
+        return [
+            {"role": "system", "content": system_prompt},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Проанализируй эту планировку квартиры. Оцени удобство планировки, расположение комнат, санузлов, лифтов. Опиши сильные и слабые стороны планировки."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{image_base64}",
+                            "detail": detail
                         }
-                    ]
-                }
-            ],
-            temperature=0.7,
-            max_tokens=2500
-        )
-        
-        content = response.choices[0].message.content
-        if not content:
-            raise ValueError("Пустой ответ от OpenAI API")
-        
-        data = self._parse_json_response(content)
-        
+                    }
+                ]
+            }
+        ]
+    
+    @staticmethod
+    def _build_image_analysis(data: dict) -> ImageAnalysis:
         return ImageAnalysis(
             description=data.get("description", ""),
             marketing_insights=data.get("marketing_insights", []),
@@ -179,6 +675,155 @@ class OpenAIService:
             recommendations=data.get("recommendations", [])
         )
     
+    def _image_cache_key(self, image_base64: str, mime_type: str, detail: str) -> str:
+        # detail=auto — прежний ключ, чтобы не терять уже накопленный кэш
+        kind = "image" if detail == "auto" else f"image-{detail}"
+        return self.cache.make_key(
+            kind, self.vision_model, IMAGE_PROMPT_VERSION, normalize_image(image_base64, mime_type)
+        )
+    
+    async def analyze_image(
+        self,
+        image_base64: str,
+        mime_type: str = "image/jpeg",
+        detail: str = "auto"
+    ) -> ImageAnalysis:
+        """Анализ планировки квартиры (detail — уровень детализации изображения для модели)"""
+        cache_key = self._image_cache_key(image_base64, mime_type, detail)
+        return await self.inflight.do(
+            cache_key,
+            lambda: self._analyze_image(cache_key, image_base64, mime_type, detail)
+        )
+    
+    async def _analyze_image(
+        self,
+        cache_key: str,
+        image_base64: str,
+        mime_type: str,
+        detail: str
+    ) -> ImageAnalysis:
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return ImageAnalysis.model_validate(cached)
+        
+        data, outcome = await self._routed_json(
+            "image",
+            self.vision_model,
+            self._image_messages(image_base64, mime_type, detail),
+            temperature=0.7,
+            max_tokens=2500
+        )
+        
+        analysis = self._build_image_analysis(data)
+        if outcome == PARSE_OK:
+            await self.cache.set(cache_key, analysis.model_dump())
+        return analysis
+    
+    def stream_image(
+        self,
+        image_base64: str,
+        mime_type: str = "image/jpeg",
+        detail: str = "auto"
+    ) -> AsyncIterator[dict]:
+        """Анализ планировки с выдачей событий по мере генерации (см. _stream_analysis)"""
+        return self._stream_analysis(
+            kind="image",
+            cache_key=self._image_cache_key(image_base64, mime_type, detail),
+            model=self.vision_model,
+            messages=self._image_messages(image_base64, mime_type, detail),
+            build=self._build_image_analysis
+        )
+    
+    async def _stream_analysis(
+        self,
+        kind: str,
+        cache_key: str,
+        model: str,
+        messages: list,
+        build: Callable[[dict], BaseModel]
+    ) -> AsyncIterator[dict]:
+        """
+        Потоковый анализ: события по мере генерации ответа моделью
+        
+        - {"type": "delta", "text": ...} — очередной фрагмент ответа;
+        - {"type": "item", "field": ..., "index": ..., "value": ...} — готовый элемент списка;
+        - {"type": "field", "field": ..., "value": ...} — готовое поле ответа;
+        - {"type": "result", "analysis": {...}, "cached": ...} — итоговый проверенный результат.
+        
+        Результат из кэша отдаётся теми же событиями item/field/result, но сразу.
+        Оборванный ответ чинится, но повторить уже показанный поток нельзя:
+        если починить не удалось — ValueError.
+        """
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            for event in self._result_events(build(cached), cached=True):
+                yield event
+            return
+        
+        stream, reservation = await self._send(**self._json_request(
+            kind,
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=2500,
+            stream=True
+        ))
+        parser = IncrementalJsonParser()
+        parts = []
+        interrupted = False
+        try:
+            with span("llm.stream"):
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    yield {"type": "delta", "text": delta}
+                    for event in parser.feed(delta):
+                        yield event
+        except (asyncio.CancelledError, GeneratorExit):
+            # Потоковый ответ закрыт до конца: клиент отключился
+            interrupted = True
+            raise
+        finally:
+            # Клиент отключился или ошибка — закрываем соединение с OpenAI сразу
+            await stream.close()
+            # В потоке usage не приходит — исправляем резерв по оценке ответа
+            prompt_tokens = estimate_messages_tokens(messages)
+            completion_tokens = estimate_tokens("".join(parts))
+            self.limiter.settle(reservation, prompt_tokens + completion_tokens)
+            if interrupted:
+                cancellation.record_resource(RESOURCE_LLM_CALL)
+                cancellation.record_resource(
+                    RESOURCE_LLM_TOKENS, max(0, reservation.tokens - prompt_tokens - completion_tokens)
+                )
+            openai_tokens.inc(prompt_tokens, model, "prompt")
+            openai_tokens.inc(completion_tokens, model, "completion")
+        
+        content = "".join(parts)
+        if not content:
+            raise ValueError("Пустой ответ от OpenAI API")
+        
+        data, outcome = self._parse_json(kind, content)
+        if data is None:
+            raise ValueError("Не удалось разобрать JSON-ответ модели")
+        analysis = build(data)
+        if outcome == PARSE_OK:
+            await self.cache.set(cache_key, analysis.model_dump())
+        yield {"type": "result", "analysis": analysis.model_dump(), "cached": False}
+    
+    @staticmethod
+    def _result_events(analysis: BaseModel, cached: bool) -> Iterator[dict]:
+        """Готовый результат теми же событиями item/field/result, что и потоковый ответ"""
+        for field, value in analysis.model_dump().items():
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    yield {"type": "item", "field": field, "index": index, "value": item}
+            yield {"type": "field", "field": field, "value": value}
+        yield {"type": "result", "analysis": analysis.model_dump(), "cached": cached}
+    
     async def analyze_parsed_content(
         self, 
         title: Optional[str], 
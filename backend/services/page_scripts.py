@@ -0,0 +1,180 @@
+"""
+JavaScript, выполняемый в браузере парсера
+"""
+
+# Инструментирование страницы: счётчик незавершённых fetch/XHR и время последней
+# активности (сетевые запросы, изменения DOM). Регистрируется через CDP
+# (Page.addScriptToEvaluateOnNewDocument) и выполняется до скриптов самой страницы.
+# Повторный запуск безопасен.
+INSTRUMENT_JS = """
+(() => {
+    if (window.__biReady) return;
+    const state = window.__biReady = { inflight: 0, lastActivity: Date.now() };
+    const touch = () => { state.lastActivity = Date.now(); };
+
+    if (window.fetch) {
+        const originalFetch = window.fetch;
+        window.fetch = function (...args) {
+            state.inflight++;
+            touch();
+            return originalFetch.apply(this, args).finally(() => {
+                state.inflight = Math.max(0, state.inflight - 1);
+                touch();
+            });
+        };
+    }
+
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        state.inflight++;
+        touch();
+        this.addEventListener('loadend', () => {
+            state.inflight = Math.max(0, state.inflight - 1);
+            touch();
+        }, { once: true });
+        return originalSend.apply(this, args);
+    };
+
+    const observe = () => {
+        new MutationObserver(touch).observe(document.documentElement, {
+            childList: true, subtree: true, attributes: true, characterData: true
+        });
+    };
+    if (document.documentElement) {
+        observe();
+    } else {
+        document.addEventListener('readystatechange', observe, { once: true });
+    }
+})();
+"""
+
+# Проба готовности страницы. Если инструментирование через CDP недоступно,
+# ставит его на лету (запросы, начатые раньше, тогда видны только по Resource Timing).
+READINESS_PROBE_JS = INSTRUMENT_JS + """
+const state = window.__biReady;
+let lastResourceEnd = 0;
+for (const entry of performance.getEntriesByType('resource')) {
+    if (entry.responseEnd > lastResourceEnd) lastResourceEnd = entry.responseEnd;
+}
+lastResourceEnd = lastResourceEnd ? performance.timeOrigin + lastResourceEnd : 0;
+return {
+    readyState: document.readyState,
+    inflight: state.inflight,
+    idleMs: Date.now() - Math.max(state.lastActivity, lastResourceEnd)
+};
+"""
+
+# Извлечение контента за один вызов execute_script вместо page_source + BeautifulSoup
+# + отдельного find_element(body).text. arguments[0] — ограничение длины видимого текста.
+# Видимый текст возвращается блоками [текст, всего символов, в ссылках, в служебных
+# элементах, в заголовках] — тот же обход, что collect_blocks в content_extraction.
+EXTRACT_CONTENT_JS = """
+const maxChars = arguments[0] || 200000;
+const clean = (value) => (value || '').replace(/\\s+/g, ' ').trim();
+
+const h1 = document.querySelector('h1');
+
+let firstParagraph = null;
+const container = document.querySelector('main') || document.querySelector('article') || document.body;
+if (container) {
+    for (const p of container.querySelectorAll('p')) {
+        const text = clean(p.textContent);
+        if (text.length > 50) {
+            firstParagraph = text.slice(0, 500);
+            break;
+        }
+    }
+}
+
+const meta = document.querySelector('meta[name="description" i], meta[property="og:description"]');
+
+const jsonLd = [];
+for (const script of document.querySelectorAll('script[type="application/ld+json"]')) {
+    if (jsonLd.length >= 10) break;
+    try {
+        jsonLd.push(JSON.parse(script.textContent));
+    } catch (e) {
+        // Битый JSON-LD на странице — пропускаем
+    }
+}
+
+const BLOCK_TAGS = new Set([
+    'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'nav', 'aside',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'ul', 'ol', 'dl', 'dt', 'dd',
+    'table', 'tr', 'td', 'th', 'blockquote', 'pre', 'form', 'figure', 'figcaption', 'br'
+]);
+const SKIP_TAGS = new Set(['script', 'style', 'noscript', 'template', 'svg', 'iframe', 'head']);
+const HEADING_TAGS = new Set(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']);
+const BOILERPLATE_TAGS = new Set(['nav', 'aside', 'menu', 'dialog']);
+const BOILERPLATE_ROLES = new Set([
+    'navigation', 'banner', 'contentinfo', 'complementary', 'search', 'menu', 'menubar', 'dialog', 'alertdialog'
+]);
+const BOILERPLATE_MARKER = /(?:^|[\\s_-])(?:cookies?|consent|gdpr|breadcrumbs?|navbar|nav|menu|sidebar|footer|social|share|subscribe|popup|modal)(?:$|[\\s_-])/i;
+
+const isBoilerplate = (el, tag, inContent) => {
+    if (tag === 'header' || tag === 'footer') return !inContent;
+    if (BOILERPLATE_TAGS.has(tag)) return true;
+    if (BOILERPLATE_ROLES.has((el.getAttribute('role') || '').toLowerCase())) return true;
+    if (tag === 'body' || tag === 'main' || tag === 'article') return false;
+    const marker = `${el.getAttribute('class') || ''} ${el.id || ''}`;
+    return BOILERPLATE_MARKER.test(marker) && !el.querySelector('h1');
+};
+const isHidden = (el) => el.checkVisibility ? !el.checkVisibility() : el.getClientRects().length === 0;
+
+const blocks = [];
+let collected = 0;
+let parts = [];
+let counts = [0, 0, 0, 0];
+const add = (value, ctx) => {
+    const size = clean(value).length;
+    if (!size) return;
+    parts.push(value);
+    counts[0] += size;
+    if (ctx.link) counts[1] += size;
+    if (ctx.boilerplate) counts[2] += size;
+    if (ctx.heading) counts[3] += size;
+};
+const flush = () => {
+    const text = clean(parts.join(''));
+    if (text) {
+        blocks.push([text, ...counts]);
+        collected += text.length;
+    }
+    parts = [];
+    counts = [0, 0, 0, 0];
+};
+const walk = (el, ctx) => {
+    for (const node of el.childNodes) {
+        if (collected >= maxChars) return;
+        if (node.nodeType === Node.TEXT_NODE) {
+            add(node.nodeValue, ctx);
+            continue;
+        }
+        if (node.nodeType !== Node.ELEMENT_NODE) continue;
+        const tag = node.localName;
+        if (SKIP_TAGS.has(tag) || isHidden(node)) continue;
+        const block = BLOCK_TAGS.has(tag);
+        if (block) flush();
+        walk(node, {
+            link: ctx.link || tag === 'a',
+            boilerplate: ctx.boilerplate || isBoilerplate(node, tag, ctx.inContent),
+            heading: ctx.heading || HEADING_TAGS.has(tag),
+            inContent: ctx.inContent || tag === 'main' || tag === 'article'
+        });
+        if (block) flush();
+    }
+};
+if (document.body) {
+    walk(document.body, { link: false, boilerplate: false, heading: false, inContent: false });
+    flush();
+}
+
+return {
+    title: clean(document.title) || null,
+    h1: h1 ? (clean(h1.textContent) || null) : null,
+    firstParagraph: firstParagraph,
+    blocks: blocks,
+    metaDescription: meta ? (clean(meta.getAttribute('content')) || null) : null,
+    jsonLd: jsonLd
+};
+"""
@@ -3,25 +3,39 @@
 """
 import base64
 import asyncio
+import json
 import os
+import time
 import logging
+import re
 from pathlib import Path
 from typing import Optional, Tuple
 from io import BytesIO
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import lxml.html
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.common.exceptions import JavascriptException, TimeoutException, WebDriverException
 from webdriver_manager.chrome import ChromeDriverManager
 from webdriver_manager.core.os_manager import ChromeType
 from bs4 import BeautifulSoup
 from PIL import Image
 
 from backend.config import settings
+from backend.models.schemas import ContentReport, ParsedPage
+from backend.services.browser_pool import BrowserPool, BrowserPoolTimeout
+from backend.services.cancellation import RESOURCE_BROWSER, cancellation
+from backend.services.deadline import DeadlineExceeded, deadlines
+from backend.services import deadline
+from backend.services.content_extraction import blocks_from_counts, blocks_from_text, collect_blocks, select_content
+from backend.services.metrics import page_text_tokens, span
+from backend.services.page_scripts import EXTRACT_CONTENT_JS, INSTRUMENT_JS, READINESS_PROBE_JS
+from backend.services.singleflight import SingleFlight
 
 # Подавление лишних логов Selenium и браузера
 logging.getLogger('selenium').setLevel(logging.ERROR)
@@ -33,6 +47,52 @@ logging.getLogger('selenium.webdriver.common.selenium_manager').setLevel(logging
 # Подавление логов WDM (webdriver-manager)
 logging.getLogger('WDM').setLevel(logging.ERROR)
 
+# Теги, содержимое которых не является видимым текстом
+NON_VISIBLE_TAGS = ('script', 'style', 'noscript', 'template', 'svg', 'iframe', 'head')
+
+# id корневых контейнеров SPA-фреймворков (React, Vue, Next, Nuxt, Gatsby, Angular)
+SPA_ROOT_IDS = ('root', 'app', '__next', '__nuxt', '___gatsby', 'app-root')
+
+# Признаки страницы, которая без JavaScript не работает
+NOSCRIPT_MARKERS = ('enable javascript', 'javascript is required', 'включите javascript', 'javascript отключен')
+
+# Кодировка, объявленная в самом HTML (<meta charset> или http-equiv), — ищется в начале документа
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=', re.IGNORECASE)
+META_CHARSET_SCAN_BYTES = 4096
+BOMS = (b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff')
+
+
+def html_encoding(body: bytes, header_encoding: Optional[str]) -> Optional[str]:
+    """
+    Кодировка для разбора HTML: None — lxml определит её сам по BOM и <meta charset>
+
+    Приоритет как у браузера: charset из Content-Type, затем BOM и meta в документе.
+    Если кодировка нигде не объявлена, lxml считал бы страницу latin-1 — тогда
+    берём UTF-8, если тело в ней корректно, иначе оставляем выбор lxml.
+    """
+    if header_encoding:
+        return header_encoding
+    if body.startswith(BOMS) or META_CHARSET.search(body[:META_CHARSET_SCAN_BYTES]):
+        return None
+    try:
+        body.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    return "utf-8"
+
+
+def normalize_url(url: str) -> str:
+    """
+    URL для сравнения запросов: схема и хост в нижнем регистре, без порта
+    по умолчанию и без #фрагмента (он не влияет на загружаемую страницу)
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
 
 class ParserService:
     """Парсинг веб-страниц через Selenium Chrome"""
@@ -41,6 +101,201 @@ class ParserService:
         self.timeout = settings.parser_timeout or 30
         self.user_agent = settings.parser_user_agent or "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         self.yandex_browser_path = getattr(settings, 'yandex_browser_path', None) or ""
+        self.pool = BrowserPool(
+            factory=self._get_driver,
+            size=settings.browser_pool_size,
+            max_pages=settings.browser_pool_max_pages,
+            lease_timeout=settings.browser_pool_lease_timeout
+        )
+        # Одновременные запросы одного URL разделяют одну загрузку
+        self.inflight = SingleFlight()
+    
+        self.http_client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=httpx.Timeout(settings.parser_http_timeout, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=settings.parser_http_max_connections,
+                max_keepalive_connections=settings.parser_http_max_connections
+            ),
+            headers={
+                "User-Agent": self.user_agent,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "ru-RU,ru;q=0.9,en;q=0.8"
+            }
+        )
+    
+    async def start(self):
+        """Запустить пул браузеров (вызывается при старте приложения)"""
+        await self.pool.start(prewarm=settings.browser_pool_prewarm)
+    
+    async def shutdown(self):
+        """Закрыть все браузеры пула и HTTP-клиент (вызывается при остановке приложения)"""
+        await self.pool.drain()
+        await self.http_client.aclose()
+    
+    async def _fetch_http(self, url: str, timeout: float) -> Tuple[Optional[dict], str]:
+        """
+        Быстрый путь: загрузить страницу обычным HTTP-запросом и разобрать через lxml
+        
+        Returns:
+            (извлечённый контент, "") если контента достаточно; иначе причина перехода
+            на браузер и контент, если HTML удалось разобрать (None — если нет)
+        """
+        try:
+            request_timeout = httpx.Timeout(timeout, connect=min(5.0, timeout))
+            async with self.http_client.stream("GET", url, timeout=request_timeout) as response:
+                if response.status_code >= 400:
+                    return None, f"HTTP {response.status_code}"
+                content_type = response.headers.get("content-type", "")
+                if "html" not in content_type.lower():
+                    return None, f"тип содержимого {content_type or 'не указан'}"
+                
+                # Читаем не больше parser_http_max_bytes
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > settings.parser_http_max_bytes:
+                        return None, "страница слишком большая"
+                body = b"".join(chunks)
+                # response.encoding без charset в заголовке — всегда utf-8, он бы
+                # перекрыл <meta charset="windows-1251"> в самой странице
+                encoding = html_encoding(body, response.charset_encoding)
+        except Exception as e:
+            return None, f"ошибка загрузки: {e}"
+        
+        # Разбор HTML — работа для CPU, выносим из event loop
+        loop = asyncio.get_event_loop()
+        try:
+            extracted = await loop.run_in_executor(None, self._extract_html, body, encoding)
+        except Exception as e:
+            return None, f"ошибка разбора HTML: {e}"
+        
+        return extracted, self._js_rendering_reason(extracted)
+    
+    def _page_from_html(self, url: str, extracted: dict, skipped: Optional[list] = None) -> ParsedPage:
+        """ParsedPage из контента, извлечённого из HTML быстрым путём"""
+        text, report = self._select_text(extracted["blocks"])
+        return ParsedPage(
+            url=url,
+            title=extracted["title"],
+            h1=extracted["h1"],
+            first_paragraph=extracted["first_paragraph"],
+            full_text=text or None,
+            content_report=report,
+            meta_description=extracted["meta_description"],
+            json_ld=extracted["json_ld"],
+            fetch_method="http",
+            skipped=skipped or []
+        )
+    
+    @staticmethod
+    def _select_text(blocks: list) -> Tuple[str, ContentReport]:
+        """Текст для модели в пределах бюджета токенов (см. content_extraction)"""
+        text, report = select_content(
+            blocks, settings.parser_content_token_budget, settings.parser_strip_boilerplate
+        )
+        page_text_tokens.inc(report.raw_tokens, "raw")
+        page_text_tokens.inc(report.sent_tokens, "sent")
+        return text, report
+    
+    @staticmethod
+    def _clean_text(text: Optional[str]) -> str:
+        return re.sub(r'\s+', ' ', text or '').strip()
+    
+    def _extract_html(self, body: bytes, encoding: Optional[str]) -> dict:
+        """Извлечь title, h1, первый абзац и видимый текст из HTML (lxml; encoding=None — по meta/BOM)"""
+        parser = lxml.html.HTMLParser(encoding=encoding, remove_comments=True)
+        doc = lxml.html.fromstring(body, parser=parser)
+        
+        title = self._clean_text(doc.findtext('.//title')) or None
+        
+        noscript_text = " ".join(
+            self._clean_text(el.text_content()) for el in doc.iter('noscript')
+        ).lower()
+        
+        meta_description = None
+        for content in doc.xpath(
+            '//meta[translate(@name, "DESCRIPTON", "descripton")="description"]/@content'
+            ' | //meta[@property="og:description"]/@content'
+        ):
+            meta_description = self._clean_text(content) or None
+            if meta_description:
+                break
+        
+        json_ld = []
+        for script in doc.xpath('//script[@type="application/ld+json"]')[:10]:
+            try:
+                json_ld.append(json.loads(script.text or ''))
+            except ValueError:
+                pass
+        
+        body_el = doc.find('.//body')
+        if body_el is None:
+            body_el = doc
+        
+        # Пустые корневые контейнеры SPA ищем до удаления скриптов
+        spa_roots = [
+            el for el in body_el.iter('div', 'main', 'app-root')
+            if el.get('id') in SPA_ROOT_IDS
+        ]
+        
+        # Убираем невидимое
+        for el in list(body_el.iter(*NON_VISIBLE_TAGS)):
+            el.drop_tree()
+        for el in body_el.xpath('.//*[@hidden or contains(translate(@style, " ", ""), "display:none")]'):
+            el.drop_tree()
+        
+        h1 = None
+        h1_el = body_el.find('.//h1')
+        if h1_el is not None:
+            h1 = self._clean_text(h1_el.text_content()) or None
+        
+        first_paragraph = None
+        main_content = body_el.find('.//main')
+        if main_content is None:
+            main_content = body_el.find('.//article')
+        if main_content is None:
+            main_content = body_el
+        for p in main_content.iter('p'):
+            text = self._clean_text(p.text_content())
+            if len(text) > 50:
+                first_paragraph = text[:500]
+                break
+        
+        # Видимый текст по блокам (блок — строка, как в body.innerText браузера)
+        blocks = collect_blocks(body_el)
+        text = "\n".join(block.text for block in blocks)
+        
+        spa_root_text = max((len(self._clean_text(el.text_content())) for el in spa_roots), default=None)
+        
+        return {
+            "title": title,
+            "h1": h1,
+            "first_paragraph": first_paragraph,
+            "text": text,
+            "blocks": blocks,
+            "meta_description": meta_description,
+            "json_ld": json_ld,
+            "noscript_text": noscript_text,
+            "spa_root_text": spa_root_text
+        }
+    
+    def _js_rendering_reason(self, extracted: dict) -> str:
+        """Причина считать страницу JS-приложением (пустая строка — HTML достаточно)"""
+        min_text = settings.parser_http_min_text
+        text_length = len(extracted["text"])
+        
+        if text_length == 0:
+            return "пустой body"
+        if extracted["spa_root_text"] is not None and extracted["spa_root_text"] < min_text:
+            return "пустой корневой контейнер SPA"
+        if any(marker in extracted["noscript_text"] for marker in NOSCRIPT_MARKERS) and text_length < min_text * 3:
+            return "страница требует JavaScript"
+        if text_length < min_text:
+            return f"мало текста ({text_length} символов)"
+        return ""
         
     def _get_driver(self) -> webdriver.Chrome:
         """Создает и настраивает Chrome/Яндекс браузер драйвер"""
@@ -57,6 +312,8 @@ class ParserService:
         
         chrome_options = Options()
         chrome_options.add_argument('--headless')  # Запуск без GUI
+        # driver.get возвращается после DOMContentLoaded, дальше готовность определяет _wait_until_ready
+        chrome_options.page_load_strategy = 'eager'
         chrome_options.add_argument('--no-sandbox')
         chrome_options.add_argument('--disable-dev-shm-usage')
         chrome_options.add_argument('--disable-gpu')
@@ -278,162 +535,314 @@ class ParserService:
             print(error_msg)
             raise WebDriverException(f"Не удалось создать WebDriver: {str(e)}")
         
+        driver.set_page_load_timeout(self.timeout)
+        
+        # Счётчик сетевых запросов и изменений DOM на каждой новой странице
+        try:
+            driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': INSTRUMENT_JS})
+        except Exception as e:
+            print(f"CDP недоступен, готовность страницы будет определяться без него: {e}")
+        
         return driver
     
-    async def parse_url(self, url: str) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]:
+    def _wait_until_ready(self, driver: webdriver.Chrome, budget: float) -> Tuple[bool, float]:
         """
-        Парсит URL через Selenium, делает скриншот и извлекает контент
+        Дождаться готовности страницы (блокирующий вызов, выполняется в отдельном потоке)
+        
+        Страница считается готовой, когда document.readyState == "complete", нет незавершённых
+        fetch/XHR и DOM и сеть не менялись последние parser_ready_quiet_ms миллисекунд.
+        Ждём не дольше budget секунд.
         
         Returns:
-            Tuple[title, h1, first_paragraph, screenshot_base64, full_text, error]
+            (готова ли страница, затраченное время в секундах)
+        """
+        started = time.monotonic()
+        deadline = started + budget
+        quiet_ms = settings.parser_ready_quiet_ms
+        
+        while True:
+            try:
+                state = driver.execute_script(READINESS_PROBE_JS) or {}
+            except TimeoutException:
+                state = {}
+            
+            if (
+                state.get("readyState") == "complete"
+                and state.get("inflight", 0) == 0
+                and state.get("idleMs", 0) >= quiet_ms
+            ):
+                return True, time.monotonic() - started
+            
+            if time.monotonic() >= deadline:
+                return False, time.monotonic() - started
+            
+            time.sleep(settings.parser_ready_poll_interval)
+    
+    def _extract_with_script(self, driver: webdriver.Chrome) -> Optional[dict]:
+        """Извлечь контент одним вызовом execute_script (None — если скрипт не выполнился)"""
+        try:
+            data = driver.execute_script(EXTRACT_CONTENT_JS, settings.parser_max_text_chars)
+        except JavascriptException as e:
+            print(f"Скрипт извлечения контента не выполнился, используем BeautifulSoup: {e}")
+            return None
+        if not isinstance(data, dict):
+            return None
+        return {
+            "title": data.get("title"),
+            "h1": data.get("h1"),
+            "first_paragraph": data.get("firstParagraph"),
+            "blocks": blocks_from_counts(data.get("blocks")),
+            "meta_description": data.get("metaDescription"),
+            "json_ld": data.get("jsonLd") or []
+        }
+    
+    def _extract_with_soup(self, driver: webdriver.Chrome) -> dict:
+        """Запасной путь: весь HTML через page_source и разбор BeautifulSoup"""
+        soup = BeautifulSoup(driver.page_source, 'lxml')
+        
+        title = None
+        title_tag = soup.find('title')
+        if title_tag:
+            title = title_tag.get_text(strip=True)
+        
+        h1 = None
+        h1_tag = soup.find('h1')
+        if h1_tag:
+            h1 = h1_tag.get_text(strip=True)
+        
+        # Первый абзац
+        first_paragraph = None
+        main_content = soup.find(['main', 'article']) or soup.find('body')
+        if main_content:
+            for p in main_content.find_all('p'):
+                text = p.get_text(strip=True)
+                if len(text) > 50:
+                    first_paragraph = text[:500]
+                    break
+        
+        meta_description = None
+        meta_tag = soup.find('meta', attrs={'name': re.compile('^description$', re.I)})
+        if meta_tag and meta_tag.get('content'):
+            meta_description = meta_tag['content'].strip() or None
+        
+        json_ld = []
+        for script in soup.find_all('script', type='application/ld+json')[:10]:
+            try:
+                json_ld.append(json.loads(script.string or ''))
+            except ValueError:
+                pass
+        
+        # Видимый текст: сначала как в браузере (body.text), иначе — текст из HTML
+        text = ""
+        try:
+            text = driver.find_element(By.TAG_NAME, "body").text or ""
+        except Exception as e:
+            print(f"Ошибка при извлечении текста через Selenium: {e}")
+            if main_content:
+                text = main_content.get_text(" ", strip=True)
+        
+        return {
+            "title": title,
+            "h1": h1,
+            "first_paragraph": first_paragraph,
+            # Разметки body.text не сохраняет: отбор только по повторам и бюджету
+            "blocks": blocks_from_text(text[:settings.parser_max_text_chars]),
+            "meta_description": meta_description,
+            "json_ld": json_ld
+        }
+    
+    async def parse_url(self, url: str, screenshot: bool = False) -> ParsedPage:
+        """
+        Парсит URL и извлекает контент
+        
+        Сначала пробует быстрый путь — обычный HTTP-запрос и разбор HTML через lxml.
+        Браузер (Selenium) запускается, только если страница похожа на JS-приложение
+        или явно запрошен скриншот.
         """
         # Проверяем и нормализуем URL
         if not url or not isinstance(url, str):
-            return None, None, None, None, None, "Некорректный URL"
+            return ParsedPage(url=url or "", error="Некорректный URL")
         
         url = url.strip()
         if not url:
-            return None, None, None, None, None, "Пустой URL"
+            return ParsedPage(url=url, error="Пустой URL")
         
         # Добавляем протокол если его нет
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
         
-        driver = None
         try:
-            # Запускаем браузер в отдельном потоке (Selenium не async)
+            return await self.inflight.do(
+                (normalize_url(url), screenshot),
+                lambda: self._parse(url, screenshot)
+            )
+        except DeadlineExceeded as e:
+            # Ожидали загрузку, начатую другим запросом, и не дождались до своего дедлайна
+            deadlines.skip("parse", url)
+            return ParsedPage(url=url, error=str(e))
+    
+    async def _parse(self, url: str, screenshot: bool) -> ParsedPage:
+        """
+        Загрузка страницы: HTTP, при необходимости — браузер
+        
+        Если до дедлайна запроса браузер не успеть (см. DEADLINE_BROWSER_MIN), страница
+        берётся по HTTP даже без достаточного текста и без скриншота.
+        """
+        reserve = settings.deadline_analysis_reserve
+        browser_affordable = deadline.has_time(reserve + settings.deadline_browser_min)
+        skipped = []
+        if screenshot and not browser_affordable:
+            deadlines.skip("screenshot", "нет времени на браузер")
+            skipped.append("screenshot")
+        
+        if (not screenshot and settings.parser_http_first) or not browser_affordable:
+            with span("parse.http"):
+                extracted, reason = await self._fetch_http(url, deadline.budget(settings.parser_http_timeout, reserve))
+            if extracted is not None and not reason:
+                return self._page_from_html(url, extracted, skipped)
+            if not browser_affordable:
+                deadlines.skip("browser", reason)
+                if extracted is None:
+                    return ParsedPage(url=url, error=f"Страница не загрузилась до дедлайна запроса ({reason})")
+                return self._page_from_html(url, extracted, skipped + ["browser"])
+            print(f"HTTP-парсинг {url} недостаточен ({reason}), используем браузер")
+        
+        return await self._parse_with_browser(url)
+    
+    @staticmethod
+    def _open(driver: webdriver.Chrome, url: str, timeout: float):
+        """Открыть страницу с таймаутом загрузки (он меньше PARSER_TIMEOUT, если близок дедлайн)"""
+        driver.set_page_load_timeout(timeout)
+        driver.get(url)
+    
+    async def _parse_with_browser(self, url: str) -> ParsedPage:
+        """Парсит URL через Selenium, делает скриншот и извлекает контент"""
+        lease = None
+        try:
             loop = asyncio.get_event_loop()
             
-            # Создаем драйвер с обработкой ошибок
+            # Берём уже запущенный браузер из пула
             try:
-                driver = await loop.run_in_executor(None, self._get_driver)
+                # Ожидание свободного браузера или запуск нового драйвера
+                with span("parse.browser_lease"):
+                    lease = await self.pool.acquire()
+            except BrowserPoolTimeout as e:
+                return ParsedPage(url=url, error=str(e))
             except Exception as e:
                 import traceback
                 error_msg = f"Ошибка при создании драйвера: {str(e)}\n{traceback.format_exc()}"
                 print(error_msg)
-                return None, None, None, None, None, f"Ошибка при создании браузера: {str(e)}"
+                return ParsedPage(url=url, error=f"Ошибка при создании браузера: {str(e)}")
             
-            if not driver:
-                return None, None, None, None, None, "Не удалось создать драйвер браузера"
+            driver = lease.driver
+            reserve = settings.deadline_analysis_reserve
+            skipped = []
             
             # Открываем страницу
+            load_timeout = max(1.0, deadline.budget(self.timeout, reserve))
             try:
-                await loop.run_in_executor(None, driver.get, url)
+                with span("parse.page_load"):
+                    await loop.run_in_executor(None, self._open, driver, url, load_timeout)
             except Exception as e:
-                import traceback
-                error_msg = f"Ошибка при открытии URL {url}: {str(e)}\n{traceback.format_exc()}"
-                print(error_msg)
-                return None, None, None, None, None, f"Ошибка при открытии страницы: {str(e)}"
-            
-            # Ждем загрузки страницы
-            wait = WebDriverWait(driver, self.timeout)
-            try:
-                # Ждем загрузки body
-                wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                # Дополнительная задержка для загрузки динамического контента
-                await asyncio.sleep(2)
-            except TimeoutException:
-                pass  # Продолжаем даже если таймаут
-            
-            # Получаем HTML после выполнения JavaScript
-            # page_source - это свойство, а не метод, поэтому нужна обертка
-            def get_page_source():
-                return driver.page_source
-            
-            html = await loop.run_in_executor(None, get_page_source)
-            soup = BeautifulSoup(html, 'lxml')
-            
-            # Извлекаем title
-            title = None
-            title_tag = soup.find('title')
-            if title_tag:
-                title = title_tag.get_text(strip=True)
-            
-            # Извлекаем h1
-            h1 = None
-            h1_tag = soup.find('h1')
-            if h1_tag:
-                h1 = h1_tag.get_text(strip=True)
+                if not (isinstance(e, TimeoutException) and load_timeout < self.timeout):
+                    lease.mark_broken()
+                    import traceback
+                    error_msg = f"Ошибка при открытии URL {url}: {str(e)}\n{traceback.format_exc()}"
+                    print(error_msg)
+                    return ParsedPage(url=url, error=f"Ошибка при открытии страницы: {str(e)}")
+                # Таймаут сокращён дедлайном: останавливаем загрузку и берём то, что успело загрузиться
+                deadlines.skip("page_load", f"загрузка остановлена через {load_timeout:.1f} с")
+                skipped.append("page_load")
+                try:
+                    await loop.run_in_executor(None, driver.execute_script, "window.stop();")
+                except Exception:
+                    lease.mark_broken()
+                    return ParsedPage(url=url, error=f"Страница не загрузилась до дедлайна запроса: {e}")
             
-            # Извлекаем первый абзац
-            first_paragraph = None
-            main_content = soup.find(['main', 'article']) or soup.find('body')
-            if main_content:
-                for p in main_content.find_all('p'):
-                    text = p.get_text(strip=True)
-                    if len(text) > 50:
-                        first_paragraph = text[:500]
-                        break
+            # Ждем, пока страница догрузит динамический контент (вне event loop)
+            with span("parse.ready_wait"):
+                ready, waited = await loop.run_in_executor(
+                    None, self._wait_until_ready, driver, deadline.budget(settings.parser_ready_max_wait, reserve)
+                )
+            if not ready:
+                print(f"Страница {url} не успокоилась за {waited:.1f} с, продолжаем с текущим состоянием")
             
-            # Извлекаем весь видимый текст страницы
-            full_text = None
-            try:
-                def get_body_text():
-                    body = driver.find_element(By.TAG_NAME, "body")
-                    return body.text if body.text else ""
-                
-                body_text = await loop.run_in_executor(None, get_body_text)
-                if body_text and isinstance(body_text, str) and body_text.strip():
-                    full_text = body_text[:5000] if len(body_text) > 5000 else body_text
-            except Exception as e:
-                print(f"Ошибка при извлечении текста через Selenium: {e}")
-                # Если не удалось получить через Selenium, используем BeautifulSoup
-                if main_content:
-                    try:
-                        soup_text = main_content.get_text(strip=True)
-                        if soup_text and isinstance(soup_text, str) and soup_text.strip():
-                            full_text = soup_text[:5000] if len(soup_text) > 5000 else soup_text
-                    except Exception as e2:
-                        print(f"Ошибка при извлечении текста через BeautifulSoup: {e2}")
+            # Извлекаем контент одним execute_script; если скрипты заблокированы — через page_source
+            with span("parse.extract"):
+                extracted = await loop.run_in_executor(None, self._extract_with_script, driver)
+                if extracted is None:
+                    extracted = await loop.run_in_executor(None, self._extract_with_soup, driver)
+                text, report = self._select_text(extracted["blocks"])
             
-            # Делаем скриншот
-            screenshot_base64 = None
-            try:
-                # get_screenshot_as_png - это метод, можно вызывать напрямую
-                screenshot = await loop.run_in_executor(None, driver.get_screenshot_as_png)
-                # Конвертируем в base64
-                if screenshot:
-                    screenshot_base64 = base64.b64encode(screenshot).decode('utf-8')
-            except Exception as e:
-                print(f"Ошибка при создании скриншота: {e}")
-                import traceback
-                print(traceback.format_exc())
+            # Делаем скриншот (подготовка для модели — в image_service)
+            screenshot_png = None
+            if not deadline.has_time(reserve):
+                # Время парсинга вышло: скриншот не успеют проанализировать
+                deadlines.skip("screenshot", "время парсинга исчерпано")
+                skipped.append("screenshot")
+            else:
+                try:
+                    # get_screenshot_as_png - это метод, можно вызывать напрямую
+                    with span("parse.screenshot"):
+                        screenshot_png = await loop.run_in_executor(None, driver.get_screenshot_as_png)
+                except Exception as e:
+                    print(f"Ошибка при создании скриншота: {e}")
+                    import traceback
+                    print(traceback.format_exc())
             
-            return title, h1, first_paragraph, screenshot_base64, full_text, None
+            return ParsedPage(
+                url=url,
+                title=extracted["title"],
+                h1=extracted["h1"],
+                first_paragraph=extracted["first_paragraph"],
+                screenshot_png=screenshot_png or None,
+                full_text=text or None,
+                content_report=report,
+                meta_description=extracted["meta_description"],
+                json_ld=extracted["json_ld"],
+                fetch_method="selenium",
+                skipped=skipped
+            )
             
+        except asyncio.CancelledError:
+            # Клиент отключился: все await выше — команды браузера в потоках, их не прервать
+            # отменой задачи. Браузер закрывается при возврате, это обрывает загрузку страницы
+            if lease:
+                lease.mark_interrupted()
+                cancellation.record_resource(RESOURCE_BROWSER)
+            raise
         except WebDriverException as e:
+            # Браузер мог упасть — при возврате в пул он будет перезапущен
+            if lease:
+                lease.mark_broken()
             import traceback
             error_msg = f"Ошибка WebDriver: {str(e)}\n{traceback.format_exc()}"
             print(error_msg)
             # Проверяем, не связана ли ошибка с split
             if "'NoneType' object has no attribute 'split'" in str(e) or "split" in str(e).lower():
-                return None, None, None, None, None, f"Ошибка конфигурации браузера. Проверьте установку Chrome/Яндекс браузера и ChromeDriver."
-            return None, None, None, None, None, f"Ошибка WebDriver: {str(e)}"
+                return ParsedPage(url=url, error=f"Ошибка конфигурации браузера. Проверьте установку Chrome/Яндекс браузера и ChromeDriver.")
+            return ParsedPage(url=url, error=f"Ошибка WebDriver: {str(e)}")
         except TimeoutException:
-            return None, None, None, None, None, "Превышено время ожидания загрузки страницы"
+            return ParsedPage(url=url, error="Превышено время ожидания загрузки страницы")
         except AttributeError as e:
             import traceback
             error_msg = f"Ошибка атрибута: {str(e)}\n{traceback.format_exc()}"
             print(error_msg)
             if "split" in str(e).lower():
-                return None, None, None, None, None, f"Ошибка обработки данных. Проверьте корректность URL и установку браузера."
-            return None, None, None, None, None, f"Ошибка атрибута: {str(e)}"
+                return ParsedPage(url=url, error=f"Ошибка обработки данных. Проверьте корректность URL и установку браузера.")
+            return ParsedPage(url=url, error=f"Ошибка атрибута: {str(e)}")
         except Exception as e:
             import traceback
             error_msg = f"Неизвестная ошибка: {str(e)}\n{traceback.format_exc()}"
             print(error_msg)
             # Специальная обработка ошибки split
             if "'NoneType' object has no attribute 'split'" in str(e) or ("split" in str(e).lower() and "NoneType" in str(e)):
-                return None, None, None, None, None, f"Ошибка конфигурации. Возможно, проблема с установкой ChromeDriver или путем к браузеру. Проверьте логи сервера для деталей."
-            return None, None, None, None, None, f"Неизвестная ошибка: {str(e)}"
+                return ParsedPage(url=url, error=f"Ошибка конфигурации. Возможно, проблема с установкой ChromeDriver или путем к браузеру. Проверьте логи сервера для деталей.")
+            return ParsedPage(url=url, error=f"Неизвестная ошибка: {str(e)}")
         finally:
-            # Закрываем браузер
-            if driver:
-                try:
-                    loop = asyncio.get_event_loop()
-                    await loop.run_in_executor(None, driver.quit)
-                except:
-                    pass
+            # Возвращаем браузер в пул (и при повторной отмене — слот пула не должен потеряться)
+            if lease:
+                await asyncio.shield(self.pool.release(lease))
 
 
 # Глобальный экземпляр
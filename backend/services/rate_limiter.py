@@ -0,0 +1,304 @@
+"""
+Ограничитель запросов к OpenAI по лимитам аккаунта
+
+Бюджеты запросов в минуту (RPM) и токенов в минуту (TPM) — корзины токенов,
+пополняющиеся непрерывно. Перед вызовом резервируется оценка токенов, после
+ответа резерв исправляется по фактическому usage. Запросы, которым не хватило
+бюджета, ждут в очереди с приоритетами: интерактивные запросы обслуживаются
+раньше фоновых задач и пакетов. После 429 очередь приостанавливается на время
+из Retry-After, чтобы не продолжать бить в API всем потоком.
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+from backend.config import settings
+
+# Приоритеты (меньше — раньше)
+PRIORITY_INTERACTIVE = 0  # Синхронные эндпоинты и потоковая выдача
+PRIORITY_JOB = 1  # Фоновые задачи (/jobs)
+PRIORITY_BATCH = 2  # Пакетная обработка
+
+# Приоритет запросов текущей задачи asyncio (наследуется дочерними задачами)
+llm_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority_scope(priority: int):
+    """Выполнять запросы к модели внутри блока с заданным приоритетом"""
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Задержка из заголовков ответа 429: retry-after-ms или Retry-After (секунды или дата)"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _TokenBucket:
+    """Корзина на N единиц в минуту с непрерывным пополнением"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Через сколько секунд в корзине будет amount (больше ёмкости не ждём)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        """Списать (уровень может уйти в минус, если фактический расход больше оценки)"""
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    """Резерв бюджета под один запрос"""
+
+    def __init__(self, tokens: int, waited: float):
+        self.tokens = tokens
+        self.waited = waited
+
+
+class RateLimiter:
+    """Допуск запросов к API по бюджетам RPM/TPM с очередью по приоритету"""
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float
+    ):
+        self.requests = _TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # Очередь ожидающих: (приоритет, порядковый номер, токены, future)
+        self._waiters: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Метрики
+        self.admitted = 0
+        self.throttled = 0  # Ответов 429
+        self.retries = 0
+        self.tokens_reserved = 0
+        self.tokens_used = 0
+        self._waits: deque = deque(maxlen=1000)
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # === Бюджет ===
+
+    def _delay(self, tokens: int) -> float:
+        """Сколько ждать, пока запрос на tokens токенов можно будет пропустить"""
+        delay = self._paused_until - time.monotonic()
+        if self.requests is not None:
+            delay = max(delay, self.requests.time_until(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.time_until(tokens))
+        return max(0.0, delay)
+
+    def _take(self, tokens: int):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+        self.admitted += 1
+        self.tokens_reserved += tokens
+
+    def _refund(self, tokens: int):
+        if self.requests is not None:
+            self.requests.give_back(1)
+        if self.tokens is not None:
+            self.tokens.give_back(tokens)
+
+    # === Очередь ===
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._dispatcher is None or self._dispatcher.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch(), name="openai-rate-limiter")
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        """Пропускать ожидающих по приоритету, как только хватает бюджета"""
+        while True:
+            # Отменённые ожидания (клиент ушёл) просто выбрасываем
+            while self._waiters and self._waiters[0][3].done():
+                heapq.heappop(self._waiters)
+
+            self._wakeup.clear()
+            if not self._waiters:
+                await self._wakeup.wait()
+                continue
+
+            _, _, tokens, future = self._waiters[0]
+            delay = self._delay(tokens)
+            if delay <= 0:
+                heapq.heappop(self._waiters)
+                self._take(tokens)
+                future.set_result(None)
+                continue
+
+            # Ждём пополнения или нового запроса (он может быть приоритетнее)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, tokens: int, priority: Optional[int] = None) -> Reservation:
+        """Дождаться бюджета под запрос с оценкой tokens токенов"""
+        if priority is None:
+            priority = llm_priority.get()
+        started = time.monotonic()
+
+        if not self._waiters and self._delay(tokens) <= 0:
+            self._take(tokens)
+        else:
+            self._ensure_dispatcher()
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), tokens, future))
+            self._wake()
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Бюджет уже выделен, а запрос не состоится — возвращаем
+                if future.done() and not future.cancelled():
+                    self._refund(tokens)
+                raise
+
+        waited = time.monotonic() - started
+        self._waits.append(waited)
+        self.wait_count += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return Reservation(tokens, waited)
+
+    def settle(self, reservation: Reservation, used_tokens: Optional[int]):
+        """Исправить резерв по фактическому расходу (usage из ответа)"""
+        if used_tokens is None:
+            used_tokens = reservation.tokens
+        self.tokens_used += used_tokens
+        if self.tokens is None:
+            return
+        difference = reservation.tokens - used_tokens
+        if difference > 0:
+            self.tokens.give_back(difference)
+        elif difference < 0:
+            self.tokens.take(-difference)
+
+    def release(self, reservation: Reservation):
+        """Запрос не дошёл до модели (429, обрыв соединения) — токены не израсходованы"""
+        if self.tokens is not None:
+            self.tokens.give_back(reservation.tokens)
+
+    # === Повторы ===
+
+    def on_rate_limited(self, retry_after: Optional[float], attempt: int) -> float:
+        """Ответ 429: приостановить очередь и вернуть задержку перед повтором"""
+        self.throttled += 1
+        delay = self.backoff_delay(attempt, retry_after)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self._wake()
+        return delay
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Экспоненциальная задержка со случайным разбросом, не меньше Retry-After"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        delay = random.uniform(ceiling / 2, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def percentile(q: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1)
+
+        return {
+            "requests_per_minute": int(self.requests.capacity) if self.requests else None,
+            "tokens_per_minute": int(self.tokens.capacity) if self.tokens else None,
+            "requests_available": round(self.requests.level, 1) if self.requests else None,
+            "tokens_available": round(self.tokens.level) if self.tokens else None,
+            "queued": sum(1 for *_, future in self._waiters if not future.done()),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "tokens_reserved": self.tokens_reserved,
+            "tokens_used": self.tokens_used,
+            "wait_ms_avg": round(self.wait_total / self.wait_count * 1000, 1) if self.wait_count else None,
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": round(self.wait_max * 1000, 1)
+        }
+
+
+# Глобальный экземпляр
+rate_limiter = RateLimiter(
+    requests_per_minute=settings.openai_rpm,
+    tokens_per_minute=settings.openai_tpm,
+    max_retries=settings.openai_max_retries,
+    backoff_base=settings.openai_backoff_base,
+    backoff_max=settings.openai_backoff_max
+)
@@ -0,0 +1,173 @@
+"""
+Хранилище скриншотов на диске (контентно-адресуемое)
+
+Имя файла — SHA-256 содержимого, поэтому одинаковые скриншоты хранятся один раз,
+а файл по данному адресу никогда не меняется и может кэшироваться клиентом навсегда.
+Размер хранилища ограничен: при превышении удаляются давно не запрашивавшиеся файлы.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from backend.config import settings
+from backend.models.schemas import ImageRef
+from backend.services.metrics import span
+
+# Расширения по MIME-типу и обратно
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+MIME_TYPES = {extension: mime_type for mime_type, extension in EXTENSIONS.items()}
+
+# Имя файла в URL: <sha256>.<расширение>
+NAME_PATTERN = re.compile(r"^([0-9a-f]{64})\.(png|jpg|webp)$")
+
+
+class ScreenshotStore:
+    """Файлы скриншотов по хэшу содержимого с LRU-очисткой по размеру"""
+
+    def __init__(self, directory: str, max_bytes: int, url_prefix: str = "/screenshots"):
+        self.directory = Path(directory)
+        self.max_bytes = max(0, max_bytes)
+        self.url_prefix = url_prefix
+
+        # Индекс файлов в порядке последнего использования: имя -> размер
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        # Счётчики
+        self.writes = 0
+        self.deduplicated = 0
+        self.evictions = 0
+
+    def _path(self, name: str) -> Path:
+        return self.directory / name[:2] / name
+
+    async def _run(self, func, *args):
+        """Выполнить операцию с диском в отдельном потоке под блокировкой индекса"""
+        def locked():
+            with self._lock:
+                return func(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, locked)
+
+    def _load_index(self):
+        """Просканировать каталог один раз, упорядочив файлы по времени использования"""
+        entries = []
+        if self.directory.exists():
+            for path in self.directory.glob("*/*"):
+                if not NAME_PATTERN.match(path.name):
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((name, size) for _, name, size in entries)
+        self._total_bytes = sum(size for _, _, size in entries)
+
+    def _touch(self, name: str):
+        """Отметить использование файла для LRU"""
+        try:
+            os.utime(self._path(name))
+        except OSError:
+            pass
+        if name in self._index:
+            self._index.move_to_end(name)
+
+    def _remove(self, name: str):
+        self._total_bytes -= self._index.pop(name, 0)
+        try:
+            self._path(name).unlink()
+        except OSError:
+            pass
+
+    def _put(self, name: str, data: bytes):
+        if self._index is None:
+            self._load_index()
+        path = self._path(name)
+        if name in self._index and path.exists():
+            self._touch(name)
+            self.deduplicated += 1
+            return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Атомарная запись: параллельный GET не отдаст полузаписанный файл
+        tmp_path = path.with_name(f"{name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        self._total_bytes += len(data) - self._index.pop(name, 0)
+        self._index[name] = len(data)
+        self.writes += 1
+
+        # Только что записанный файл не удаляем, даже если он один больше лимита
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            oldest = next(iter(self._index))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _open(self, name: str) -> Optional[Path]:
+        if self._index is None:
+            self._load_index()
+        path = self._path(name)
+        if not path.exists():
+            if name in self._index:
+                self._remove(name)
+            return None
+        self._touch(name)
+        return path
+
+    # === Публичный интерфейс ===
+
+    async def put(self, data: bytes, mime_type: str, width: int, height: int) -> ImageRef:
+        """Сохранить изображение и вернуть ссылку на него"""
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"{digest}.{EXTENSIONS.get(mime_type, 'png')}"
+        with span("screenshot.store"):
+            await self._run(self._put, name, data)
+        return ImageRef(
+            url=f"{self.url_prefix}/{name}",
+            width=width,
+            height=height,
+            bytes=len(data),
+            mime_type=mime_type
+        )
+
+    async def open(self, name: str) -> Optional[Path]:
+        """Путь к файлу по имени из URL или None (неизвестное или удалённое имя)"""
+        if not NAME_PATTERN.match(name):
+            return None
+        return await self._run(self._open, name)
+
+    @staticmethod
+    def etag(name: str) -> str:
+        """ETag — хэш содержимого из имени файла"""
+        return f'"{name.split(".", 1)[0]}"'
+
+    @staticmethod
+    def mime_type(name: str) -> str:
+        return MIME_TYPES[name.rsplit(".", 1)[1]]
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._index) if self._index is not None else None,
+            "bytes": self._total_bytes if self._index is not None else None,
+            "max_bytes": self.max_bytes,
+            "writes": self.writes,
+            "deduplicated": self.deduplicated,
+            "evictions": self.evictions
+        }
+
+
+# Глобальный экземпляр
+screenshot_store = ScreenshotStore(
+    directory=settings.screenshot_store_dir,
+    max_bytes=settings.screenshot_store_max_mb * 1024 * 1024
+)
@@ -0,0 +1,92 @@
+"""
+Объединение одинаковых запросов, выполняющихся одновременно (single-flight)
+
+Если тот же URL или тот же текст уже обрабатывается, новый запрос не запускает
+второй браузер и второй вызов модели, а ждёт результата первого. Результат
+(или исключение) получают все ожидающие; он общий, поэтому его нельзя изменять.
+
+Вычисление выполняется в контексте первого запроса: с его приоритетом в очереди к
+модели и его дедлайном. Поэтому объединяются только запросы с тем же приоритетом и
+дедлайном того же порядка (остаток бюджета в пределах степени двойки), а каждый
+ожидающий ждёт не дольше своего дедлайна.
+"""
+import asyncio
+import math
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from backend.services import deadline
+from backend.services.deadline import DeadlineExceeded
+from backend.services.rate_limiter import llm_priority
+
+T = TypeVar("T")
+
+
+def _deadline_bucket() -> Optional[int]:
+    """Порядок остатка бюджета запроса: [1, 2) с — 0, [2, 4) с — 1, ... (None — без дедлайна)"""
+    left = deadline.remaining()
+    if left is None:
+        return None
+    return int(math.log2(max(left, 1.0)))
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Одно выполнение на ключ среди одновременных запросов"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+
+        # Счётчики
+        self.executed = 0  # Запусков вычисления
+        self.coalesced = 0  # Запросов, присоединившихся к уже идущему вычислению
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        Выполнить factory() или дождаться уже идущего выполнения с тем же ключом
+
+        Вычисление идёт в отдельной задаче: отмена одного из ожидающих его не прерывает.
+        Если ушли все ожидающие, вычисление отменяется. DeadlineExceeded — если
+        вычисление не завершилось до дедлайна этого ожидающего.
+        """
+        key = (key, llm_priority.get(), _deadline_bucket())
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            left = deadline.remaining()
+            if left is None:
+                return await asyncio.shield(call.task)
+            try:
+                return await asyncio.wait_for(asyncio.shield(call.task), left)
+            except asyncio.TimeoutError:
+                if call.task.done():
+                    # TimeoutError самого вычисления
+                    raise
+                raise DeadlineExceeded("Бюджет времени запроса исчерпан в ожидании общего вычисления")
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced
+        }
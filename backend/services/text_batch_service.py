@@ -0,0 +1,221 @@
+"""
+Пакетный анализ текстов (/analyze_text_batch)
+
+Короткие тексты упаковываются по несколько в один запрос к модели, чтобы длинный
+системный промпт передавался один раз на группу, а не на каждый текст. Группы
+ограничены числом текстов и оценкой входных токенов и выполняются параллельно.
+Элемент ответа, не прошедший проверку, переспрашивается отдельным запросом.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from openai import APIError
+
+from backend.config import settings
+from backend.models.schemas import CompetitorAnalysis, TextBatchItem, TextBatchResponse, TextBatchStats
+from backend.services.cache_service import normalize_text
+from backend.services.history_service import history_service
+from backend.services.openai_service import describe_api_error, openai_service
+from backend.services.rate_limiter import PRIORITY_BATCH, priority_scope
+from backend.services.tokens import estimate_tokens
+
+
+class _BatchRun:
+    """Состояние одного пакета: результаты и счётчики для отчёта"""
+
+    def __init__(self, concurrency: int):
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self.results: Dict[str, TextBatchItem] = {}  # Ключ — нормализованный текст
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.fallback_items = 0
+
+
+class TextBatchService:
+    """Анализ нескольких текстов с упаковкой в общие запросы"""
+
+    def __init__(
+        self,
+        max_items: int,
+        max_input_tokens: int,
+        item_max_tokens: int,
+        output_tokens: int,
+        concurrency: int
+    ):
+        self.max_items = max(1, max_items)
+        self.max_input_tokens = max_input_tokens
+        self.item_max_tokens = item_max_tokens
+        self.output_tokens = output_tokens
+        self.concurrency = concurrency
+
+        # Статистика
+        self.batches_total = 0
+        self.calls_total = 0
+        self.calls_saved_total = 0
+        self.tokens_saved_total = 0
+        self.fallback_items_total = 0
+
+    def pack(self, texts: List[str]) -> List[List[str]]:
+        """
+        Разбить тексты на группы для общих запросов (порядок сохраняется)
+
+        Длинный текст или текст, не поместившийся ни в одну группу, идёт
+        отдельной группой из одного элемента — он анализируется обычным запросом.
+        """
+        groups: List[List[str]] = []
+        current: List[str] = []
+        for text in texts:
+            if estimate_tokens(text) > self.item_max_tokens:
+                groups.append([text])
+                continue
+            candidate = current + [text]
+            if current and (
+                len(candidate) > self.max_items
+                or openai_service.text_batch_prompt_tokens(candidate) > self.max_input_tokens
+            ):
+                groups.append(current)
+                candidate = [text]
+            current = candidate
+        if current:
+            groups.append(current)
+        return groups
+
+    async def _single(self, run: _BatchRun, key: str, text: str):
+        """Обычный анализ одного текста"""
+        async with run.slots:
+            run.calls += 1
+            run.prompt_tokens += openai_service.text_prompt_tokens(text)
+            try:
+                analysis = await openai_service.analyze_text(text)
+                run.results[key] = TextBatchItem(index=-1, success=True, analysis=analysis, mode="single")
+            except APIError as e:
+                run.results[key] = TextBatchItem(index=-1, success=False, error=describe_api_error(e))
+            except Exception as e:
+                run.results[key] = TextBatchItem(index=-1, success=False, error=f"Ошибка при анализе: {str(e)}")
+
+    async def _group(self, run: _BatchRun, keys: List[str], texts: List[str]):
+        """Анализ группы текстов одним запросом с переспросом неудачных элементов"""
+        if len(texts) == 1:
+            await self._single(run, keys[0], texts[0])
+            return
+
+        analyses: List[Optional[CompetitorAnalysis]]
+        async with run.slots:
+            run.calls += 1
+            run.prompt_tokens += openai_service.text_batch_prompt_tokens(texts)
+            try:
+                analyses = await openai_service.analyze_text_batch(texts, self.output_tokens)
+            except APIError as e:
+                # Ошибка API (ключ, регион, лимит) повторится и для одиночных запросов
+                error = describe_api_error(e)
+                for key in keys:
+                    run.results[key] = TextBatchItem(index=-1, success=False, error=error)
+                return
+            except Exception as e:
+                print(f"Пакетный анализ текстов не удался, анализируем по одному: {e}")
+                analyses = [None] * len(texts)
+
+        retry = []
+        for key, text, analysis in zip(keys, texts, analyses):
+            if analysis is None:
+                retry.append(self._single(run, key, text))
+            else:
+                run.results[key] = TextBatchItem(index=-1, success=True, analysis=analysis, mode="batched")
+        run.fallback_items += len(retry)
+        await asyncio.gather(*retry)
+
+    async def analyze(self, texts: List[str]) -> TextBatchResponse:
+        """Проанализировать тексты; результаты в порядке запроса"""
+        started = time.perf_counter()
+        run = _BatchRun(self.concurrency)
+
+        # Пустые тексты, повторы и кэш отсеиваем до обращения к модели
+        keys: List[Optional[str]] = []
+        pending: Dict[str, str] = {}
+        cached = 0
+        for text in texts:
+            if not text or not isinstance(text, str) or not text.strip():
+                keys.append(None)
+                continue
+            key = normalize_text(text).decode("utf-8")
+            keys.append(key)
+            if key in run.results or key in pending:
+                cached += 1
+                continue
+            analysis = await openai_service.get_cached_text(text)
+            if analysis is not None:
+                run.results[key] = TextBatchItem(index=-1, success=True, analysis=analysis, mode="cache")
+                cached += 1
+            else:
+                pending[key] = text
+
+        key_by_text = {text: key for key, text in pending.items()}
+        groups = self.pack(list(pending.values()))
+        # Пакеты уступают интерактивным запросам в очереди к модели
+        with priority_scope(PRIORITY_BATCH):
+            await asyncio.gather(*(
+                self._group(run, [key_by_text[text] for text in group], group) for group in groups
+            ))
+
+        items = []
+        for index, key in enumerate(keys):
+            if key is None:
+                items.append(TextBatchItem(index=index, success=False, error="Текст для анализа не может быть пустым"))
+            else:
+                items.append(run.results[key].model_copy(update={"index": index}))
+
+        calls_single = len(pending)
+        prompt_tokens_single = sum(openai_service.text_prompt_tokens(text) for text in pending.values())
+        stats = TextBatchStats(
+            texts=len(texts),
+            cached=cached,
+            calls=run.calls,
+            calls_single=calls_single,
+            calls_saved=calls_single - run.calls,
+            fallback_items=run.fallback_items,
+            prompt_tokens=run.prompt_tokens,
+            prompt_tokens_single=prompt_tokens_single,
+            tokens_saved=prompt_tokens_single - run.prompt_tokens,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1)
+        )
+
+        self.batches_total += 1
+        self.calls_total += stats.calls
+        self.calls_saved_total += stats.calls_saved
+        self.tokens_saved_total += stats.tokens_saved
+        self.fallback_items_total += stats.fallback_items
+
+        succeeded = sum(1 for item in items if item.success)
+        if succeeded:
+            history_service.add_entry(
+                request_type="text",
+                request_summary=f"Пакет текстов: {len(texts)}",
+                response_summary=f"Проанализировано {succeeded} из {len(texts)}, запросов к модели: {stats.calls}"
+            )
+
+        return TextBatchResponse(
+            success=succeeded > 0,
+            items=items,
+            stats=stats,
+            error=None if succeeded else next((item.error for item in items if item.error), None)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "batches_total": self.batches_total,
+            "calls_total": self.calls_total,
+            "calls_saved_total": self.calls_saved_total,
+            "tokens_saved_total": self.tokens_saved_total,
+            "fallback_items_total": self.fallback_items_total
+        }
+
+
+# Глобальный экземпляр
+text_batch_service = TextBatchService(
+    max_items=settings.text_batch_max_items,
+    max_input_tokens=settings.text_batch_max_input_tokens,
+    item_max_tokens=settings.text_batch_item_max_tokens,
+    output_tokens=settings.text_batch_output_tokens,
+    concurrency=settings.text_batch_concurrency
+)
@@ -0,0 +1,116 @@
+"""
+Анализ длинных текстов по частям (map-reduce)
+
+- split_text — деление текста на части по абзацам (длинный абзац — по предложениям)
+  в пределах бюджета токенов;
+- merge_analyses — объединение анализов частей: пункты списков без повторов и
+  почти-повторов, чаще встречавшиеся в частях — первыми.
+"""
+import re
+from typing import Dict, List, Sequence
+
+from backend.models.schemas import CompetitorAnalysis
+from backend.services.tokens import estimate_tokens
+
+LIST_FIELDS = ("strengths", "weaknesses", "unique_offers", "recommendations")
+
+# Пункты с такой долей общих слов считаются одним и тем же
+DUPLICATE_SIMILARITY = 0.7
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n|\r\n\s*\r\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+_WORD = re.compile(r'\w+')
+
+
+def _pack(pieces: Sequence[str], max_tokens: int, separator: str) -> List[str]:
+    """
+    Жадная упаковка фрагментов по порядку в части не больше max_tokens
+
+    Оценки фрагментов складываются, а не пересчитываются для всей части: сумма
+    округлённых вверх оценок не меньше оценки целого, поэтому часть не выйдет за бюджет.
+    """
+    chunks, current, current_tokens = [], [], 0
+    separator_tokens = estimate_tokens(separator)
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + separator_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens + (separator_tokens if len(current) > 1 else 0)
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_text(text: str, max_tokens: int) -> List[str]:
+    """
+    Разделить текст на части не больше max_tokens (оценка) по границам абзацев
+
+    Абзацы, не помещающиеся в часть целиком, делятся по предложениям, а
+    предложения — по словам. Порядок текста сохраняется.
+    """
+    paragraphs = [p.strip() for p in _PARAGRAPH_BREAK.split(text.strip()) if p.strip()]
+    if len(paragraphs) == 1:
+        # Абзацы без пустых строк между ними
+        paragraphs = [p.strip() for p in text.strip().split("\n") if p.strip()]
+
+    pieces: List[str] = []
+    for paragraph in paragraphs:
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        sentences: List[str] = []
+        for sentence in _SENTENCE_END.split(paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                sentences.append(sentence)
+            else:
+                # «Предложение» без знаков препинания — делим по словам
+                sentences.extend(_pack(sentence.split(), max_tokens, " "))
+        # Части одного абзаца склеиваются пробелом, абзацы — пустой строкой
+        pieces.extend(_pack(sentences, max_tokens, " "))
+    return _pack(pieces, max_tokens, "\n\n")
+
+
+def _words(text: str) -> frozenset:
+    return frozenset(word for word in _WORD.findall(text.lower()) if len(word) > 2)
+
+
+def _similar(a: frozenset, b: frozenset) -> bool:
+    if not a or not b:
+        return a == b
+    return len(a & b) / len(a | b) >= DUPLICATE_SIMILARITY
+
+
+def merge_points(lists: Sequence[Sequence[str]], max_items: int) -> List[str]:
+    """
+    Объединить пункты из анализов частей без повторов
+
+    Почти одинаковые пункты (по доле общих слов) сливаются в первый встреченный;
+    порядок — по числу частей, в которых пункт встретился, затем по первому появлению.
+    """
+    groups: List[Dict] = []
+    for points in lists:
+        for point in points:
+            text = point.strip() if isinstance(point, str) else ""
+            if not text:
+                continue
+            words = _words(text)
+            for group in groups:
+                if _similar(words, group["words"]):
+                    group["count"] += 1
+                    break
+            else:
+                groups.append({"text": text, "words": words, "count": 1, "order": len(groups)})
+    groups.sort(key=lambda group: (-group["count"], group["order"]))
+    return [group["text"] for group in groups[:max_items]]
+
+
+def merge_analyses(analyses: Sequence[CompetitorAnalysis], max_items: int) -> CompetitorAnalysis:
+    """Объединить анализы частей текста; summary — резюме частей через пробел (см. reduce в OpenAIService)"""
+    merged = {
+        field: merge_points([getattr(analysis, field) for analysis in analyses], max_items)
+        for field in LIST_FIELDS
+    }
+    summary = " ".join(analysis.summary.strip() for analysis in analyses if analysis.summary.strip())
+    return CompetitorAnalysis(**merged, summary=summary)
@@ -0,0 +1,49 @@
+"""
+Оценка числа токенов без токенизатора
+
+Точный подсчёт зависит от модели; для упаковки запросов и отчётов достаточно
+консервативной оценки: кириллица дробится на токены мельче латиницы.
+"""
+import math
+from typing import Iterable, Union
+
+# Символов на токен: латиница ~4, кириллица ~2.5 (берём с запасом)
+LATIN_CHARS_PER_TOKEN = 4.0
+OTHER_CHARS_PER_TOKEN = 2.5
+
+# Служебные токены на каждое сообщение чата и на ответ
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+# Изображение в сообщении: detail=low — фиксированно, иначе худший случай
+# для detail=high (768×2048 после масштабирования: 8 плиток по 170 + 85)
+IMAGE_TOKENS = {"low": 85, "high": 1445}
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка токенов в строке"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    other_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / LATIN_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN)
+
+
+def estimate_messages_tokens(messages: Iterable[dict]) -> int:
+    """Оценка входных токенов запроса chat.completions"""
+    total = REPLY_OVERHEAD_TOKENS
+    for message in messages:
+        content: Union[str, list] = message.get("content") or ""
+        total += MESSAGE_OVERHEAD_TOKENS
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content:
+            if not isinstance(part, dict):
+                continue
+            if part.get("type") == "image_url":
+                detail = (part.get("image_url") or {}).get("detail", "auto")
+                total += IMAGE_TOKENS.get(detail, IMAGE_TOKENS["high"])
+            else:
+                total += estimate_tokens(part.get("text", ""))
+    return total
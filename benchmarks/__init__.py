@@ -0,0 +1,3 @@
+"""
+Бенчмарки BuildIntel (запуск из корня проекта: python -m benchmarks.<имя>)
+"""
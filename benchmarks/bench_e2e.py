@@ -0,0 +1,344 @@
+"""
+Сквозной бенчмарк API на локальной заглушке LLM (без затрат на OpenAI)
+
+Поднимает приложение на uvicorn с LLM_PROVIDER=stub, локальный HTTP-сервер со страницей
+для /parse_demo и прогоняет сценарии /analyze_text, /analyze_image, /parse_demo и
+/history на нескольких уровнях параллельности. Для каждого уровня считаются
+p50/p95/p99 задержки и пропускная способность; результат сохраняется в JSON, который
+можно сравнить с прогоном другого коммита (benchmarks/compare.py).
+
+Кэш анализов отключён, а каждый запрос уникален (текст, пиксель изображения, URL),
+поэтому все запросы доходят до заглушки и не объединяются single-flight.
+
+Запуск:
+    python -m benchmarks.bench_e2e --concurrency 1 8 32 --requests 64 --output bench-e2e.json
+    python -m benchmarks.compare bench-base.json bench-e2e.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+SCENARIOS = ("analyze_text", "analyze_image", "parse_demo", "history")
+
+FIXTURE_HTML = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+  <title>ЖК «Парковый» — квартиры от застройщика</title>
+  <meta name="description" content="Квартиры бизнес-класса у парка, сдача в 2025 году">
+</head>
+<body>
+  <h1>Квартиры у парка с отделкой и рассрочкой 0%</h1>
+  <p>Жилой комплекс «Парковый» — монолитные дома с подземным паркингом в десяти минутах
+  от метро. Гарантия застройщика 5 лет, сдача третьего корпуса во втором квартале 2025 года.</p>
+  <p>Планировки от 38 до 120 м², высота потолков 3 метра, панорамное остекление, кладовые
+  на каждом этаже. Во дворе без машин — детские площадки, сад и зона для спорта.</p>
+  <p>Ипотека от 5,9%, рассрочка без переплаты до конца строительства, скидка 7% при полной оплате.</p>
+</body>
+</html>
+"""
+
+
+# Та же страница в windows-1251, кодировка объявлена только в <meta> (частый случай
+# для русскоязычных сайтов): быстрый HTTP-путь должен прочитать её без браузера
+FIXTURE_CP1251_PATH = "/cp1251/"
+# В windows-1251 нет «²»
+FIXTURE_CP1251_HTML = FIXTURE_HTML.replace(
+    "<head>", '<head>\n  <meta charset="windows-1251">', 1
+).replace("м²", "кв. м")
+FIXTURE_TITLE = "ЖК «Парковый» — квартиры от застройщика"
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    """Одна и та же статическая страница на любой путь (/cp1251/... — в windows-1251)"""
+
+    body = FIXTURE_HTML.encode("utf-8")
+    body_cp1251 = FIXTURE_CP1251_HTML.encode("cp1251")
+
+    def do_GET(self):
+        if self.path.startswith(FIXTURE_CP1251_PATH):
+            body, content_type = self.body_cp1251, "text/html"
+        else:
+            body, content_type = self.body, "text/html; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """Локальный сайт для /parse_demo"""
+
+    def __init__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class AppServer:
+    """Приложение на uvicorn в отдельном потоке со своим event loop"""
+
+    def __init__(self):
+        import uvicorn
+        from backend.main import app
+
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        port = self._server.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    def start(self):
+        self._thread.start()
+        while not self._server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("Не удалось запустить приложение")
+            time.sleep(0.05)
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=30)
+
+
+def make_floor_plans(count: int) -> List[bytes]:
+    """Простые «планировки» PNG, отличающиеся одним пикселем (чтобы не совпадал кэш-ключ)"""
+    from PIL import Image, ImageDraw
+
+    base = Image.new("RGB", (1200, 900), "white")
+    draw = ImageDraw.Draw(base)
+    draw.rectangle((60, 60, 1140, 840), outline="black", width=8)
+    draw.line((600, 60, 600, 840), fill="black", width=6)
+    draw.line((60, 450, 600, 450), fill="black", width=6)
+    draw.line((600, 560, 1140, 560), fill="black", width=6)
+
+    plans = []
+    for index in range(count):
+        image = base.copy()
+        image.putpixel((index % 1000 + 100, 880), (index % 256, 0, 0))
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        plans.append(buffer.getvalue())
+    return plans
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), round(q * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+async def run_level(
+    request: Callable[[int], Awaitable[bool]],
+    total: int,
+    concurrency: int,
+    offset: int
+) -> dict:
+    """Прогнать total запросов не более чем по concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(index: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await request(offset + index)
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "mean_ms": ms(sum(latencies) / len(latencies)),
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1])
+    }
+
+
+def make_requests(client: httpx.AsyncClient, fixture_url: str, plans: List[bytes]) -> dict:
+    """Запрос сценария по номеру; True — успешный ответ"""
+
+    async def analyze_text(index: int) -> bool:
+        response = await client.post("/analyze_text", json={
+            "text": f"ЖК «Парковый»: квартиры у парка, рассрочка 0%, сдача в 2025 году. Предложение №{index}"
+        })
+        return response.status_code == 200 and response.json().get("success", False)
+
+    async def analyze_image(index: int) -> bool:
+        response = await client.post(
+            "/analyze_image",
+            files={"file": (f"plan-{index}.png", plans[index % len(plans)], "image/png")}
+        )
+        return response.status_code == 200 and response.json().get("success", False)
+
+    async def parse_demo(index: int) -> bool:
+        # Каждый второй запрос — страница в windows-1251 с кодировкой только в <meta>
+        path = f"{FIXTURE_CP1251_PATH}{index}" if index % 2 else f"/page/{index}"
+        response = await client.post("/parse_demo", json={"url": f"{fixture_url}{path}"})
+        if response.status_code != 200 or not response.json().get("success", False):
+            return False
+        # Кракозябры в заголовке — кодировка страницы определена неверно
+        return (response.json().get("data") or {}).get("title") == FIXTURE_TITLE
+
+    async def history(index: int) -> bool:
+        response = await client.get("/history")
+        return response.status_code == 200
+
+    return {
+        "analyze_text": analyze_text,
+        "analyze_image": analyze_image,
+        "parse_demo": parse_demo,
+        "history": history
+    }
+
+
+def git_revision() -> dict:
+    def git(*args) -> Optional[str]:
+        try:
+            return subprocess.run(
+                ["git", *args], capture_output=True, text=True, timeout=10, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "-uno"))}
+
+
+async def run_benchmark(args, app_url: str, fixture_url: str) -> List[dict]:
+    plans = make_floor_plans(max(args.requests, 1))
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+    results = []
+    async with httpx.AsyncClient(base_url=app_url, timeout=120.0, limits=limits) as client:
+        requests = make_requests(client, fixture_url, plans)
+        offset = 0
+        for scenario in args.scenarios:
+            # Прогрев: первый запрос запускает процессы обработки изображений и соединения
+            await requests[scenario](10 ** 6)
+            for concurrency in args.concurrency:
+                level = await run_level(requests[scenario], args.requests, concurrency, offset)
+                offset += args.requests
+                results.append({"scenario": scenario, **level})
+                print(
+                    f"{scenario:14} x{concurrency:<4} "
+                    f"p50 {level['p50_ms']:>8.1f}  p95 {level['p95_ms']:>8.1f}  p99 {level['p99_ms']:>8.1f} мс  "
+                    f"{level['throughput_rps']:>7.1f} запр/с  ошибок {level['errors']}"
+                )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Уровни параллельности")
+    parser.add_argument("--requests", type=int, default=64, help="Запросов на каждый уровень")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Медиана задержки заглушки LLM")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="Разброс задержки заглушки")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500 от заглушки")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429 от заглушки")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench-e2e.json", help="Куда сохранить результаты (JSON)")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="buildintel-bench-")
+    # Настройки читаются при импорте backend, поэтому задаём их до него
+    os.environ.update({
+        "LLM_PROVIDER": "stub",
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "stub-key",
+        "STUB_LATENCY_MS": str(args.latency_ms),
+        "STUB_LATENCY_SIGMA": str(args.latency_sigma),
+        "STUB_ERROR_RATE": str(args.error_rate),
+        "STUB_RATE_LIMIT_RATE": str(args.rate_limit_rate),
+        "STUB_SEED": str(args.seed),
+        "CACHE_ENABLED": "false",
+        "CACHE_DIR": os.path.join(workdir.name, "cache"),
+        "SCREENSHOT_STORE_DIR": os.path.join(workdir.name, "screenshots"),
+        "HISTORY_FILE": os.path.join(workdir.name, "history.json"),
+        "HISTORY_DB_FILE": os.path.join(workdir.name, "history.db"),
+        "BROWSER_POOL_PREWARM": "false",
+        "METRICS_ENABLED": "true"
+    })
+
+    fixture = FixtureServer()
+    fixture.start()
+    app_server = AppServer()
+    app_server.start()
+    try:
+        results = asyncio.run(run_benchmark(args, app_server.base_url, fixture.base_url))
+    finally:
+        app_server.stop()
+        fixture.stop()
+        workdir.cleanup()
+
+    artifact = {
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "stub": {
+                "latency_ms": args.latency_ms,
+                "latency_sigma": args.latency_sigma,
+                "error_rate": args.error_rate,
+                "rate_limit_rate": args.rate_limit_rate,
+                "seed": args.seed
+            },
+            "requests_per_level": args.requests
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
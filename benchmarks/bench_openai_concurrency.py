@@ -0,0 +1,302 @@
+"""
+Бенчмарк конкурентных запросов к OpenAI: синхронный клиент против общего асинхронного
+
+Поднимает локальную заглушку /v1/chat/completions с фиксированной задержкой и прогоняет
+одинаковое число одновременных анализов двумя способами:
+- "before": синхронный OpenAI клиент внутри async-обработчика (как было раньше) —
+  каждый вызов блокирует event loop, запросы выполняются строго по очереди;
+- "after": OpenAIService на AsyncOpenAI с общим пулом соединений.
+
+Помимо пропускной способности измеряется максимальная задержка event loop —
+именно она определяет, насколько "зависают" /health, /history и остальные запросы.
+
+Запуск:
+    python -m benchmarks.bench_openai_concurrency --requests 50 --concurrency 25 --latency 0.2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+
+# Заглушке не нужен настоящий ключ, а сервис должен ходить в локальный endpoint
+os.environ.setdefault("OPENAI_API_KEY", "stub-key")
+
+from openai import OpenAI  # noqa: E402
+
+from backend.config import settings  # noqa: E402
+
+
+STUB_ANALYSIS = {
+    "strengths": ["Конкретные сроки сдачи", "Гарантия 5 лет", "Развитая инфраструктура"],
+    "weaknesses": ["Нет цен", "Мало социального доказательства", "Слабый CTA"],
+    "unique_offers": ["Рассрочка 0%", "Отделка премиум-класса", "Рядом метро"],
+    "recommendations": ["Добавить цены", "Добавить отзывы", "Усилить призыв к действию"],
+    "summary": "Текст убедительный, но не хватает конкретики по цене"
+}
+
+
+class StubOpenAIServer:
+    """Минимальный HTTP/1.1 сервер с keep-alive, отвечающий как /v1/chat/completions"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.port = None
+        self.requests_served = 0
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    async def _shutdown(self):
+        self._server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _run(self):
+        # Сервер живёт в своём потоке со своим event loop, чтобы блокирующий
+        # клиент в основном потоке не мешал ему отвечать
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                payload = {}
+                if length:
+                    try:
+                        payload = json.loads(await reader.readexactly(length))
+                    except json.JSONDecodeError:
+                        payload = {}
+
+                if payload.get("stream"):
+                    await self._stream(writer)
+                    continue
+
+                await asyncio.sleep(self.latency)
+                self.requests_served += 1
+
+                body = json.dumps({
+                    "id": f"chatcmpl-stub-{self.requests_served}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "stub",
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": json.dumps(STUB_ANALYSIS, ensure_ascii=False)}
+                    }],
+                    "usage": {"prompt_tokens": 600, "completion_tokens": 200, "total_tokens": 800}
+                }, ensure_ascii=False).encode("utf-8")
+
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    b"Connection: keep-alive\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii")
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def _stream(self, writer: asyncio.StreamWriter, chunks: int = 40):
+        """Ответ stream=true: тот же JSON, равномерно порезанный на SSE-чанки за latency"""
+        content = json.dumps(STUB_ANALYSIS, ensure_ascii=False)
+        step = max(1, len(content) // chunks)
+        pieces = [content[i:i + step] for i in range(0, len(content), step)]
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Connection: keep-alive\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+
+        def send(data: str):
+            event = f"data: {data}\n\n".encode("utf-8")
+            writer.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+
+        for piece in pieces:
+            await asyncio.sleep(self.latency / len(pieces))
+            send(json.dumps({
+                "id": f"chatcmpl-stub-{self.requests_served}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "stub",
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": piece}}]
+            }, ensure_ascii=False))
+            await writer.drain()
+        send("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        self.requests_served += 1
+
+
+class LoopLagMonitor:
+    """Измеряет максимальную задержку срабатывания таймера в event loop"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.max_lag = 0.0
+        self._loop = None
+        self._task = None
+        self._expected = None
+
+    async def _run(self):
+        while True:
+            self._expected = self._loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._observe()
+
+    def _observe(self):
+        if self._expected is not None:
+            self.max_lag = max(self.max_lag, self._loop.time() - self._expected)
+
+    def __enter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._expected = self._loop.time() + self.interval
+        self._task = self._loop.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        # Таймер мог так и не сработать, если loop был заблокирован до самого конца
+        self._observe()
+        self._task.cancel()
+
+
+async def _run_concurrently(handler, total: int, concurrency: int) -> float:
+    """Прогнать total вызовов handler не более чем по concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return time.perf_counter() - started
+
+
+async def bench_before(base_url: str, total: int, concurrency: int) -> dict:
+    """Старый путь: синхронный клиент внутри async-обработчика"""
+    client = OpenAI(api_key="stub-key", base_url=base_url)
+
+    async def handler():
+        client.chat.completions.create(
+            model=settings.openai_model,
+            messages=[{"role": "user", "content": "Текст для анализа"}],
+            max_tokens=2500
+        )
+
+    # Прогрев соединения
+    await handler()
+    with LoopLagMonitor() as monitor:
+        await asyncio.sleep(0)
+        elapsed = await _run_concurrently(handler, total, concurrency)
+    client.close()
+    return {"elapsed_s": elapsed, "throughput_rps": total / elapsed, "max_loop_lag_ms": monitor.max_lag * 1000}
+
+
+async def bench_after(base_url: str, total: int, concurrency: int) -> dict:
+    """Новый путь: OpenAIService на общем асинхронном клиенте"""
+    settings.openai_base_url = base_url
+    # Иначе после прогрева все ответы приходили бы из кэша анализа (и он писался бы
+    # в рабочий каталог): сравниваем транспорт, а не кэш
+    settings.cache_enabled = False
+    from backend.services.openai_service import OpenAIService
+    service = OpenAIService()
+    service.cache.enabled = False
+    counter = itertools.count()
+
+    async def handler():
+        # Разные тексты, чтобы запросы не объединялись и не попадали в кэш
+        await service.analyze_text(f"Жилой комплекс с гарантией 5 лет и рассрочкой 0%. Предложение №{next(counter)}")
+
+    await handler()
+    with LoopLagMonitor() as monitor:
+        await asyncio.sleep(0)
+        elapsed = await _run_concurrently(handler, total, concurrency)
+    await service.aclose()
+    return {"elapsed_s": elapsed, "throughput_rps": total / elapsed, "max_loop_lag_ms": monitor.max_lag * 1000}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="Всего запросов в каждом прогоне")
+    parser.add_argument("--concurrency", type=int, default=25, help="Одновременных запросов")
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка ответа заглушки, секунды")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON файл")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(latency=args.latency)
+    server.start()
+    try:
+        before = await bench_before(server.base_url, args.requests, args.concurrency)
+        after = await bench_after(server.base_url, args.requests, args.concurrency)
+    finally:
+        server.stop()
+
+    results = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "stub_latency_s": args.latency,
+        "before": before,
+        "after": after,
+        "speedup": after["throughput_rps"] / before["throughput_rps"]
+    }
+
+    print(f"Запросов: {args.requests}, одновременно: {args.concurrency}, задержка заглушки: {args.latency}s")
+    print(f"{'':8} {'время, с':>10} {'запр/с':>10} {'лаг loop, мс':>14}")
+    for name in ("before", "after"):
+        r = results[name]
+        print(f"{name:8} {r['elapsed_s']:>10.2f} {r['throughput_rps']:>10.1f} {r['max_loop_lag_ms']:>14.1f}")
+    print(f"Ускорение: x{results['speedup']:.1f}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+Сравнение двух прогонов benchmarks/bench_e2e.py
+
+Для каждой пары (сценарий, параллельность) выводит p50/p95/p99 и пропускную способность
+базового и нового прогона с изменением в процентах. Регрессия — рост p95 или падение
+пропускной способности больше порога; с --fail-on-regression код возврата будет 1.
+
+Запуск:
+    python -m benchmarks.compare bench-base.json bench-e2e.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Optional
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def change(base: Optional[float], new: Optional[float]) -> Optional[float]:
+    """Изменение в процентах"""
+    if base is None or new is None or base == 0:
+        return None
+    return (new - base) / base * 100
+
+
+def format_change(value: Optional[float]) -> str:
+    return "     —" if value is None else f"{value:+6.1f}%"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", help="Базовый прогон (JSON)")
+    parser.add_argument("new", help="Новый прогон (JSON)")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Порог регрессии, %%")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Код возврата 1 при регрессии")
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    print(f"База:  {base['meta'].get('commit')} ({base['meta'].get('timestamp')})")
+    print(f"Новый: {new['meta'].get('commit')} ({new['meta'].get('timestamp')})")
+    if base["meta"].get("stub") != new["meta"].get("stub"):
+        print("Внимание: параметры заглушки LLM различаются, сравнение может быть некорректным")
+
+    base_results = {(r["scenario"], r["concurrency"]): r for r in base["results"]}
+    regressions = []
+    print(f"\n{'сценарий':14} {'x':>4} {'p50, мс':>18} {'p95, мс':>18} {'p99, мс':>18} {'запр/с':>18}")
+    for result in new["results"]:
+        key = (result["scenario"], result["concurrency"])
+        old = base_results.get(key)
+        if old is None:
+            continue
+        cells = []
+        for field in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            cells.append(f"{result[field]:>10.1f} {format_change(change(old[field], result[field]))}")
+        print(f"{key[0]:14} {key[1]:>4} " + " ".join(cells))
+
+        p95_change = change(old["p95_ms"], result["p95_ms"])
+        throughput_change = change(old["throughput_rps"], result["throughput_rps"])
+        if (p95_change is not None and p95_change > args.threshold) or (
+            throughput_change is not None and throughput_change < -args.threshold
+        ):
+            regressions.append(key)
+        if result["errors"] > old["errors"]:
+            print(f"{'':19} ошибок: {old['errors']} → {result['errors']}")
+
+    if regressions:
+        print(f"\nРегрессии (порог {args.threshold:.0f}%): " + ", ".join(f"{s} x{c}" for s, c in regressions))
+        return 1 if args.fail_on_regression else 0
+    print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
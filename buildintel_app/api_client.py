@@ -3,15 +3,52 @@
 """
 import requests
 import base64
+import json
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List
 
 
 class APIClient:
     """Клиент для взаимодействия с FastAPI бэкендом"""
     
+    # Опрос фоновых задачи: интервал и общее время ожидания результата
+    JOB_POLL_INTERVAL = 1.0
+    JOB_MAX_WAIT = 300
+    
+    # Сколько готовы ждать синхронный анализ. Сервер получает бюджет меньше на
+    # RESPONSE_MARGIN (заголовок X-Request-Timeout) и успевает вернуть частичный
+    # результат или ошибку раньше, чем сработает таймаут клиента
+    REQUEST_TIMEOUT = 60
+    RESPONSE_MARGIN = 5
+    
+    def _deadline_headers(self, seconds: float) -> Dict[str, str]:
+        """Бюджет времени запроса для сервера"""
+        return {"X-Request-Timeout": str(max(1, seconds - self.RESPONSE_MARGIN))}
+    
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url
+    
+    def _wait_for_job(self, submit_response: requests.Response) -> Dict[str, Any]:
+        """Дождаться завершения фоновой задачи и вернуть её результат"""
+        job = submit_response.json()
+        deadline = time.monotonic() + self.JOB_MAX_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(self.JOB_POLL_INTERVAL)
+            response = requests.get(f"{self.base_url}{job['status_url']}", timeout=10)
+            response.raise_for_status()
+            status = response.json()
+            if status["status"] == "done":
+                return status["result"]
+            if status["status"] == "failed":
+                return {
+                    "success": False,
+                    "error": status.get("error") or "Ошибка выполнения задачи"
+                }
+        return {
+            "success": False,
+            "error": "Превышено время ожидания результата"
+        }
         
     def analyze_text(self, text: str) -> Dict[str, Any]:
         """Анализ текста"""
@@ -19,7 +56,8 @@ class APIClient:
             response = requests.post(
                 f"{self.base_url}/analyze_text",
                 json={"text": text},
-                timeout=60
+                headers=self._deadline_headers(self.REQUEST_TIMEOUT),
+                timeout=self.REQUEST_TIMEOUT
             )
             response.raise_for_status()
             return response.json()
@@ -34,13 +72,20 @@ class APIClient:
         try:
             with open(image_path, 'rb') as f:
                 files = {'file': (Path(image_path).name, f, 'image/jpeg')}
+                # Анализ идёт в фоне на сервере, соединение не держим открытым
                 response = requests.post(
-                    f"{self.base_url}/analyze_image",
+                    f"{self.base_url}/jobs/analyze_image",
                     files=files,
-                    timeout=120
+                    headers=self._deadline_headers(self.JOB_MAX_WAIT),
+                    timeout=60
                 )
+            if response.status_code == 503:
+                return {
+                    "success": False,
+                    "error": "Сервер перегружен, повторите запрос позже"
+                }
             response.raise_for_status()
-            return response.json()
+            return self._wait_for_job(response)
         except requests.exceptions.RequestException as e:
             return {
                 "success": False,
@@ -52,22 +97,46 @@ class APIClient:
                 "error": "Файл не найден"
             }
             
-    def parse_url(self, url: str) -> Dict[str, Any]:
-        """Парсинг URL"""
+    def parse_url(self, url: str, screenshot: bool = False) -> Dict[str, Any]:
+        """Парсинг URL (screenshot=True — через браузер со скриншотом)"""
         try:
+            # Парсинг идёт в фоне на сервере, соединение не держим открытым
             response = requests.post(
-                f"{self.base_url}/parse_demo",
-                json={"url": url},
-                timeout=120
+                f"{self.base_url}/jobs/parse",
+                json={"url": url, "screenshot": screenshot},
+                headers=self._deadline_headers(self.JOB_MAX_WAIT),
+                timeout=10
             )
+            if response.status_code == 503:
+                return {
+                    "success": False,
+                    "error": "Сервер перегружен, повторите запрос позже"
+                }
             response.raise_for_status()
-            return response.json()
+            return self._wait_for_job(response)
         except requests.exceptions.RequestException as e:
             return {
                 "success": False,
                 "error": f"Ошибка запроса: {str(e)}"
             }
             
+    def parse_batch(self, urls: List[str], screenshot: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Пакетный парсинг: результаты по каждому URL выдаются по мере готовности
+        
+        Последний элемент — сводка с type="summary".
+        """
+        with requests.post(
+            f"{self.base_url}/parse_batch",
+            json={"urls": urls, "screenshot": screenshot},
+            stream=True,
+            timeout=(10, 600)
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+            
     def get_history(self) -> Dict[str, Any]:
         """Получение истории"""
         try:
@@ -3,22 +3,32 @@
 """
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLineEdit, QPushButton, QLabel,
-    QScrollArea, QFrame, QMessageBox
+    QScrollArea, QFrame, QMessageBox, QCheckBox
 )
 from PyQt5.QtCore import QThread, pyqtSignal
 
+# Шаги, которые сервер пропускает, если не укладывается в бюджет времени запроса
+SKIPPED_STAGE_NAMES = {
+    "browser": "загрузка в браузере",
+    "page_load": "полная загрузка страницы",
+    "screenshot": "скриншот",
+    "vision": "анализ скриншота",
+    "analysis": "анализ моделью"
+}
+
 
 class ParseUrlThread(QThread):
     """Поток для парсинга URL"""
     finished = pyqtSignal(dict)
     
-    def __init__(self, api_client, url):
+    def __init__(self, api_client, url, screenshot=False):
         super().__init__()
         self.api_client = api_client
         self.url = url
+        self.screenshot = screenshot
         
     def run(self):
-        result = self.api_client.parse_url(self.url)
+        result = self.api_client.parse_url(self.url, screenshot=self.screenshot)
         self.finished.emit(result)
 
 
@@ -71,6 +81,11 @@ class ParseTab(QWidget):
         url_layout.addWidget(self.url_input)
         layout.addLayout(url_layout)
         
+        # Скриншот (как #screenshot-input в веб-интерфейсе): без него страница берётся по HTTP
+        self.screenshot_checkbox = QCheckBox("Сделать скриншот и визуальный анализ (медленнее, через браузер)")
+        self.screenshot_checkbox.setStyleSheet("color: #f1f5f9;")
+        layout.addWidget(self.screenshot_checkbox)
+        
         # Кнопка парсинга
         self.parse_btn = QPushButton("Парсить и проанализировать")
         self.parse_btn.setStyleSheet("""
@@ -127,7 +142,7 @@ class ParseTab(QWidget):
         self.parse_btn.setText("Парсю и анализирую...")
         
         # Запуск парсинга в отдельном потоке
-        self.thread = ParseUrlThread(self.api_client, url)
+        self.thread = ParseUrlThread(self.api_client, url, screenshot=self.screenshot_checkbox.isChecked())
         self.thread.finished.connect(self.on_parse_complete)
         self.thread.start()
         
@@ -174,6 +189,11 @@ class ParseTab(QWidget):
             
             self.results_layout.addWidget(url_frame)
             
+        # Частичный результат: сервер не успел выполнить все шаги за бюджет времени
+        if data.get("partial"):
+            skipped = ", ".join(SKIPPED_STAGE_NAMES.get(stage, stage) for stage in data.get("skipped", []))
+            self.add_info_item("Частичный результат", f"Не хватило времени, пропущено: {skipped}")
+            
         # Извлеченные данные
         if data.get("title"):
             self.add_info_item("Заголовок", data["title"])
@@ -188,7 +208,7 @@ class ParseTab(QWidget):
             self.add_info_item("Текст страницы", text)
             
         # Скриншот
-        if data.get("screenshot_base64"):
+        if data.get("screenshot_thumbnail") or data.get("screenshot_image") or data.get("screenshot_thumbnail_base64"):
             screenshot_label = QLabel("Скриншот страницы:")
             screenshot_label.setStyleSheet("color: #f1f5f9; font-weight: bold; margin-top: 12px;")
             self.results_layout.addWidget(screenshot_label)
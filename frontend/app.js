@@ -10,6 +10,15 @@ const state = {
     isLoading: false
 };
 
+// Шаги, которые сервер пропускает, если не укладывается в бюджет времени запроса
+const SKIPPED_STAGE_NAMES = {
+    browser: 'загрузка в браузере',
+    page_load: 'полная загрузка страницы',
+    screenshot: 'скриншот',
+    vision: 'анализ скриншота',
+    analysis: 'анализ моделью'
+};
+
 // === DOM Elements ===
 const elements = {
     // Navigation
@@ -30,6 +39,7 @@ const elements = {
     
     // Parse demo
     urlInput: document.getElementById('url-input'),
+    screenshotInput: document.getElementById('screenshot-input'),
     parseBtn: document.getElementById('parse-btn'),
     
     // History
@@ -69,11 +79,69 @@ const api = {
         return response.json();
     },
     
-    async parseDemo(url) {
+    /**
+     * POST-запрос с потоковым ответом (Server-Sent Events).
+     * onEvent вызывается для каждого события: delta, item, field, result, error.
+     */
+    async stream(path, options, onEvent) {
+        const response = await fetch(`${this.baseUrl}${path}`, { method: 'POST', ...options });
+        if (!response.ok) {
+            // Например, 413 — файл больше допустимого размера
+            let detail = null;
+            try {
+                detail = (await response.json()).detail;
+            } catch (e) {
+                // Тело ответа не JSON
+            }
+            onEvent({ type: 'error', error: typeof detail === 'string' ? detail : `Ошибка сервера (${response.status})` });
+            return;
+        }
+        if (!response.body) {
+            throw new Error('Streaming is not supported');
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // События разделены пустой строкой
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const data = block
+                    .split('\n')
+                    .filter(line => line.startsWith('data:'))
+                    .map(line => line.slice(5).trim())
+                    .join('\n');
+                if (data) onEvent(JSON.parse(data));
+            }
+        }
+    },
+    
+    analyzeTextStream(text, onEvent) {
+        return this.stream('/analyze_text/stream', {
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ text })
+        }, onEvent);
+    },
+    
+    analyzeImageStream(file, onEvent) {
+        const formData = new FormData();
+        formData.append('file', file);
+        return this.stream('/analyze_image/stream', { body: formData }, onEvent);
+    },
+    
+    async parseDemo(url, screenshot = false) {
         const response = await fetch(`${this.baseUrl}/parse_demo`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ url })
+            body: JSON.stringify({ url, screenshot })
         });
         return response.json();
     },
@@ -134,6 +202,11 @@ const ui = {
         elements.resultsSection.scrollIntoView({ behavior: 'smooth' });
     },
     
+    // Обновить результаты без прокрутки (при потоковой выдаче)
+    updateResults(html) {
+        elements.resultsContent.innerHTML = html;
+    },
+    
     hideResults() {
         elements.resultsSection.hidden = true;
     },
@@ -177,6 +250,7 @@ const ui = {
         const scorePercent = (analysis.visual_style_score / 10) * 100;
         
         return `
+            ${analysis.description ? `
             <div class="result-block">
                 <h3>
                     <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
@@ -188,7 +262,9 @@ const ui = {
                 </h3>
                 <p>${analysis.description}</p>
             </div>
+            ` : ''}
             
+            ${analysis.visual_style_score !== null ? `
             <div class="result-block">
                 <h3>
                     <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
@@ -202,19 +278,51 @@ const ui = {
                         <div class="score-fill" style="width: ${scorePercent}%"></div>
                     </div>
                 </div>
-                <p>${analysis.visual_style_analysis}</p>
+                <p>${analysis.visual_style_analysis || ''}</p>
             </div>
+            ` : ''}
             
             ${this.renderResultBlock('Анализ удобства планировки', analysis.marketing_insights, 'insights')}
             ${this.renderResultBlock('Сильные и слабые стороны, рекомендации', analysis.recommendations, 'recommendations')}
         `;
     },
     
+    renderPrepReport(report) {
+        if (!report) return '';
+        const stepLabels = {
+            original: 'отправлено без изменений',
+            orientation: 'поворот по EXIF',
+            autocrop: 'обрезка полей',
+            grayscale: 'оттенки серого',
+            resize: 'уменьшение',
+            reencode: `перекодирование в ${report.format.toUpperCase()}`
+        };
+        const steps = (report.steps || []).map(step => stepLabels[step] || step).join(', ');
+        
+        return `
+            <div class="parsed-content">
+                <div class="label">Подготовка изображения:</div>
+                <div class="value">${report.original_width}×${report.original_height} → ${report.prepared_width}×${report.prepared_height}, ${Math.round(report.original_bytes / 1024)} КБ → ${Math.round(report.prepared_bytes / 1024)} КБ за ${Math.round(report.elapsed_ms)} мс${steps ? ` (${steps})` : ''}</div>
+            </div>
+        `;
+    },
+    
     renderParsedContent(data) {
         const parsed = data;
+        // Скриншоты приходят ссылками на хранилище: миниатюра всегда, исходный PNG — по запросу.
+        // base64 — только если сервер не смог сохранить файл
+        const image = parsed.screenshot_thumbnail || parsed.screenshot_image;
+        let screenshotSrc = image ? `${api.baseUrl}${image.url}` : null;
+        if (!screenshotSrc && parsed.screenshot_base64) {
+            screenshotSrc = `data:image/png;base64,${parsed.screenshot_base64}`;
+        } else if (!screenshotSrc && parsed.screenshot_thumbnail_base64) {
+            screenshotSrc = `data:image/jpeg;base64,${parsed.screenshot_thumbnail_base64}`;
+        }
+        const fullUrl = parsed.screenshot_image ? `${api.baseUrl}${parsed.screenshot_image.url}` : null;
+        const report = parsed.screenshot_report;
         
         return `
-            ${parsed.screenshot_base64 ? `
+            ${screenshotSrc ? `
                 <div class="result-block">
                     <h3>
                         <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
@@ -225,9 +333,12 @@ const ui = {
                         Скриншот страницы
                     </h3>
                     <div style="text-align: center; margin-top: 16px;">
-                        <img src="data:image/png;base64,${parsed.screenshot_base64}" 
+                        <img src="${screenshotSrc}" 
                              alt="Screenshot" 
-                             style="max-width: 100%; border-radius: 8px; border: 1px solid var(--border-color);" />
+                             ${image ? `width="${image.width}" height="${image.height}"` : ''}
+                             loading="lazy"
+                             style="max-width: 100%; height: auto; border-radius: 8px; border: 1px solid var(--border-color);" />
+                        ${fullUrl ? `<p><a href="${fullUrl}" target="_blank" rel="noopener">Открыть в исходном разрешении</a></p>` : ''}
                     </div>
                 </div>
             ` : ''}
@@ -236,6 +347,21 @@ const ui = {
                 <div class="label">URL:</div>
                 <div class="value">${parsed.url}</div>
                 
+                ${parsed.partial ? `
+                    <div class="label">Частичный результат:</div>
+                    <div class="value">Не хватило времени, пропущено: ${(parsed.skipped || []).map(stage => SKIPPED_STAGE_NAMES[stage] || stage).join(', ')}</div>
+                ` : ''}
+                
+                ${parsed.fetch_method ? `
+                    <div class="label">Способ загрузки:</div>
+                    <div class="value">${parsed.fetch_method === 'http' ? 'HTTP (без браузера)' : 'Браузер (Selenium)'}</div>
+                ` : ''}
+                
+                ${report ? `
+                    <div class="label">Скриншот для модели:</div>
+                    <div class="value">${report.original_width}×${report.original_height} → ${report.prepared_width}×${report.prepared_height} ${report.format.toUpperCase()}, ${Math.round(report.original_bytes / 1024)} КБ → ${Math.round(report.prepared_bytes / 1024)} КБ, ~${report.prepared_tokens} токенов (сэкономлено ~${report.tokens_saved})</div>
+                ` : ''}
+                
                 <div class="label">Title:</div>
                 <div class="value">${parsed.title || 'Не найден'}</div>
                 
@@ -365,13 +491,12 @@ const handlers = {
         ui.showLoading();
         
         try {
-            const result = await api.analyzeText(text);
-            
-            if (result.success && result.analysis) {
-                ui.showResults(ui.renderTextAnalysis(result.analysis));
-            } else {
-                ui.showError(result.error || 'Произошла ошибка при анализе');
-            }
+            // Пункты анализа показываются по мере генерации, итог заменяет частичный результат
+            const partial = { strengths: [], weaknesses: [], unique_offers: [], recommendations: [], summary: '' };
+            await api.analyzeTextStream(text, (event) => {
+                this.applyStreamEvent(partial, event, (analysis) => ui.renderTextAnalysis(analysis),
+                    'Произошла ошибка при анализе');
+            });
         } catch (error) {
             ui.showError('Ошибка соединения с сервером');
             console.error(error);
@@ -380,6 +505,32 @@ const handlers = {
         }
     },
     
+    // Обработка события потокового анализа
+    applyStreamEvent(partial, event, render, defaultError) {
+        let analysis = partial;
+        if (event.type === 'item' && Array.isArray(partial[event.field])) {
+            partial[event.field][event.index] = event.value;
+        } else if (event.type === 'field' && event.field in partial) {
+            partial[event.field] = event.value;
+        } else if (event.type === 'result') {
+            analysis = event.analysis;
+        } else if (event.type === 'error') {
+            ui.hideLoading();
+            ui.showError(event.error || defaultError);
+            return;
+        } else {
+            return;
+        }
+        
+        // Первое готовое событие — убираем оверлей и показываем результаты
+        if (state.isLoading) {
+            ui.hideLoading();
+            ui.showResults(render(analysis));
+        } else {
+            ui.updateResults(render(analysis));
+        }
+    },
+    
     // Image upload
     handleUploadClick() {
         elements.imageInput.click();
@@ -443,13 +594,20 @@ const handlers = {
         ui.showLoading();
         
         try {
-            const result = await api.analyzeImage(state.selectedImage);
-            
-            if (result.success && result.analysis) {
-                ui.showResults(ui.renderImageAnalysis(result.analysis));
-            } else {
-                ui.showError(result.error || 'Произошла ошибка при анализе планировки');
-            }
+            const partial = {
+                description: '', marketing_insights: [], visual_style_score: null,
+                visual_style_analysis: '', recommendations: []
+            };
+            let preprocessing = null;
+            await api.analyzeImageStream(state.selectedImage, (event) => {
+                if (event.type === 'preprocessing') {
+                    preprocessing = event.report;
+                    return;
+                }
+                this.applyStreamEvent(partial, event,
+                    (analysis) => ui.renderImageAnalysis(analysis) + ui.renderPrepReport(preprocessing),
+                    'Произошла ошибка при анализе планировки');
+            });
         } catch (error) {
             ui.showError('Ошибка соединения с сервером');
             console.error(error);
@@ -475,7 +633,7 @@ const handlers = {
         ui.showLoading();
         
         try {
-            const result = await api.parseDemo(url);
+            const result = await api.parseDemo(url, elements.screenshotInput.checked);
             
             if (result.success && result.data) {
                 ui.showResults(ui.renderParsedContent(result.data));